@@ -1,7 +1,15 @@
-from datetime import timedelta
-from typing import Annotated, Any, List
-
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, status
+from datetime import datetime, timedelta
+from typing import Annotated, Any, List, Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+    status,
+)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
@@ -12,9 +20,10 @@ from app.services.gcp_storage import gcp_storage
 from app.services.jobs_service import job_service
 from app.services.jwt_service import jwt_service
 from app.services.otp_service import otp_service
-from app.utils.constants import CHUNK_SIZE
+from app.utils.background_job import JobStatus
+from app.utils.constants import CHUNK_SIZE, DEFAULT_PAGE_SIZE, NEXT_CURSOR_HEADER
 from app.utils.global_logging import get_logger
-from app.utils.whatsapp import send_whatsapp_message
+from app.utils.whatsapp import async_whatsapp_client
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 settings = get_settings()
@@ -59,10 +68,12 @@ async def get_status():
 
 @router.post("/otp", status_code=201)
 async def post_otp(otp_req: OtpReq) -> str:
-    otp = otp_service.generate_otp_and_save(otp_req.phone_number)
+    otp = await otp_service.generate_otp_and_save(otp_req.phone_number)
     message = f"Your OTP is {otp}"
     # Send the OTP via SMS or any other method
-    s, err = send_whatsapp_message(f"{otp_req.phone_number}", message, settings)
+    s, err = await async_whatsapp_client.send_whatsapp_message(
+        f"{otp_req.phone_number}", message
+    )
     if s is False:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     else:
@@ -75,7 +86,7 @@ async def post_otp(otp_req: OtpReq) -> str:
 async def post_generate_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
-    is_valid = otp_service.verify_otp(form_data.username, form_data.password)
+    is_valid = await otp_service.verify_otp(form_data.username, form_data.password)
 
     if is_valid:
         jwt_token = jwt_service.create_token(
@@ -107,26 +118,46 @@ async def get_current_user(
     dependencies=[Depends(current_user)],
 )
 async def get_runs(
-    page_size: int = Query(1, ge=1, le=100),
+    response: Response,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=100),
+    cursor: Optional[str] = None,
+    job_status: Optional[JobStatus] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
 ):
-    """_summary_
+    """
+    List job summaries, newest first.
+
+    The cursor of the next page is returned in the X-Next-Cursor header,
+    which is missing on the last page.
 
     Args:
-        page_size (int, optional): size of the page. Defaults to Query(1, ge=1, le=100).
+        page_size (int, optional): size of the page. Defaults to Query(15, ge=1, le=100).
+        cursor (str, optional): X-Next-Cursor of the previous page.
+        job_status (JobStatus, optional): only jobs with this status.
+        since (datetime, optional): only jobs started at or after this time.
+        until (datetime, optional): only jobs started before this time.
 
     Raises:
-        HTTPException: Http server error
+        HTTPException: Bad request for an invalid cursor, http server error
 
     Returns:
         List: of Firestore documents
     """
     try:
-        return job_service.get_jobs(page_size)
+        jobs, next_cursor = await job_service.get_jobs(
+            page_size, cursor, job_status, since, until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Exception occur {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return jobs
 
 
 @router.post("/batch", name="Create Batch Job")
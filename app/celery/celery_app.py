@@ -1,6 +1,8 @@
 from celery import Celery
+from celery.signals import worker_init
 
 from app.config import get_settings
+from app.utils.startup_profile import startup_profile
 
 settings = get_settings()
 PROJECT_ID = settings.gcp_project_id
@@ -13,3 +15,10 @@ app = Celery(
     backend=f"gs://{RESULTS_BUCKET}/tasks?gcs_project={PROJECT_ID}&gcs_ttl=86400&gcs_threadpool_maxsize=20&firestore_project={FIRESTORE_PROJECT}",
 )
 app.autodiscover_tasks(["app.celery"])
+
+
+@worker_init.connect
+def stop_import_timing(**kwargs):
+    # Imports are only timed for the web server's startup report, and the
+    # worker's pool processes are forked after this
+    startup_profile.uninstall_import_timer()
@@ -27,9 +27,63 @@ class Settings(BaseSettings):
     whatsapp_api_token: str = Field(alias="WHATSAPP_API_TOKEN")
     whatsapp_phone_number_id: str = Field(alias="WHATSAPP_PHONE_NUMBER_ID")
     whatsapp_business_account_id: str = Field(alias="WHATSAPP_BUSINESS_ACCOUNT_ID")
+    whatsapp_http_pool_size: int = Field(default=20, alias="WHATSAPP_HTTP_POOL_SIZE")
+    whatsapp_http_timeout_seconds: float = Field(
+        default=10, alias="WHATSAPP_HTTP_TIMEOUT_SECONDS"
+    )
+    whatsapp_rate_limit_per_second: float = Field(
+        default=80, alias="WHATSAPP_RATE_LIMIT_PER_SECOND"
+    )
+    whatsapp_max_retries: int = Field(default=3, alias="WHATSAPP_MAX_RETRIES")
+    whatsapp_dispatch_queue_size: int = Field(
+        default=500, alias="WHATSAPP_DISPATCH_QUEUE_SIZE"
+    )
+    whatsapp_dispatch_workers: int = Field(
+        default=16, alias="WHATSAPP_DISPATCH_WORKERS"
+    )
 
     # OpenAI Settings
     openai_api_key: str = Field(alias="OPENAI_API_KEY")
+    # Concurrent OpenAI calls allowed per instance, by kind of traffic
+    openai_chat_concurrency: int = Field(default=16, alias="OPENAI_CHAT_CONCURRENCY")
+    openai_structured_concurrency: int = Field(
+        default=8, alias="OPENAI_STRUCTURED_CONCURRENCY"
+    )
+    openai_embedding_concurrency: int = Field(
+        default=4, alias="OPENAI_EMBEDDING_CONCURRENCY"
+    )
+
+    # Turn budget of the LLM tool loop
+    turn_max_iterations: int = Field(default=6, alias="TURN_MAX_ITERATIONS")
+    turn_deadline_seconds: float = Field(default=60, alias="TURN_DEADLINE_SECONDS")
+    turn_token_budget: int = Field(default=100000, alias="TURN_TOKEN_BUDGET")
+    tool_timeout_seconds: float = Field(default=30, alias="TOOL_TIMEOUT_SECONDS")
+    tool_executor_workers: int = Field(default=32, alias="TOOL_EXECUTOR_WORKERS")
+    chat_history_max_tokens: int = Field(default=18000, alias="CHAT_HISTORY_MAX_TOKENS")
+    # "document" or "messages", see app/services/chat_history_store.py
+    chat_history_storage: str = Field(default="document", alias="CHAT_HISTORY_STORAGE")
+    # Store "document" histories as a compressed "msgpack" or "json" blob
+    chat_history_codec: str = Field(default="", alias="CHAT_HISTORY_CODEC")
+    chat_history_message_ttl_seconds: int = Field(
+        default=86400, alias="CHAT_HISTORY_MESSAGE_TTL_SECONDS"
+    )
+    chat_history_cache_size: int = Field(default=1000, alias="CHAT_HISTORY_CACHE_SIZE")
+    chat_history_cache_ttl_seconds: float = Field(
+        default=240, alias="CHAT_HISTORY_CACHE_TTL_SECONDS"
+    )
+    chat_history_flush_delay_seconds: float = Field(
+        default=1, alias="CHAT_HISTORY_FLUSH_DELAY_SECONDS"
+    )
+    chat_summary_enabled: bool = Field(default=False, alias="CHAT_SUMMARY_ENABLED")
+    chat_summary_trigger_tokens: int = Field(
+        default=8000, alias="CHAT_SUMMARY_TRIGGER_TOKENS"
+    )
+    chat_summary_keep_tokens: int = Field(
+        default=3000, alias="CHAT_SUMMARY_KEEP_TOKENS"
+    )
+    chat_summary_timeout_seconds: float = Field(
+        default=30, alias="CHAT_SUMMARY_TIMEOUT_SECONDS"
+    )
 
     # Google Cloud Settings
     gcp_project_id: str = Field(alias="GCP_PROJECT_ID")
@@ -46,14 +100,45 @@ class Settings(BaseSettings):
     firestore_collection_processed_messages: str = Field(
         default="processed_messages", alias="FIRESTORE_COLLECTION_PROCESSED_MESSAGES"
     )
+    processed_messages_cache_size: int = Field(
+        default=10000, alias="PROCESSED_MESSAGES_CACHE_SIZE"
+    )
+    job_write_window_seconds: float = Field(default=2, alias="JOB_WRITE_WINDOW_SECONDS")
 
     # Pinecone Settings
     pinecone_api_key: str = Field(alias="PINECONE_API_KEY")
     pinecone_index_name: str = Field(alias="PINECONE_INDEX_NAME")
+    # Let every user match invoices indexed before owners were recorded,
+    # turn off once app.utils.backfill_invoice_owners has run
+    invoice_unowned_fallback: bool = Field(
+        default=True, alias="INVOICE_UNOWNED_FALLBACK"
+    )
+
+    # Message Queue Settings
+    message_queue_max_size: int = Field(default=1000, alias="MESSAGE_QUEUE_MAX_SIZE")
+    message_queue_workers: int = Field(default=8, alias="MESSAGE_QUEUE_WORKERS")
+    message_queue_max_conversations: int = Field(
+        default=500, alias="MESSAGE_QUEUE_MAX_CONVERSATIONS"
+    )
+    message_queue_mailbox_idle_seconds: float = Field(
+        default=300, alias="MESSAGE_QUEUE_MAILBOX_IDLE_SECONDS"
+    )
+    message_coalesce_window_ms: int = Field(
+        default=0, alias="MESSAGE_COALESCE_WINDOW_MS"
+    )
+
+    # Startup
+    startup_warm_up: bool = Field(default=True, alias="STARTUP_WARM_UP")
 
     # Temporary Files
     temp_file_path: str = Field(default="/tmp", alias="TEMP_FILE_PATH")
 
+    # Media Streaming
+    media_chunk_size: int = Field(default=8 * 1024 * 1024, alias="MEDIA_CHUNK_SIZE")
+    media_spool_max_bytes: int = Field(
+        default=16 * 1024 * 1024, alias="MEDIA_SPOOL_MAX_BYTES"
+    )
+
     # Jwt
     jwt_secret: str = Field(alias="JWT_SECRET_KEY")
     jwt_algo: str = Field(alias="JWT_ALGORITHM")
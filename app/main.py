@@ -5,9 +5,18 @@ This module initializes the FastAPI application and includes all the routes
 for the application. It serves as the entry point for the WhatsApp billing bot.
 """
 
+# Imported first so the startup profile times every import that follows
+from app.utils.startup_profile import startup_profile  # isort: skip
+
+import asyncio
+import functools
 import json
 import os
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import UTC, datetime
 from pathlib import Path
 
@@ -28,19 +37,37 @@ from jwt import ExpiredSignatureError
 from app.api.admin.admin import router as admin_router
 from app.config import Settings, get_settings
 from app.services.ai_service import analyze_text_with_openai, generate_bill_summary
+from app.services.chat_history_cache import chat_history_cache
 from app.services.firebase_chat_history import FirebaseChatHistory
-from app.services.llm_service import llm_service
-from app.services.processed_messages import check_message_status_and_save
+from app.services.history_compactor import history_compactor
+from app.services.intent_router import intent_router, message_text
+from app.services.message_queue import (
+    MessageQueue,
+    QueueFullError,
+    merge_text_messages,
+)
+from app.services.processed_messages import check_messages_status_and_save
+from app.services.turn_executor import TurnExecutor
 from app.utils.background_job import DocumentJob, process_document
+from app.utils.constants import NEXT_CURSOR_HEADER
 from app.utils.document_processor import extract_text_from_image
 from app.utils.global_logging import get_logger
-from app.utils.llm_tools import run_llm_tools
-from app.utils.types import LLMResponse  # Import the LLMResponse type
+from app.utils.lazy import warm_up
+from app.utils.llm_tools import delete_context
+from app.utils.metrics import (
+    CONTENT_TYPE,
+    collect_server_timing,
+    http_request_seconds,
+    registry,
+    server_timing_header,
+    turn_seconds,
+)
+from app.utils.outbound_dispatcher import outbound_dispatcher
 from app.utils.whatsapp import (
+    async_whatsapp_client,
     check_whatsapp_token,
     download_whatsapp_media,
     send_read_receipt,
-    send_typing_indicator,
     send_whatsapp_message,
 )
 
@@ -50,18 +77,128 @@ settings = get_settings()
 logger = get_logger(__name__)
 logger.info(f"Starting application with log level: {settings.log_level}")
 
-# Validate WhatsApp API token
-token_valid = check_whatsapp_token(settings)
-if not token_valid:
-    logger.warning(
-        "WhatsApp API token validation failed. Some functionality may not work."
+
+def warm_up_clients(stop: threading.Event):
+    """
+    Initialize the lazy service clients and validate the WhatsApp API token.
+
+    Runs in the background once the server is listening so none of this
+    network work delays the cold start. Setting stop ends it early on
+    shutdown, as the thread itself cannot be cancelled.
+    """
+    warm_up(stop)
+    if stop.is_set():
+        return
+    # Validate WhatsApp API token
+    token_valid = check_whatsapp_token(settings)
+    if not token_valid:
+        logger.warning(
+            "WhatsApp API token validation failed. Some functionality may not work."
+        )
+    logger.info(f"Startup profile: {json.dumps(startup_profile.report())}")
+
+
+# Fire-and-forget tasks, referenced until done so they are not garbage collected
+_background_tasks: set[asyncio.Future] = set()
+
+
+def _background_task_done(task: asyncio.Future):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task failed: {task.exception()}")
+
+
+def run_in_background(awaitable) -> asyncio.Future:
+    """Run an awaitable without waiting for it, logging its failure."""
+    task = asyncio.ensure_future(awaitable)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def discard_future(future: asyncio.Future | None):
+    """Cancel a future no longer needed, retrieving its error if it failed."""
+    if future is None or future.cancel() or future.cancelled():
+        return
+    future.exception()
+
+
+async def handle_queued_message(message):
+    """Entry point for message queue workers."""
+    started = time.perf_counter()
+    try:
+        return await process_whatsapp_message(message, settings)
+    finally:
+        turn_seconds.observe(
+            time.perf_counter() - started,
+            message_type=message.get("type", "unknown"),
+        )
+
+
+# Incoming WhatsApp messages are processed off the request path by these workers
+message_queue = MessageQueue(handle_queued_message)
+
+for stat, documentation in (
+    ("depth", "Messages waiting in the message queue"),
+    ("busy_workers", "Message queue workers handling a turn"),
+    ("active_conversations", "Conversations with pending or running turns"),
+):
+    registry.gauge(
+        f"message_queue_{stat}",
+        documentation,
+        function=lambda stat=stat: message_queue.stats()[stat],
     )
+registry.gauge(
+    "whatsapp_dispatch_queue_depth",
+    "Outbound WhatsApp sends waiting for a dispatcher thread",
+    function=lambda: outbound_dispatcher.stats()["depth"],
+)
+
+# Runs the blocking Firestore, Graph API and tool calls made while a message is
+# handled, so they never block the event loop
+blocking_executor = ThreadPoolExecutor(
+    max_workers=settings.message_queue_workers * 3, thread_name_prefix="blocking"
+)
+
+
+# Runs the LLM tool loop of text turns within their budget
+turn_executor = TurnExecutor(blocking_executor)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable in the blocking executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        blocking_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await message_queue.start()
+    startup_profile.mark_ready()
+    warm_up_task = None
+    warm_up_stop = threading.Event()
+    if settings.startup_warm_up:
+        warm_up_task = asyncio.create_task(
+            asyncio.to_thread(warm_up_clients, warm_up_stop)
+        )
+    yield
+    warm_up_stop.set()
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    await message_queue.stop()
+    # Write the chat histories still waiting for the write-behind flush
+    await asyncio.to_thread(chat_history_cache.close)
+    await async_whatsapp_client.aclose()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="WhatsApp Billing Bot API",
     description="API for WhatsApp billing automation with AI capabilities",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Get the project root directory (parent of app directory)
@@ -114,12 +251,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Add global exception handling middleware
 app.middleware("http")(global_exception_middleware)
 
 
+async def server_timing_middleware(request: Request, call_next):
+    """
+    Middleware recording request latency and adding a Server-Timing header
+    with the time spent in each external dependency.
+    """
+    started = time.perf_counter()
+    with collect_server_timing() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        elapsed,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+
+app.middleware("http")(server_timing_middleware)
+
+
 # Include admin router
 app.include_router(admin_router)
 
@@ -166,6 +327,54 @@ async def health_check(settings: Settings = Depends(get_settings)):
     }
 
 
+# Message queue stats endpoint
+@app.get("/health/queue")
+async def queue_stats():
+    """
+    Message queue stats used to size the worker pool and instances.
+
+    Returns:
+        dict: Queue depth, wait time and worker utilisation
+    """
+    return message_queue.stats()
+
+
+# Outbound dispatcher stats endpoint
+@app.get("/health/outbound")
+async def outbound_stats():
+    """
+    Outbound WhatsApp dispatcher stats.
+
+    Returns:
+        dict: Dispatch queue depth, retries and time spent throttled
+    """
+    return outbound_dispatcher.stats()
+
+
+# Prometheus metrics endpoint
+@app.get("/metrics")
+async def metrics():
+    """
+    Metrics in the Prometheus text exposition format.
+
+    Returns:
+        Response: Dependency latencies, turn durations and queue gauges
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
+# Startup profile endpoint
+@app.get("/health/startup")
+async def startup_stats():
+    """
+    Cold start profile of this instance.
+
+    Returns:
+        dict: Time to ready, slowest module imports and client init times
+    """
+    return startup_profile.report()
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -226,7 +435,6 @@ async def verify_whatsapp_webhook(
 @app.post("/webhook/whatsapp")
 async def whatsapp_webhook(
     request: Request,
-    background_tasks: BackgroundTasks,
     settings: Settings = Depends(get_settings),
 ):
     """
@@ -234,7 +442,7 @@ async def whatsapp_webhook(
 
     This endpoint:
     1. Verifies the WhatsApp message format
-    2. Processes incoming messages
+    2. Enqueues incoming messages for the message queue workers
     3. Returns appropriate response to WhatsApp
 
     Args:
@@ -282,11 +490,19 @@ async def whatsapp_webhook(
                 messages = value.get("messages", [])
 
                 for message in messages:
-                    # Process each message
-                    process_whatsapp_message(message, settings, background_tasks)
+                    # Enqueue each message, processing happens in the workers.
+                    # Dedup runs there too, see processed_messages
+                    message_queue.submit(message)
 
         return {"success": True}
 
+    except QueueFullError as e:
+        # Let WhatsApp retry the delivery once the backlog has drained
+        logger.error(f"Rejecting webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+        )
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         raise HTTPException(
@@ -295,12 +511,16 @@ async def whatsapp_webhook(
         )
 
 
-def process_whatsapp_message(
+async def process_whatsapp_message(
     message, settings, background_tasks: BackgroundTasks = None
 ):
     """
     Process an individual WhatsApp message.
 
+    Text messages and interactive replies are answered on the event loop, by
+    the intent router or by awaiting the LLM; other message types are handled
+    by process_media_message in the blocking executor.
+
     Args:
         message: The WhatsApp message object
         settings: Application settings
@@ -308,55 +528,120 @@ def process_whatsapp_message(
     Returns:
         None
     """
+    history_future = None
     try:
         # Extract message information
         message_id = message.get("id")
         message_type = message.get("type")
         sender_id = message.get("from")
+        # Text messages merged by the message queue carry the originals
+        received = message.get("coalesced", [message])
+        # Text and interactive replies are answered in the conversation
+        has_text = message_text(message) is not None
+
+        # Dedup and history load are independent network calls, run them
+        # concurrently
+        dedup_future = asyncio.ensure_future(
+            run_blocking(
+                check_messages_status_and_save, [m.get("id") for m in received]
+            )
+        )
+        history_future = (
+            asyncio.ensure_future(FirebaseChatHistory.aload(sender_id))
+            if has_text
+            else None
+        )
+
+        processed = await dedup_future
+        unprocessed = [m for m, done in zip(received, processed) if not done]
         # Check if message is already processed
-        if check_message_status_and_save(message_id):
+        if not unprocessed:
             logger.warning(f"Message {message_id} is already processed.")
             return
-        #  Send typing indicator
-        send_read_receipt(message_id)
-        send_typing_indicator(message_id)
-        chat_history = FirebaseChatHistory(sender_id)
+        # Duplicates were read before, only new messages get a read receipt
+        # with typing indicator
+        run_in_background(
+            run_blocking(send_read_receipt, message_id, typing_indicator=True)
+        )
         # Log the receipt of message
         logger.info(
             f"Processing message from {sender_id}, type: {message_type}, id: {message_id}"
         )
 
+        # Small talk and known interactive replies are answered without the
+        # LLM, retries of processed messages are not routed again
+        intent = (
+            intent_router.route(merge_text_messages(unprocessed)) if has_text else None
+        )
+        text_parts = [(message_text(m), m.get("id")) for m in unprocessed]
+
         # Handle different message types
-        if message_type == "text":
+        if intent is not None:
+            if intent.clear_context:
+                await run_blocking(delete_context.func, sender_id)
+            else:
+                # Recorded so that the next LLM turn knows what was answered
+                try:
+                    chat_history = await history_future
+                    chat_history.add_human_messages_as_turn(text_parts)
+                    chat_history.add_ai_message(intent.reply)
+                    await run_blocking(chat_history.commit)
+                except Exception as e:
+                    logger.error(f"Failed to record {intent.name} reply: {e}")
+            return await async_whatsapp_client.send_whatsapp_message(
+                sender_id, intent.reply
+            )
+        elif has_text:
             try:
-                text_data = message.get("text", {})
-                text_body = text_data.get("body", "")
-
-                logger.info(f"Received text message: {text_body}")
+                chat_history = await history_future
+                logger.info(f"Received {len(text_parts)} text message(s): {text_parts}")
 
-                chat_history.add_human_message(text_body, message_id)
+                chat_history.add_human_messages_as_turn(text_parts)
                 # TODO: update llm service to access chat history
-                # TODO: limit maximum iterations to avoid infinite loops
-                while True:
-                    resp: LLMResponse = llm_service.format_and_query(
-                        chat_history.messages
-                    )
+                result = await turn_executor.run(chat_history, sender_id)
 
-                    if resp["type"] == "tool_calls":
-                        chat_history.add_ai_message("", resp["tool_calls"])
-                        chat_history = run_llm_tools(
-                            resp["tool_calls"], chat_history, sender_id
-                        )
-                    elif resp["type"] == "message":
-                        chat_history.add_ai_message(resp["text"])
-                        break
-
-                logger.info(f"LLM response: {resp}")
-                chat_history.commit()
-                return send_whatsapp_message(sender_id, f"{resp['text']}", settings)
+                logger.info(f"LLM response: {result.text}")
+                await run_blocking(chat_history.commit)
+                response = await async_whatsapp_client.send_whatsapp_message(
+                    sender_id, result.text
+                )
+                # Compact after replying, still before the sender's next message
+                if settings.chat_summary_enabled and history_compactor.should_compact(
+                    chat_history
+                ):
+                    if await history_compactor.compact(chat_history):
+                        await run_blocking(chat_history.commit)
+                return response
             except Exception as e:
                 logger.error(f"Something went wrong: {e}")
-        elif message_type == "image":
+        else:
+            await run_blocking(
+                process_media_message, message, settings, background_tasks
+            )
+
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}")
+    finally:
+        # Duplicates and cleared conversations never await the history load
+        discard_future(history_future)
+
+
+def process_media_message(message, settings, background_tasks: BackgroundTasks = None):
+    """
+    Process a WhatsApp message that is not text. Blocking.
+
+    Args:
+        message: The WhatsApp message object
+        settings: Application settings
+
+    Returns:
+        None
+    """
+    try:
+        message_type = message.get("type")
+        sender_id = message.get("from")
+
+        if message_type == "image":
             # Extract image details
             image_data = message.get("image", {})
             image_id = image_data.get("id", "")
@@ -460,6 +745,9 @@ def process_whatsapp_message(
             if background_tasks:
                 logger.info("Adding to background task queue")
                 background_tasks.add_task(process_document, document_job)
+            else:
+                # Already running in a message queue worker
+                process_document(document_job)
 
         elif message_type == "audio":
             # TODO: Implement audio message handling
@@ -486,44 +774,6 @@ def process_whatsapp_message(
 
             # TODO: Process location data (e.g., find nearby merchants)
 
-        elif message_type == "button":
-            # TODO: Implement button response handling
-            button_data = message.get("button", {})
-            button_text = button_data.get("text", "")
-            logger.info(f"Received button response: {button_text}")
-
-            # TODO: Process button click based on button text
-
-        elif message_type == "interactive":
-            # TODO: Implement interactive message handling
-            interactive_data = message.get("interactive", {})
-            interactive_type = interactive_data.get("type", "")
-
-            if interactive_type == "button_reply":
-                button_reply = interactive_data.get("button_reply", {})
-                button_id = button_reply.get("id", "")
-                button_title = button_reply.get("title", "")
-                logger.info(
-                    f"Received interactive button reply: {button_title} (ID: {button_id})"
-                )
-
-                # TODO: Process button reply based on button ID
-
-            elif interactive_type == "list_reply":
-                list_reply = interactive_data.get("list_reply", {})
-                list_id = list_reply.get("id", "")
-                list_title = list_reply.get("title", "")
-                logger.info(
-                    f"Received interactive list reply: {list_title} (ID: {list_id})"
-                )
-
-                # TODO: Process list selection based on list ID
-
-            else:
-                logger.info(
-                    f"Received unsupported interactive message type: {interactive_type}"
-                )
-
         else:
             logger.info(f"Received unsupported message type: {message_type}")
 
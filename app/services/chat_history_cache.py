@@ -0,0 +1,513 @@
+"""
+Process-local write-behind cache of chat histories.
+
+Hot conversations are served from memory, so a turn costs no Firestore read,
+and commits are written behind by a flusher thread, so several commits of a
+turn become a single write. Writes are conditional on the update time of the
+document as it was read, which replaces the existence check before every
+write and stops a stale copy from overwriting a newer or deleted history.
+When another instance changed the history, the stored one is read again and
+the messages added to the stale copy are appended to it. Copies taken before
+such a merge are rebased onto it when they are committed. A write that fails
+for any other reason stays pending and is retried after a backoff.
+Histories are read and written through a ChatHistoryStore.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from app.config import get_settings
+from app.services.chat_history_store import (
+    SUMMARY_PREFIX,
+    ChatHistoryStore,
+    StoredHistory,
+    get_chat_history_store,
+)
+from app.services.db_service import MAX_WRITE_ATTEMPTS, DocumentChangedError
+from app.utils.global_logging import get_logger
+from app.utils.metrics import registry
+
+settings = get_settings()
+
+logger = get_logger(__name__)
+
+# Writes of a commit, the first one and the retries after merging
+MAX_FLUSH_ATTEMPTS = 3
+# Wait before retrying a failed write, doubled on every further failure
+FLUSH_RETRY_DELAY_SECONDS = 1.0
+
+cache_requests_total = registry.counter(
+    "chat_history_cache_requests_total",
+    "Chat history cache lookups by result",
+    ("result",),
+)
+flush_total = registry.counter(
+    "chat_history_flush_total",
+    "Chat history writes by outcome",
+    ("outcome",),
+)
+
+
+def _is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and message.content.startswith(
+        SUMMARY_PREFIX
+    )
+
+
+@dataclass
+class ConversationState:
+    messages: List[BaseMessage]
+    message_tokens: List[int]
+    # Identifies the loaded copy, commits of an older copy are rejected
+    generation: int = 0
+    # Update time of the stored document, None if it does not exist yet
+    update_time: Optional[datetime] = None
+    # IDs of the stored message documents, see ChatHistoryStore
+    message_ids: List[str] = field(default_factory=list)
+    # Messages as they were stored, the others were added since
+    base: List[BaseMessage] = field(default_factory=list)
+    # Messages of the cached history when this copy was taken
+    origin: List[BaseMessage] = field(default_factory=list)
+
+
+@dataclass
+class _Entry:
+    state: ConversationState
+    expires_at: float
+    # Cleared conversations are kept as tombstones to reject stale commits
+    cleared: bool = False
+    version: int = 0
+    flushed_version: int = 0
+    dirty_since: Optional[float] = None
+    # Failed writes of the pending commits and when they are tried again
+    failures: int = 0
+    retry_at: Optional[float] = None
+    # Generations replaced by a merge, their copies are rebased on commit
+    merged: Set[int] = field(default_factory=set)
+    write_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed_version
+
+
+class ChatHistoryCache:
+    """
+    LRU and TTL cache of chat histories with write-behind flushing.
+
+    Args:
+        store: Reads and writes the histories, by default the one selected by
+            CHAT_HISTORY_STORAGE
+        max_entries: Maximum number of cached conversations
+        ttl_seconds: Idle time after which a conversation is read again
+        flush_delay: Seconds a commit waits before it is written, 0 writes
+            every commit immediately
+    """
+
+    def __init__(
+        self,
+        store: Optional[ChatHistoryStore] = None,
+        max_entries: int = settings.chat_history_cache_size,
+        ttl_seconds: float = settings.chat_history_cache_ttl_seconds,
+        flush_delay: float = settings.chat_history_flush_delay_seconds,
+    ):
+        self.store = store or get_chat_history_store()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.flush_delay = flush_delay
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._generations = itertools.count(1)
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _new_entry(self, state: ConversationState, cleared: bool = False) -> _Entry:
+        return _Entry(
+            state=state, expires_at=time.monotonic() + self.ttl_seconds, cleared=cleared
+        )
+
+    @staticmethod
+    def _copy(state: ConversationState) -> ConversationState:
+        return ConversationState(
+            list(state.messages),
+            list(state.message_tokens),
+            state.generation,
+            state.update_time,
+            list(state.message_ids),
+            list(state.base),
+            list(state.messages),
+        )
+
+    def _live(self, user_id: str) -> Optional[_Entry]:
+        # Caller holds the lock
+        entry = self._entries.get(user_id)
+        if entry is None or entry.cleared:
+            return None
+        if entry.expires_at < time.monotonic() and not entry.dirty:
+            del self._entries[user_id]
+            return None
+        return entry
+
+    def _evict(self):
+        # Caller holds the lock. Dirty entries stay until they are flushed
+        if len(self._entries) <= self.max_entries:
+            return
+        for user_id in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if not self._entries[user_id].dirty:
+                del self._entries[user_id]
+
+    def _cached(self, user_id: str) -> Optional[ConversationState]:
+        with self._lock:
+            entry = self._live(user_id)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + self.ttl_seconds
+                self._entries.move_to_end(user_id)
+                cache_requests_total.inc(result="hit")
+                return self._copy(entry.state)
+        cache_requests_total.inc(result="miss")
+        return None
+
+    def _insert(self, user_id: str, stored: StoredHistory) -> ConversationState:
+        messages, message_tokens, update_time, message_ids = stored
+        with self._lock:
+            # Another load may have won the race, keep its copy
+            entry = self._live(user_id)
+            if entry is None:
+                state = ConversationState(
+                    messages,
+                    message_tokens,
+                    next(self._generations),
+                    update_time,
+                    message_ids,
+                    list(messages),
+                )
+                entry = self._new_entry(state)
+                self._entries[user_id] = entry
+                self._evict()
+            return self._copy(entry.state)
+
+    def get_or_load(self, user_id: str) -> ConversationState:
+        """
+        Return a copy of the cached history, reading it from the store on a miss.
+
+        Args:
+            user_id: WhatsApp ID of the user
+
+        Returns:
+            ConversationState: A copy the caller may change
+        """
+        state = self._cached(user_id)
+        if state is not None:
+            return state
+        return self._insert(user_id, self.store.load(user_id))
+
+    async def aget_or_load(self, user_id: str) -> ConversationState:
+        """Like get_or_load, but a miss awaits the store's aload."""
+        state = self._cached(user_id)
+        if state is not None:
+            return state
+        return self._insert(user_id, await self.store.aload(user_id))
+
+    def commit(self, user_id: str, state: ConversationState) -> bool:
+        """
+        Store a changed history, to be written behind.
+
+        Args:
+            user_id: WhatsApp ID of the user
+            state: The changed copy from get_or_load
+
+        Returns:
+            bool: False if the conversation was cleared or reloaded since the
+            copy was taken, in which case the changes are dropped
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            messages, message_tokens = state.messages, state.message_tokens
+            if entry is not None and entry.state.generation != state.generation:
+                if state.generation not in entry.merged:
+                    logger.warning(
+                        f"Chat history of {user_id} was cleared or reloaded, "
+                        "dropping the commit"
+                    )
+                    flush_total.inc(outcome="stale")
+                    return False
+                # Merged with another instance's changes since the copy was taken
+                messages, message_tokens = self._rebase_copy(entry.state, state)
+                flush_total.inc(outcome="rebased")
+            if entry is None:
+                # Evicted or expired while the turn ran, written from this copy
+                entry = self._new_entry(self._copy(state))
+                self._entries[user_id] = entry
+            entry.state.messages = list(messages)
+            entry.state.message_tokens = list(message_tokens)
+            entry.version += 1
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+            if entry.dirty_since is None:
+                entry.dirty_since = time.monotonic()
+            self._entries.move_to_end(user_id)
+            self._evict()
+
+            if self.flush_delay > 0:
+                self._start_flusher()
+                self._wake.notify()
+                return True
+
+        self._flush_entry(user_id)
+        return True
+
+    def delete(self, user_id: str):
+        """
+        Delete a chat history from the cache and Firestore.
+
+        A tombstone is kept so that commits of copies taken before the delete,
+        such as the turn that ran the delete_context tool, are dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None:
+            # Wait for a write in flight so it cannot land after the delete
+            entry.write_lock.acquire()
+        try:
+            with self._lock:
+                state = ConversationState([], [], next(self._generations))
+                self._entries[user_id] = self._new_entry(state, cleared=True)
+                self._entries.move_to_end(user_id)
+                self._evict()
+            self.store.delete(user_id)
+        finally:
+            if entry is not None:
+                entry.write_lock.release()
+
+    def _flush_entry(self, user_id: str):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None or entry.cleared:
+            return
+
+        with entry.write_lock:
+            with self._lock:
+                if self._entries.get(user_id) is not entry or not entry.dirty:
+                    return
+                version = entry.version
+                state = entry.state
+                snapshot = self._copy(entry.state)
+
+            written = snapshot
+            for attempt in range(MAX_FLUSH_ATTEMPTS):
+                try:
+                    new_update_time, message_ids = self.store.save(
+                        user_id,
+                        written.messages,
+                        written.message_tokens,
+                        written.update_time,
+                        written.message_ids,
+                    )
+                    break
+                except DocumentChangedError as e:
+                    error: Exception = e
+                    if attempt + 1 < MAX_FLUSH_ATTEMPTS:
+                        logger.warning(
+                            f"Chat history of {user_id} changed elsewhere, "
+                            f"merging: {e}"
+                        )
+                        flush_total.inc(outcome="merged")
+                        try:
+                            written = self._rebase(user_id, snapshot)
+                            continue
+                        except Exception as load_error:
+                            self._retry_later(user_id, entry, load_error)
+                            return
+                    logger.error(f"Not writing chat history of {user_id}: {error}")
+                    flush_total.inc(outcome="conflict")
+                    with self._lock:
+                        if self._entries.get(user_id) is entry:
+                            del self._entries[user_id]
+                    return
+                except Exception as e:
+                    self._retry_later(user_id, entry, e)
+                    return
+
+            flush_total.inc(outcome="ok")
+            with self._lock:
+                if written is not snapshot:
+                    # Commits made during the write are kept on top of the merge
+                    flushed = {id(message) for message in snapshot.messages}
+                    later = [
+                        (message, tokens)
+                        for message, tokens in zip(state.messages, state.message_tokens)
+                        if id(message) not in flushed
+                        and not isinstance(message, SystemMessage)
+                    ]
+                    entry.merged.add(state.generation)
+                    state.messages = written.messages + [m for m, _ in later]
+                    state.message_tokens = written.message_tokens + [
+                        t for _, t in later
+                    ]
+                    # Copies taken before the merge would overwrite it, their
+                    # commits are rebased instead
+                    state.generation = next(self._generations)
+                state.update_time = new_update_time
+                state.message_ids = message_ids
+                state.base = list(written.messages)
+                entry.flushed_version = version
+                entry.dirty_since = None if not entry.dirty else time.monotonic()
+                entry.failures = 0
+                entry.retry_at = None
+
+    def _retry_later(self, user_id: str, entry: _Entry, error: Exception):
+        """
+        Keep the commits of a failed write pending and schedule a retry.
+
+        The entry stays dirty, so commits made while the write was in flight
+        are written with it. It is dropped after MAX_WRITE_ATTEMPTS failures.
+        """
+        with self._lock:
+            if self._entries.get(user_id) is not entry:
+                return
+            entry.failures += 1
+            if entry.failures >= MAX_WRITE_ATTEMPTS:
+                logger.error(
+                    f"Dropped chat history of {user_id} after "
+                    f"{MAX_WRITE_ATTEMPTS} failed writes: {error}"
+                )
+                flush_total.inc(outcome="error")
+                del self._entries[user_id]
+                return
+            delay = FLUSH_RETRY_DELAY_SECONDS * 2 ** (entry.failures - 1)
+            logger.warning(
+                f"Failed to write chat history of {user_id}, "
+                f"retrying in {delay:.0f}s: {error}"
+            )
+            flush_total.inc(outcome="retry")
+            entry.retry_at = time.monotonic() + delay
+            self._start_flusher()
+            self._wake.notify()
+
+    @staticmethod
+    def _rebase_copy(
+        current: ConversationState, copy: ConversationState
+    ) -> Tuple[List[BaseMessage], List[int]]:
+        """
+        Apply the changes of a copy taken before a merge to the merged history.
+
+        Messages the copy dropped, e.g. by compaction, are dropped. The merge
+        read them back from the store, so they are matched by value. Messages
+        the copy added are appended, and a new summary replaces the current
+        one.
+        """
+        in_copy = {id(message) for message in copy.messages}
+        in_origin = {id(message) for message in copy.origin}
+        in_current = {id(message) for message in current.messages}
+        pairs = list(zip(current.messages, current.message_tokens))
+        for dropped in copy.origin:
+            if id(dropped) in in_copy:
+                continue
+            index = next(
+                (i for i, (m, _) in enumerate(pairs) if m is dropped or m == dropped),
+                None,
+            )
+            if index is not None:
+                del pairs[index]
+        for index, (message, tokens) in enumerate(
+            zip(copy.messages, copy.message_tokens)
+        ):
+            if id(message) in in_origin or id(message) in in_current:
+                continue
+            if index == 1 and _is_summary(message):
+                if len(pairs) > 1 and _is_summary(pairs[1][0]):
+                    pairs[1] = (message, tokens)
+                else:
+                    pairs.insert(1, (message, tokens))
+            elif not isinstance(message, SystemMessage):
+                pairs.append((message, tokens))
+        return [m for m, _ in pairs], [t for _, t in pairs]
+
+    def _rebase(self, user_id: str, snapshot: ConversationState) -> ConversationState:
+        """
+        Read the stored history and append the messages added to snapshot.
+
+        Summaries of the stale copy are dropped, the stored history has its own.
+        """
+        base = {id(message) for message in snapshot.base}
+        messages, message_tokens, update_time, message_ids = self.store.load(user_id)
+        stored = list(messages)
+        for message, tokens in zip(snapshot.messages, snapshot.message_tokens):
+            if id(message) not in base and not isinstance(message, SystemMessage):
+                messages.append(message)
+                message_tokens.append(tokens)
+        return ConversationState(
+            messages,
+            message_tokens,
+            snapshot.generation,
+            update_time,
+            message_ids,
+            stored,
+        )
+
+    def _due(self) -> Tuple[List[str], Optional[float]]:
+        # Caller holds the lock. Returns due entries and the wait for the next one
+        now = time.monotonic()
+        due = []
+        wait = None
+        for user_id, entry in self._entries.items():
+            if not entry.dirty or entry.dirty_since is None:
+                continue
+            if entry.retry_at is not None:
+                remaining = entry.retry_at - now
+            else:
+                remaining = entry.dirty_since + self.flush_delay - now
+            if remaining <= 0 or self._closed:
+                due.append(user_id)
+            elif wait is None or remaining < wait:
+                wait = remaining
+        return due, wait
+
+    def _start_flusher(self):
+        # Caller holds the lock
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="chat-history-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                due, wait = self._due()
+                while not due and not self._closed:
+                    self._wake.wait(wait)
+                    due, wait = self._due()
+                if not due and self._closed:
+                    return
+            for user_id in due:
+                self._flush_entry(user_id)
+
+    def flush(self):
+        """Write every pending commit now."""
+        with self._lock:
+            pending = [user_id for user_id, e in self._entries.items() if e.dirty]
+        for user_id in pending:
+            self._flush_entry(user_id)
+
+    def close(self):
+        """Stop the flusher thread after writing every pending commit."""
+        with self._lock:
+            self._closed = True
+            self._wake.notify_all()
+            flusher = self._flusher
+        if flusher is not None:
+            flusher.join()
+        self.flush()
+
+
+chat_history_cache = ChatHistoryCache()
@@ -0,0 +1,352 @@
+"""
+Storage layouts of chat histories in Firestore.
+
+"document" keeps the whole history as a messages array in one document per
+user, rewritten on every write, or as a compressed blob when
+CHAT_HISTORY_CODEC is set. "messages" stores every message as its own
+document in a messages subcollection of the user's document, which only keeps
+the sequence number of the first live message and the summary. A write then
+adds the new messages, deletes the trimmed ones and updates the user's
+document in one batch, and a load only reads the live tail.
+
+Both layouts read histories stored in the other one, so changing
+CHAT_HISTORY_STORAGE migrates each conversation on its next write.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from app.config import get_settings
+from app.services.db_service import (
+    AsyncFirestoreService,
+    BatchWrite,
+    FirestoreService,
+    async_db_service,
+    db_service,
+)
+from app.utils.helpers import (
+    HISTORY_SERIALIZERS,
+    decode_history,
+    encode_history,
+    get_ttl_key,
+    langchain_msg_to_dict,
+    list_to_langchain_msg,
+)
+from app.utils.lazy import LazySingleton
+from app.utils.prompt import system_prompt
+
+settings = get_settings()
+
+# Summaries of compacted turns are stored as the second system message
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+MESSAGES_SUBCOLLECTION = "messages"
+MESSAGES_FORMAT = "messages"
+# Fields of the user's document in the messages layout
+MESSAGES_LAYOUT_FIELDS = ("format", "head", "summary")
+
+# Messages, token counts, update time of the user's document and IDs of the
+# stored message documents
+StoredHistory = Tuple[List[BaseMessage], List[int], Optional[datetime], List[str]]
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    # Approximate counts are rounded up per message, so they add up to the
+    # count of the whole list
+    return count_tokens_approximately([message])
+
+
+def message_document_id(seq: int) -> str:
+    # Zero padded so that document IDs sort like sequence numbers
+    return f"{seq:016d}"
+
+
+class ChatHistoryStore(ABC):
+    """
+    Reads chat histories in either layout, subclasses define how they are written.
+
+    Args:
+        collection: Firestore collection of the chat histories
+        db: Firestore service
+        async_db: Firestore service of aload
+    """
+
+    def __init__(
+        self,
+        collection: str = settings.firestore_collection_chat_history,
+        db: FirestoreService | LazySingleton[FirestoreService] = db_service,
+        async_db: AsyncFirestoreService | LazySingleton[AsyncFirestoreService] = (
+            async_db_service
+        ),
+    ):
+        self.collection = collection
+        self.db = db
+        self.async_db = async_db
+
+    def _messages_path(self, user_id: str) -> Tuple[str, ...]:
+        return (self.collection, user_id, MESSAGES_SUBCOLLECTION)
+
+    def load(self, user_id: str) -> StoredHistory:
+        """
+        Read a chat history, starting with the system prompt if it is new.
+        """
+        doc_dict, update_time = self.db.read_with_update_time(self.collection, user_id)
+        tail = None
+        if doc_dict and doc_dict.get("format") == MESSAGES_FORMAT:
+            tail = self.db.read_subcollection(
+                self._messages_path(user_id), "seq", start_at=doc_dict.get("head")
+            )
+        return self._build(doc_dict, update_time, tail)
+
+    async def aload(self, user_id: str) -> StoredHistory:
+        """
+        Read a chat history like load, awaiting Firestore's AsyncClient.
+        """
+        doc_dict, update_time = await self.async_db.read_with_update_time(
+            self.collection, user_id
+        )
+        tail = None
+        if doc_dict and doc_dict.get("format") == MESSAGES_FORMAT:
+            tail = await self.async_db.read_subcollection(
+                self._messages_path(user_id), "seq", start_at=doc_dict.get("head")
+            )
+        return self._build(doc_dict, update_time, tail)
+
+    @staticmethod
+    def _build(
+        doc_dict: Optional[Dict],
+        update_time: Optional[datetime],
+        tail: Optional[List[Dict]],
+    ) -> StoredHistory:
+        # tail holds the message documents of a history in the messages layout
+        message_ids: List[str] = []
+        if tail is not None:
+            # A tail whose oldest messages expired may start with tool results
+            while tail and tail[0].get("type") != "human":
+                tail.pop(0)
+            message_ids = [message_document_id(msg["seq"]) for msg in tail]
+            leading = [system_prompt]
+            if doc_dict.get("summary"):
+                leading.append(
+                    SystemMessage(f"{SUMMARY_PREFIX}\n{doc_dict['summary']}")
+                )
+            stored = [{"type": "system", "text": msg.content} for msg in leading]
+            stored += tail
+        elif doc_dict and doc_dict.get("blob"):
+            stored = decode_history(doc_dict["blob"])
+        else:
+            stored = doc_dict.get("messages", []) if doc_dict else []
+
+        messages = list_to_langchain_msg(stored)
+        if len(messages) == 0:
+            messages.append(system_prompt)
+            stored = [{}]
+
+        # Counts are stored with the messages, older documents are counted once
+        tokens = [msg.get("tokens") for msg in stored]
+        if len(tokens) != len(messages):
+            tokens = [None] * len(messages)
+        tokens = [
+            count if count is not None else count_message_tokens(message)
+            for message, count in zip(messages, tokens)
+        ]
+
+        for message, msg_dict in zip(messages, stored):
+            if "seq" in msg_dict:
+                message.id = message_document_id(msg_dict["seq"])
+        return messages, tokens, update_time, message_ids
+
+    @abstractmethod
+    def save(
+        self,
+        user_id: str,
+        messages: List[BaseMessage],
+        message_tokens: List[int],
+        update_time: Optional[datetime],
+        message_ids: List[str],
+    ) -> Tuple[datetime, List[str]]:
+        """
+        Write a chat history if the stored one was not changed since update_time.
+
+        Args:
+            user_id: WhatsApp ID of the user
+            messages: All messages of the history
+            message_tokens: Token count of every message
+            update_time: Update time of the user's document when it was read,
+                None if it did not exist
+            message_ids: IDs of the stored message documents
+
+        Raises:
+            DocumentChangedError: If the stored history was changed or deleted
+
+        Returns:
+            Tuple[datetime, List[str]]: New update time and stored message IDs
+        """
+
+    def delete(self, user_id: str):
+        """Delete a chat history in either layout."""
+        self.db.delete(self.collection, user_id)
+        self.db.delete_subcollection(self._messages_path(user_id))
+
+    @staticmethod
+    def _to_dicts(messages: List[BaseMessage], message_tokens: List[int]) -> List[Dict]:
+        msg_dicts = langchain_msg_to_dict(messages)
+        for msg_dict, tokens in zip(msg_dicts, message_tokens):
+            msg_dict["tokens"] = tokens
+        return msg_dicts
+
+
+class DocumentChatHistoryStore(ChatHistoryStore):
+    """
+    Stores the whole history in the user's document.
+
+    Args:
+        codec: Serializer of encode_history to store a compressed blob
+            instead of the messages array, empty for the array
+    """
+
+    def __init__(
+        self,
+        collection: str = settings.firestore_collection_chat_history,
+        db: FirestoreService | LazySingleton[FirestoreService] = db_service,
+        async_db: AsyncFirestoreService | LazySingleton[AsyncFirestoreService] = (
+            async_db_service
+        ),
+        codec: str = settings.chat_history_codec,
+    ):
+        super().__init__(collection, db, async_db)
+        if codec and codec not in HISTORY_SERIALIZERS:
+            raise ValueError(f"Unsupported chat history codec: {codec}")
+        self.codec = codec
+
+    def save(self, user_id, messages, message_tokens, update_time, message_ids):
+        msg_dicts = self._to_dicts(messages, message_tokens)
+        if self.codec:
+            data = {"blob": encode_history(msg_dicts, self.codec)}
+        else:
+            data = {"messages": msg_dicts}
+        data |= get_ttl_key()
+        if update_time is None:
+            return self.db.create(self.collection, user_id, data), []
+
+        # Switching between the array, the blob and the messages layout drops
+        # the fields of the others, orphaned message documents expire
+        dropped = MESSAGES_LAYOUT_FIELDS + ("messages", "blob")
+        data |= {
+            field: firestore.DELETE_FIELD for field in dropped if field not in data
+        }
+        new_update_time = self.db.update_if_unchanged(
+            self.collection, user_id, data, update_time
+        )
+        return new_update_time, []
+
+
+class MessagesChatHistoryStore(ChatHistoryStore):
+    """
+    Appends every message as a document of the user's messages subcollection.
+
+    Args:
+        message_ttl_seconds: Expiry of message documents, a safety net for
+            messages orphaned when the user's document expires
+    """
+
+    def __init__(
+        self,
+        collection: str = settings.firestore_collection_chat_history,
+        db: FirestoreService | LazySingleton[FirestoreService] = db_service,
+        async_db: AsyncFirestoreService | LazySingleton[AsyncFirestoreService] = (
+            async_db_service
+        ),
+        message_ttl_seconds: int = settings.chat_history_message_ttl_seconds,
+    ):
+        super().__init__(collection, db, async_db)
+        self.message_ttl_seconds = message_ttl_seconds
+
+    def save(self, user_id, messages, message_tokens, update_time, message_ids):
+        stored_ids = set(message_ids)
+        # The system prompt is not stored and the summary is kept in the
+        # user's document
+        start = 0
+        while start < len(messages) and isinstance(messages[start], SystemMessage):
+            start += 1
+        summary = ""
+        if start > 1 and messages[1].content.startswith(SUMMARY_PREFIX):
+            summary = messages[1].content[len(SUMMARY_PREFIX) :].strip()
+
+        # Messages are only added at the end, anything after the first new
+        # message is written again
+        kept = start
+        while kept < len(messages) and messages[kept].id in stored_ids:
+            kept += 1
+        kept_ids = [message.id for message in messages[start:kept]]
+
+        # Sequence numbers start from the clock, so a new conversation always
+        # sorts after messages orphaned by an expired one
+        next_seq = time.time_ns() // 1000
+        if kept_ids:
+            next_seq = max(next_seq, int(kept_ids[-1]) + 1)
+        new_messages = messages[kept:]
+        new_dicts = self._to_dicts(new_messages, message_tokens[kept:])
+        new_ids = [message_document_id(next_seq + i) for i in range(len(new_dicts))]
+        ids = kept_ids + new_ids
+
+        path = self._messages_path(user_id)
+        message_ttl = get_ttl_key(self.message_ttl_seconds)
+        writes = [
+            BatchWrite(
+                "set", path + (doc_id,), msg_dict | {"seq": int(doc_id)} | message_ttl
+            )
+            for doc_id, msg_dict in zip(new_ids, new_dicts)
+        ]
+        kept_set = set(kept_ids)
+        writes += [
+            BatchWrite("delete", path + (doc_id,))
+            for doc_id in message_ids
+            if doc_id not in kept_set
+        ]
+
+        data = {
+            "format": MESSAGES_FORMAT,
+            "head": int(ids[0]) if ids else next_seq,
+            "summary": summary,
+        } | get_ttl_key()
+        if update_time is None:
+            writes.append(BatchWrite("create", (self.collection, user_id), data))
+        else:
+            # Migrates a history stored in the document layout
+            data["messages"] = firestore.DELETE_FIELD
+            data["blob"] = firestore.DELETE_FIELD
+            writes.append(
+                BatchWrite(
+                    "update",
+                    (self.collection, user_id),
+                    data,
+                    last_update_time=update_time,
+                )
+            )
+
+        new_update_time = self.db.commit_writes(writes)
+        for message, doc_id in zip(new_messages, new_ids):
+            message.id = doc_id
+        return new_update_time, ids
+
+
+STORES = {
+    "document": DocumentChatHistoryStore,
+    "messages": MessagesChatHistoryStore,
+}
+
+
+def get_chat_history_store(
+    storage: str = settings.chat_history_storage,
+) -> ChatHistoryStore:
+    """Create the store of a CHAT_HISTORY_STORAGE layout."""
+    if storage not in STORES:
+        raise ValueError(f"Unsupported chat history storage: {storage}")
+    return STORES[storage]()
@@ -1,13 +1,22 @@
+import copy
 import logging
+import threading
 import traceback
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import FieldFilter, Query
+from google.cloud.firestore_v1.field_path import FieldPath
 
 from app.config import get_settings
 from app.utils.constants import DEFAULT_PAGE_SIZE
-from app.utils.helpers import get_ttl_key
+from app.utils.helpers import decode_cursor, encode_cursor, get_ttl_key
+from app.utils.lazy import LazySingleton
+from app.utils.metrics import track_dependency
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +25,39 @@ DB_NAME = "whatsapp-chatbot"
 setting = get_settings()
 
 
+# Maximum number of writes in a Firestore batch
+MAX_BATCH_WRITES = 500
+# Flushes a CoalescingWriter tries a write in before it drops it
+MAX_WRITE_ATTEMPTS = 3
+
+_app_lock = threading.Lock()
+
+
+class DocumentChangedError(Exception):
+    """Raised when a conditional write finds the document changed or deleted."""
+
+
+@dataclass
+class BatchWrite:
+    # "create", "set", "update" or "delete"
+    op: str
+    # Document path segments, e.g. ("chat_history", user_id, "messages", id)
+    path: Tuple[str, ...]
+    data: Optional[Dict] = None
+    # Precondition of "update" and "delete" writes
+    last_update_time: Optional[datetime] = None
+
+
+def get_firebase_app(cred_path: str = None) -> firebase_admin.App:
+    """Return the default Firebase app, initializing it on first use."""
+    with _app_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(cred_path)
+            return firebase_admin.initialize_app(cred)
+
+
 class FirestoreService:
     def __init__(self, cred_path: str = None):
         self.db = None
@@ -24,9 +66,7 @@ class FirestoreService:
 
         try:
             logger.info("DB service initialization started")
-            cred = credentials.Certificate(cred_path)
-            firebase_admin.initialize_app(cred)
-            self.db_app = firebase_admin.get_app()
+            self.db_app = get_firebase_app(cred_path)
             self.db = firestore.client(app=self.db_app, database_id=DB_NAME)
             logger.info("DB service initialized successfully.")
         except Exception as e:
@@ -48,10 +88,12 @@ class FirestoreService:
     def write(self, collection: str, document_id: str, data: Dict):
         try:
             self._check_db_initialized("write to")
-            self.db.collection(collection).document(document_id).set(data)
+            with track_dependency("firestore", "write"):
+                result = self.db.collection(collection).document(document_id).set(data)
             logger.debug(
                 f"Successfully wrote document {document_id} to collection {collection}"
             )
+            return result.update_time
         except Exception as e:
             logger.error(f"Error writing to database: {str(e)}")
             logger.error(f"Traceback: {traceback.format_exc()}")
@@ -60,7 +102,8 @@ class FirestoreService:
     def read(self, collection: str, document_id: str) -> Any | None:
         try:
             self._check_db_initialized("read from")
-            doc = self.db.collection(collection).document(document_id).get()
+            with track_dependency("firestore", "read"):
+                doc = self.db.collection(collection).document(document_id).get()
             if doc.exists:
                 logger.debug(
                     f"Successfully read document {document_id} from collection {collection}"
@@ -73,30 +116,223 @@ class FirestoreService:
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise
 
-    def read_list(
+    def read_with_update_time(
+        self, collection: str, document_id: str
+    ) -> Tuple[Optional[Dict], Optional[datetime]]:
+        """
+        Read a document along with its update time, for conditional writes.
+
+        Returns:
+            Tuple[Optional[Dict], Optional[datetime]]: The document and its
+            update time, or (None, None) if it does not exist
+        """
+        try:
+            self._check_db_initialized("read from")
+            with track_dependency("firestore", "read"):
+                doc = self.db.collection(collection).document(document_id).get()
+            if doc.exists:
+                return doc.to_dict(), doc.update_time
+            return None, None
+        except Exception as e:
+            logger.error(f"Error reading from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def create(self, collection: str, document_id: str, data: Dict) -> datetime:
+        """
+        Create a document, failing if it already exists.
+
+        Raises:
+            DocumentChangedError: If the document already exists
+
+        Returns:
+            datetime: Update time of the new document
+        """
+        try:
+            self._check_db_initialized("write to")
+            with track_dependency("firestore", "write"):
+                result = (
+                    self.db.collection(collection).document(document_id).create(data)
+                )
+            return result.update_time
+        except AlreadyExists as e:
+            raise DocumentChangedError(
+                f"Document {document_id} already exists in {collection}"
+            ) from e
+        except Exception as e:
+            logger.error(f"Error writing to database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def update_if_unchanged(
         self,
         collection: str,
-        page: int,
+        document_id: str,
+        data: Dict,
+        last_update_time: datetime,
+    ) -> datetime:
+        """
+        Update fields of a document only if it was not written since last_update_time.
+
+        Raises:
+            DocumentChangedError: If the document was changed or deleted
+
+        Returns:
+            datetime: New update time of the document
+        """
+        try:
+            self._check_db_initialized("write to")
+            option = self.db.write_option(last_update_time=last_update_time)
+            with track_dependency("firestore", "write"):
+                result = (
+                    self.db.collection(collection)
+                    .document(document_id)
+                    .update(data, option=option)
+                )
+            return result.update_time
+        except (FailedPrecondition, NotFound) as e:
+            raise DocumentChangedError(
+                f"Document {document_id} in {collection} changed since it was read"
+            ) from e
+        except Exception as e:
+            logger.error(f"Error writing to database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def read_subcollection(
+        self,
+        path: Tuple[str, ...],
         order_by: str,
-        page_size: int = DEFAULT_PAGE_SIZE,
-    ) -> List[Any]:
+        start_at: Any = None,
+    ) -> List[Dict]:
+        """
+        Read the documents of a subcollection ordered by a field.
+
+        Args:
+            path: Path segments of the subcollection
+            order_by: Field to order by
+            start_at: Only read documents with order_by >= start_at
+
+        Returns:
+            List[Dict]: The documents
+        """
         try:
             self._check_db_initialized("read from")
-            if page < 1:
-                raise ValueError("Page must be >= 1")
-            offset = (page - 1) * page_size
-            docs = (
-                self.db.collection(collection)
-                .order_by(order_by)
-                .limit(page_size)
-                .offset(offset)
-                .stream()
-            )
-            result = [doc.to_dict() for doc in docs]
-            logger.debug(
-                f"Successfully read {len(result)} documents from collection {collection} (page {page})"
+            query = self.db.collection(*path)
+            if start_at is not None:
+                query = query.where(filter=FieldFilter(order_by, ">=", start_at))
+            with track_dependency("firestore", "query"):
+                return [doc.to_dict() for doc in query.order_by(order_by).stream()]
+        except Exception as e:
+            logger.error(f"Error reading list from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def _stage(self, writer, write: BatchWrite):
+        # Adds a write to a WriteBatch or BulkWriter, which share these methods
+        ref = self.db.document(*write.path)
+        option = (
+            self.db.write_option(last_update_time=write.last_update_time)
+            if write.last_update_time is not None
+            else None
+        )
+        if write.op == "create":
+            writer.create(ref, write.data)
+        elif write.op == "set":
+            writer.set(ref, write.data)
+        elif write.op == "update":
+            writer.update(ref, write.data, option=option)
+        elif write.op == "delete":
+            writer.delete(ref, option=option)
+        else:
+            raise ValueError(f"Unknown batch write {write.op}")
+
+    def commit_writes(self, writes: List[BatchWrite]) -> Optional[datetime]:
+        """
+        Commit writes in batches of MAX_BATCH_WRITES.
+
+        Each batch is atomic. Writes carrying a precondition should come last,
+        so that they are in the final batch.
+
+        Raises:
+            DocumentChangedError: If a precondition failed, a document to create
+                already exists or a document to update does not exist
+
+        Returns:
+            Optional[datetime]: Update time of the last write
+        """
+        try:
+            self._check_db_initialized("write to")
+            update_time = None
+            for start in range(0, len(writes), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for write in writes[start : start + MAX_BATCH_WRITES]:
+                    self._stage(batch, write)
+                with track_dependency("firestore", "batch_write"):
+                    results = batch.commit()
+                if results:
+                    update_time = results[-1].update_time
+            return update_time
+        except (AlreadyExists, FailedPrecondition, NotFound) as e:
+            raise DocumentChangedError(str(e)) from e
+        except Exception as e:
+            logger.error(f"Error writing to database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def bulk_write(self, writes: List[BatchWrite]):
+        """
+        Commit independent writes through a BulkWriter.
+
+        Unlike commit_writes the writes are not atomic, they are sent in
+        parallel batches and each is retried on its own, which suits many
+        writes to unrelated documents.
+        """
+        if not writes:
+            return
+        try:
+            self._check_db_initialized("write to")
+            bulk_writer = self.db.bulk_writer()
+            for write in writes:
+                self._stage(bulk_writer, write)
+            with track_dependency("firestore", "bulk_write"):
+                bulk_writer.close()
+        except Exception as e:
+            logger.error(f"Error writing to database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def delete_subcollection(self, path: Tuple[str, ...]):
+        """Delete every document of a subcollection."""
+        try:
+            self._check_db_initialized("delete from")
+            with track_dependency("firestore", "query"):
+                refs = list(self.db.collection(*path).list_documents())
+            self.bulk_write(
+                [BatchWrite("delete", tuple(ref.path.split("/"))) for ref in refs]
             )
-            return result
+        except Exception as e:
+            logger.error(f"Error deleting from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    def read_all(
+        self, collection: str, fields: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Read every document of a collection.
+
+        Args:
+            collection: Collection to read
+            fields: Field mask, only these fields are read
+        """
+        try:
+            self._check_db_initialized("read from")
+            query = self.db.collection(collection)
+            if fields is not None:
+                query = query.select(fields)
+            with track_dependency("firestore", "query"):
+                return [doc.to_dict() for doc in query.stream()]
         except Exception as e:
             logger.error(f"Error reading list from database: {str(e)}")
             logger.error(f"Traceback: {traceback.format_exc()}")
@@ -115,7 +351,8 @@ class FirestoreService:
     def delete(self, collection: str, document_id: str):
         try:
             self._check_db_initialized("delete from")
-            self.db.collection(collection).document(document_id).delete()
+            with track_dependency("firestore", "delete"):
+                self.db.collection(collection).document(document_id).delete()
             logger.debug(
                 f"Successfully deleted document {document_id} from collection {collection}"
             )
@@ -125,4 +362,331 @@ class FirestoreService:
             raise
 
 
-db_service = FirestoreService(setting.gcp_credentials_path)
+class AsyncFirestoreService:
+    """
+    FirestoreService on Firestore's AsyncClient, for use from the event loop.
+
+    Firestore calls are awaited instead of blocking the loop, so one instance
+    serves other requests while they are in flight.
+    """
+
+    def __init__(self, cred_path: str = None):
+        self.db = None
+        self.db_app = None
+        self.initialization_error = None
+
+        try:
+            logger.info("Async DB service initialization started")
+            self.db_app = get_firebase_app(cred_path)
+            self.db = firestore_async.client(app=self.db_app, database_id=DB_NAME)
+            logger.info("Async DB service initialized successfully.")
+        except Exception as e:
+            self.initialization_error = str(e)
+            logger.error(f"Failed to initialize async DB service: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+
+    def _check_db_initialized(self, operation: str) -> None:
+        """Check if database is initialized, raise RuntimeError if not."""
+        if self.db is None:
+            logger.error(
+                f"Cannot {operation} database: DB not initialized. "
+                f"Initialization error: {self.initialization_error}"
+            )
+            raise RuntimeError(
+                f"Firestore database is not initialized: {self.initialization_error}"
+            )
+
+    async def write(self, collection: str, document_id: str, data: Dict):
+        try:
+            self._check_db_initialized("write to")
+            with track_dependency("firestore", "write"):
+                result = (
+                    await self.db.collection(collection).document(document_id).set(data)
+                )
+            logger.debug(
+                f"Successfully wrote document {document_id} to collection {collection}"
+            )
+            return result.update_time
+        except Exception as e:
+            logger.error(f"Error writing to database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    async def write_with_ttl(
+        self,
+        collection: str,
+        document_id: str,
+        data: Dict,
+        ttl_seconds: Optional[int] = 300,
+    ):
+        _data = data | get_ttl_key(ttl_seconds=ttl_seconds)
+        return await self.write(collection, document_id, _data)
+
+    async def read(self, collection: str, document_id: str) -> Any | None:
+        doc_dict, _ = await self.read_with_update_time(collection, document_id)
+        return doc_dict
+
+    async def read_with_update_time(
+        self, collection: str, document_id: str
+    ) -> Tuple[Optional[Dict], Optional[datetime]]:
+        try:
+            self._check_db_initialized("read from")
+            with track_dependency("firestore", "read"):
+                doc = await self.db.collection(collection).document(document_id).get()
+            if doc.exists:
+                logger.debug(
+                    f"Successfully read document {document_id} from collection {collection}"
+                )
+                return doc.to_dict(), doc.update_time
+            logger.debug(f"Document {document_id} not found in collection {collection}")
+            return None, None
+        except Exception as e:
+            logger.error(f"Error reading from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    async def read_subcollection(
+        self,
+        path: Tuple[str, ...],
+        order_by: str,
+        start_at: Any = None,
+    ) -> List[Dict]:
+        try:
+            self._check_db_initialized("read from")
+            query = self.db.collection(*path)
+            if start_at is not None:
+                query = query.where(filter=FieldFilter(order_by, ">=", start_at))
+            with track_dependency("firestore", "query"):
+                return [
+                    doc.to_dict() async for doc in query.order_by(order_by).stream()
+                ]
+        except Exception as e:
+            logger.error(f"Error reading list from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    async def read_page(
+        self,
+        collection: str,
+        order_by: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        filters: List[Tuple[str, str, Any]] = (),
+        descending: bool = True,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Read a page of documents ordered by a field, newest first by default.
+
+        A page starts after the last document of the previous one instead of
+        at an offset, so it costs the same reads however deep it is.
+
+        Args:
+            collection: Collection to read
+            order_by: Field the documents are ordered by
+            page_size: Maximum number of documents
+            cursor: Token of the previous page, None for the first page
+            fields: Field mask, only these fields are read
+            filters: (field, operator, value) conditions, filtering one field
+                and ordering by another needs a composite index
+            descending: Order of the documents
+
+        Raises:
+            ValueError: If the cursor is invalid
+
+        Returns:
+            Tuple[List[Dict], Optional[str]]: The documents and the cursor of
+            the next page, None on the last page
+        """
+        start_after = decode_cursor(cursor) if cursor else None
+        try:
+            self._check_db_initialized("read from")
+            direction = Query.DESCENDING if descending else Query.ASCENDING
+            query = self.db.collection(collection)
+            for field, op, value in filters:
+                query = query.where(filter=FieldFilter(field, op, value))
+            # Ordered by ID as well, so documents of equal value are not skipped
+            query = query.order_by(order_by, direction=direction).order_by(
+                FieldPath.document_id(), direction=direction
+            )
+            if fields is not None:
+                query = query.select(list(dict.fromkeys([*fields, order_by])))
+            if start_after is not None:
+                value, document_id = start_after
+                query = query.start_after(
+                    {order_by: value, FieldPath.document_id(): document_id}
+                )
+            # One more document than requested tells if there is a next page
+            with track_dependency("firestore", "query"):
+                docs = [doc async for doc in query.limit(page_size + 1).stream()]
+
+            next_cursor = None
+            if len(docs) > page_size:
+                docs = docs[:page_size]
+                next_cursor = encode_cursor(docs[-1].get(order_by), docs[-1].id)
+            logger.debug(f"Successfully read {len(docs)} documents from {collection}")
+            return [doc.to_dict() for doc in docs], next_cursor
+        except Exception as e:
+            logger.error(f"Error reading list from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+    async def delete(self, collection: str, document_id: str):
+        try:
+            self._check_db_initialized("delete from")
+            with track_dependency("firestore", "delete"):
+                await self.db.collection(collection).document(document_id).delete()
+            logger.debug(
+                f"Successfully deleted document {document_id} from collection {collection}"
+            )
+        except Exception as e:
+            logger.error(f"Error deleting from database: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            raise
+
+
+db_service: LazySingleton[FirestoreService] = LazySingleton(
+    "firestore", lambda: FirestoreService(setting.gcp_credentials_path)
+)
+async_db_service: LazySingleton[AsyncFirestoreService] = LazySingleton(
+    "firestore_async", lambda: AsyncFirestoreService(setting.gcp_credentials_path)
+)
+
+
+def _merge_fields(pending: BatchWrite, fields: Dict) -> BatchWrite:
+    """Apply the update fields to a pending write, adding up ArrayUnions."""
+    for field, value in fields.items():
+        previous = pending.data.get(field)
+        if isinstance(value, firestore.ArrayUnion):
+            if isinstance(previous, firestore.ArrayUnion):
+                value = firestore.ArrayUnion(previous.values + value.values)
+            elif pending.op == "set" or isinstance(previous, list):
+                value = list(previous or []) + value.values
+        pending.data[field] = value
+    return pending
+
+
+class CoalescingWriter:
+    """
+    Merges writes to the same document and commits them together.
+
+    A write is held for up to window seconds. Later writes of the same
+    document replace it and later updates are merged into it, so a document
+    costs one write per window. Pending writes are committed in one batch
+    when the window ends, on flush() and, used as a context manager, on exit.
+    Failed flushes are logged and their writes are kept for the next flush,
+    merged with the writes made since, up to MAX_WRITE_ATTEMPTS flushes. The
+    writes are meant for progress that is not worth failing the caller for.
+
+    Args:
+        db: Firestore service
+        window: Seconds a write is held, 0 writes every write immediately
+    """
+
+    def __init__(
+        self,
+        db: FirestoreService | LazySingleton[FirestoreService] = db_service,
+        window: float = setting.job_write_window_seconds,
+    ):
+        self.db = db
+        self.window = window
+        self._pending: Dict[Tuple[str, ...], BatchWrite] = {}
+        self._lock = threading.Lock()
+        # Keeps flushes in order, so an older copy never lands after a newer one
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        # Failed flushes of each document with a write still pending
+        self._failures: Dict[Tuple[str, ...], int] = {}
+
+    def write(self, collection: str, document_id: str, data: Dict):
+        """Replace the whole document, like FirestoreService.write."""
+        path = (collection, document_id)
+        # Copied so that callers may keep changing their data
+        data = copy.deepcopy(data)
+        self._add(path, lambda pending: BatchWrite("set", path, data))
+
+    def update(self, collection: str, document_id: str, fields: Dict):
+        """
+        Update top-level fields of an existing document.
+
+        ArrayUnion values of a field add up, so events appended by several
+        updates are sent once each instead of rewriting the whole array.
+        """
+        path = (collection, document_id)
+        fields = copy.deepcopy(fields)
+
+        def merge(pending: Optional[BatchWrite]) -> BatchWrite:
+            if pending is None:
+                pending = BatchWrite("update", path, {})
+            return _merge_fields(pending, fields)
+
+        self._add(path, merge)
+
+    def _add(
+        self,
+        path: Tuple[str, ...],
+        merge: Callable[[Optional[BatchWrite]], BatchWrite],
+    ):
+        # merge turns the pending write of the document, if any, into the new one
+        with self._lock:
+            self._pending[path] = merge(self._pending.get(path))
+            if self.window > 0 and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if self.window <= 0:
+            self.flush()
+
+    def flush(self):
+        """Commit every pending write now."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending:
+                return
+            try:
+                self.db.commit_writes(list(pending.values()))
+            except Exception as e:
+                self._requeue(pending, e)
+            else:
+                with self._lock:
+                    for path in pending:
+                        self._failures.pop(path, None)
+
+    def _requeue(self, failed: Dict[Tuple[str, ...], BatchWrite], error: Exception):
+        # Updates only carry their changes, dropping a failed write would lose
+        # them for good, so it is put back under the writes made since
+        with self._lock:
+            dropped = 0
+            for path, write in failed.items():
+                attempts = self._failures.get(path, 0) + 1
+                if attempts >= MAX_WRITE_ATTEMPTS:
+                    self._failures.pop(path, None)
+                    dropped += 1
+                    continue
+                self._failures[path] = attempts
+                newer = self._pending.get(path)
+                if newer is None:
+                    self._pending[path] = write
+                elif newer.op != "set":
+                    self._pending[path] = _merge_fields(write, newer.data)
+            if dropped:
+                logger.error(
+                    f"Dropped {dropped} document writes after "
+                    f"{MAX_WRITE_ATTEMPTS} attempts: {error}"
+                )
+            else:
+                logger.warning(f"Failed to write {len(failed)} documents: {error}")
+            if self.window > 0 and self._pending and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def __enter__(self) -> "CoalescingWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
@@ -0,0 +1,54 @@
+import hashlib
+from datetime import UTC, datetime
+from typing import Any, Dict, Optional
+
+from app.services.db_service import db_service
+from app.utils.global_logging import get_logger
+
+DOCUMENT_INDEX_COLLECTION = "document_index"
+
+logger = get_logger(__name__)
+
+
+class DocumentIndexService:
+    """
+    Index of documents already ingested, keyed by user and content hash.
+
+    Lets the document pipeline skip re-downloading, re-extracting and
+    re-embedding a document the user has sent before.
+    """
+
+    def __init__(self):
+        pass
+
+    def _document_id(self, user_id: str, doc_hash: str) -> str:
+        # WhatsApp hashes are base64 and may contain "/", which Firestore
+        # does not allow in document IDs
+        return hashlib.sha256(f"{user_id}:{doc_hash}".encode()).hexdigest()
+
+    def find(self, user_id: str, doc_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the index entry of a previously ingested document, if any."""
+        if not doc_hash:
+            return None
+        return db_service.read(
+            DOCUMENT_INDEX_COLLECTION, self._document_id(user_id, doc_hash)
+        )
+
+    def save(self, user_id: str, doc_hash: str, data: Dict[str, Any]):
+        """Record an ingested document with its summary and storage location."""
+        if not doc_hash:
+            return
+        db_service.write(
+            DOCUMENT_INDEX_COLLECTION,
+            self._document_id(user_id, doc_hash),
+            data
+            | {
+                "user_id": user_id,
+                "doc_hash": doc_hash,
+                "indexed_at": datetime.now(UTC),
+            },
+        )
+        logger.info(f"Indexed document hash for user {user_id}")
+
+
+document_index = DocumentIndexService()
@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import (
@@ -9,60 +9,81 @@ from langchain_core.messages import (
     SystemMessage,
     ToolCall,
     ToolMessage,
-    trim_messages,
 )
-from langchain_core.messages.utils import count_tokens_approximately
 
-from app.services.db_service import FirestoreService, db_service
-from app.utils.helpers import langchain_msg_to_dict, list_to_langchain_msg
-from app.utils.prompt import system_prompt
+from app.config import get_settings
+from app.services.chat_history_cache import ConversationState, chat_history_cache
+from app.services.chat_history_store import SUMMARY_PREFIX, count_message_tokens
 
-DB_COLLECTION_NAME = "chat_history"
+settings = get_settings()
 
 
 class FirebaseChatHistory(BaseChatMessageHistory):
-    db: FirestoreService = db_service
-
-    def __init__(self, use_id: str):
+    def __init__(
+        self,
+        use_id: str,
+        max_tokens: int = settings.chat_history_max_tokens,
+        state: Optional[ConversationState] = None,
+    ):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"Chat history created for user {use_id}")
         self.user_id: str = use_id
+        self.max_tokens = max_tokens
         self.messages: List[BaseMessage] = []
-        self._get_messages()
+        # Token count of every message, in the same order as messages
+        self.message_tokens: List[int] = []
+        self.total_tokens = 0
+        self._get_messages(state)
         self.logger.info("Firebase chat history initialized successfully.")
 
-    def add_message(self, message: BaseMessage):
+    @classmethod
+    async def aload(
+        cls, use_id: str, max_tokens: int = settings.chat_history_max_tokens
+    ) -> "FirebaseChatHistory":
+        """Create the chat history without blocking the event loop on a read."""
+        state = await chat_history_cache.aget_or_load(use_id)
+        return cls(use_id, max_tokens, state)
+
+    def add_message(self, message: BaseMessage, tokens: int = None):
         try:
+            if tokens is None:
+                tokens = count_message_tokens(message)
             self.messages.append(message)
+            self.message_tokens.append(tokens)
+            self.total_tokens += tokens
         except Exception as e:
             self.logger.error(e)
 
     def add_messages(self, messages: List[BaseMessage]):
-        try:
-            self.messages.extend(messages)
-        except Exception as e:
-            self.logger.error(e)
+        for message in messages:
+            self.add_message(message)
 
     def commit(self):
         self._write()
 
-    def _get_messages(self):
-        doc_dict = self.db.read(DB_COLLECTION_NAME, self.user_id)
-        messages = doc_dict.get("messages", []) if doc_dict else []
-        langchain_msgs = list_to_langchain_msg(messages)
-
-        if len(langchain_msgs) == 0:
-            langchain_msgs.append(system_prompt)
-
-        self.messages = langchain_msgs
-        # If doc_dict is empty create an empty document in DB
-        if not doc_dict:
-            self._create_empty_message_list()
+    def _get_messages(self, state: Optional[ConversationState] = None):
+        # The document is created by the first commit
+        if state is None:
+            state = chat_history_cache.get_or_load(self.user_id)
+        self._state: ConversationState = state
+        self.messages = self._state.messages
+        self.message_tokens = self._state.message_tokens
+        self.total_tokens = sum(self.message_tokens)
 
     def add_human_message(self, msg: str, whatsapp_msg_id: str = None):
         human_msg = HumanMessage(f"{msg}  |  latest_whatsapp_msg_id={whatsapp_msg_id}")
         self.add_message(human_msg)
 
+    def add_human_messages_as_turn(self, msgs: List[Tuple[str, str]]):
+        """Add several (text, whatsapp_msg_id) pairs as a single human turn."""
+        human_msg = HumanMessage(
+            "\n".join(
+                f"{msg}  |  latest_whatsapp_msg_id={whatsapp_msg_id}"
+                for msg, whatsapp_msg_id in msgs
+            )
+        )
+        self.add_message(human_msg)
+
     def add_ai_message(self, msg: str, tool_calls: list[ToolCall] = []):
         self.add_message(AIMessage(msg, tool_calls=tool_calls))
 
@@ -70,31 +91,104 @@ class FirebaseChatHistory(BaseChatMessageHistory):
         self.add_message(ToolMessage(content=msg, tool_call_id=tool_call_id))
 
     def clear(self):
-        self.db.delete(DB_COLLECTION_NAME, self.user_id)
-
-    def _create_empty_message_list(self):
-        FirebaseChatHistory.db.write_with_ttl(
-            DB_COLLECTION_NAME, self.user_id, {"messages": []}
+        chat_history_cache.delete(self.user_id)
+
+    @property
+    def summary(self) -> str:
+        """Summary of compacted turns, or an empty string."""
+        if (
+            len(self.messages) > 1
+            and isinstance(self.messages[1], SystemMessage)
+            and self.messages[1].content.startswith(SUMMARY_PREFIX)
+        ):
+            return self.messages[1].content[len(SUMMARY_PREFIX) :].strip()
+        return ""
+
+    def _start_index(self) -> int:
+        # The system prompt and the summary lead the history and are never dropped
+        start = 0
+        while start < len(self.messages) and isinstance(
+            self.messages[start], SystemMessage
+        ):
+            start += 1
+        return start
+
+    def cut_index(self, max_tokens: int) -> Tuple[int, int]:
+        """
+        Find the oldest turns to drop to fit the history in max_tokens.
+
+        The history restarts on a human message, so tool calls are never
+        separated from their results, and the current turn, from the last human
+        message on, is never dropped. Uses the stored token counts, so each
+        message is counted only once.
+
+        Returns:
+            Tuple[int, int]: Slice [start, end) of the messages to drop
+        """
+        start = self._start_index()
+        # Searched from the end, so this only walks the current turn
+        last_human = next(
+            (
+                i
+                for i in range(len(self.messages) - 1, start - 1, -1)
+                if isinstance(self.messages[i], HumanMessage)
+            ),
+            start,
         )
 
-    def _trim_messages(self):
-        self.messages = trim_messages(
-            self.messages,
-            strategy="last",
-            include_system=True,
-            start_on="human",
-            max_tokens=18000,
-            token_counter=count_tokens_approximately,
+        end = start
+        total = self.total_tokens
+        while end < last_human and total > max_tokens:
+            total -= self.message_tokens[end]
+            end += 1
+        while end < last_human and not isinstance(self.messages[end], HumanMessage):
+            end += 1
+        return start, end
+
+    def _drop(self, start: int, end: int):
+        dropped = sum(self.message_tokens[start:end])
+        del self.messages[start:end]
+        del self.message_tokens[start:end]
+        self.total_tokens -= dropped
+        return dropped
+
+    def trim(self):
+        """Drop the oldest turns until the history fits in max_tokens."""
+        if self.total_tokens <= self.max_tokens:
+            return
+        start, end = self.cut_index(self.max_tokens)
+        if end == start:
+            return
+        dropped = self._drop(start, end)
+        self.logger.info(
+            f"Trimmed {end - start} messages, {dropped} tokens "
+            f"from the history of {self.user_id}"
         )
 
+    def replace_with_summary(self, end: int, summary: str):
+        """
+        Replace the messages before end, and any previous summary, with a summary.
+
+        Args:
+            end: Index of the first message to keep, from cut_index
+            summary: Summary of the replaced messages
+        """
+        start = self._start_index()
+        had_summary = bool(self.summary)
+        self._drop(start, end)
+        if had_summary:
+            self._drop(1, 2)
+
+        message = SystemMessage(f"{SUMMARY_PREFIX}\n{summary}")
+        tokens = count_message_tokens(message)
+        self.messages.insert(1, message)
+        self.message_tokens.insert(1, tokens)
+        self.total_tokens += tokens
+
     def _write(self):
-        # Write messages to the database when document exists
-        doc_dict = self.db.read(DB_COLLECTION_NAME, self.user_id)
-        if not doc_dict:
-            self.logger.warning(
-                f"No document found for user {self.user_id}. Not able to commit"
-            )
-            return
-        self._trim_messages()
-        _list = langchain_msg_to_dict(self.messages)
-        self.db.write_with_ttl(DB_COLLECTION_NAME, self.user_id, {"messages": _list})
+        # Written behind by the cache, only if the history was not cleared or
+        # changed since it was read
+        self.trim()
+        self._state.messages = self.messages
+        self._state.message_tokens = self.message_tokens
+        chat_history_cache.commit(self.user_id, self._state)
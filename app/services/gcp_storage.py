@@ -1,5 +1,5 @@
 import logging
-from typing import Tuple
+from typing import Iterable, Tuple
 from uuid import uuid4
 
 from fastapi import UploadFile
@@ -7,6 +7,8 @@ from google.cloud import storage
 
 from app.config import get_settings
 from app.utils.helpers import generate_temp_file_path
+from app.utils.lazy import LazySingleton
+from app.utils.metrics import track_dependency
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -93,26 +95,76 @@ class GCPStorage:
     def upload_file(self, file_path: str, destination_blob_name: str) -> str:
         try:
             blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_filename(file_path)
+            with track_dependency("gcs", "upload"):
+                blob.upload_from_filename(file_path)
 
             logger.info(f"File uploaded to {destination_blob_name}")
             return destination_blob_name
         except Exception as e:
             logger.error(f"Error when uploading file to GCS error: {e}")
 
+    def upload_chunks(
+        self,
+        chunks: Iterable[bytes],
+        destination_blob_name: str,
+        content_type: str,
+        chunk_size: int = 8 * 1024 * 1024,
+    ) -> str:
+        """
+        Upload an iterable of byte chunks to GCS with a resumable upload.
+
+        The upload is cancelled, not finalized, if iterating the chunks fails.
+
+        Args:
+            chunks: Iterable yielding the file content
+            destination_blob_name: Destination path in GCS
+            content_type: Content type of the file
+            chunk_size: Resumable upload chunk size, a multiple of 256 KB
+
+        Returns:
+            str: The destination blob name
+        """
+        blob = self.bucket.blob(destination_blob_name)
+        # Includes the time spent producing the chunks, e.g. a media download
+        with (
+            track_dependency("gcs", "upload_stream"),
+            blob.open("wb", chunk_size=chunk_size, content_type=content_type) as f,
+        ):
+            for chunk in chunks:
+                f.write(chunk)
+
+        logger.info(f"File streamed to GCS at {destination_blob_name}")
+        return destination_blob_name
+
     def read_file(self, blob_name: str) -> bytes:
         try:
             blob = self.bucket.blob(blob_name)
             file_extension = blob_name.split(".")[-1]
             temp_file_path = generate_temp_file_path(file_extension)
             # Create a writable file object
-            with open(temp_file_path, "wb") as f:
+            with open(temp_file_path, "wb") as f, track_dependency("gcs", "download"):
                 blob.download_to_file(f)
             logger.info(f"File downloaded from {blob_name} to {temp_file_path}")
             return temp_file_path
         except Exception as e:
             logger.error(f"Error when reading file from GCS error: {e}")
 
+    def read_bytes(self, blob_name: str) -> bytes:
+        """
+        Download a blob into memory.
+
+        Args:
+            blob_name: Path to the file in GCS bucket
+
+        Returns:
+            bytes: The file content
+        """
+        blob = self.bucket.blob(blob_name)
+        with track_dependency("gcs", "download"):
+            content = blob.download_as_bytes()
+        logger.info(f"Read {len(content)} bytes from {blob_name}")
+        return content
+
     async def upload_stream(
         self,
         file: UploadFile,
@@ -134,7 +186,10 @@ class GCPStorage:
             blob = self.bucket.blob(destination_blob_name)
 
             # Upload file in chunks to handle large files efficiently
-            with blob.open("wb", content_type=file.content_type) as f:
+            with (
+                track_dependency("gcs", "upload_stream"),
+                blob.open("wb", content_type=file.content_type) as f,
+            ):
                 while True:
                     chunk = await file.read(chunk_size)
                     if not chunk:
@@ -176,7 +231,10 @@ class GCPStorage:
             blob = self.bucket.blob(blob_name)
 
             # Download file in chunks to handle large files efficiently
-            with open(temp_file_path, "wb") as f:
+            with (
+                open(temp_file_path, "wb") as f,
+                track_dependency("gcs", "download_stream"),
+            ):
                 with blob.open("rb") as source_file:
                     while True:
                         chunk = source_file.read(chunk_size)
@@ -214,11 +272,12 @@ class GCPStorage:
                     f"Source blob {source_blob_name} does not exist"
                 )
 
-            # Copy the blob to the new location
-            self.bucket.copy_blob(source_blob, self.bucket, destination_blob_name)
+            with track_dependency("gcs", "move"):
+                # Copy the blob to the new location
+                self.bucket.copy_blob(source_blob, self.bucket, destination_blob_name)
 
-            # Delete the original blob
-            source_blob.delete()
+                # Delete the original blob
+                source_blob.delete()
 
             logger.info(
                 f"Blob moved from {source_blob_name} to {destination_blob_name}"
@@ -267,4 +326,4 @@ class GCPStorage:
             raise
 
 
-gcp_storage = GCPStorage()
+gcp_storage: LazySingleton[GCPStorage] = LazySingleton("gcs", GCPStorage)
@@ -0,0 +1,107 @@
+"""
+Rolling summarisation of long conversations.
+
+Once a chat history grows past a threshold, its oldest turns are summarised
+into a system message that is stored with the history in place of those turns.
+This keeps the prompt of every LLM call small and stable instead of growing up
+to the hard trimming limit.
+"""
+
+import asyncio
+
+from langchain_core.messages import HumanMessage, get_buffer_string
+
+from app.config import get_settings
+from app.services.firebase_chat_history import FirebaseChatHistory
+from app.services.llm_service import llm_service
+from app.utils.concurrency import LimiterTimeoutError
+from app.utils.global_logging import get_logger
+from app.utils.metrics import registry
+from app.utils.prompt import summary_prompt
+
+settings = get_settings()
+
+logger = get_logger(__name__)
+
+compactions_total = registry.counter(
+    "history_compactions_total",
+    "Chat history compactions by outcome",
+    ("outcome",),
+)
+
+
+class HistoryCompactor:
+    """
+    Summarises the oldest turns of a chat history.
+
+    Args:
+        trigger_tokens: Compact once the history is over this many tokens
+        keep_tokens: Approximate tokens of recent messages kept verbatim
+        timeout: Timeout of the summary LLM call in seconds
+    """
+
+    def __init__(
+        self,
+        trigger_tokens: int = settings.chat_summary_trigger_tokens,
+        keep_tokens: int = settings.chat_summary_keep_tokens,
+        timeout: float = settings.chat_summary_timeout_seconds,
+    ):
+        self.trigger_tokens = trigger_tokens
+        self.keep_tokens = keep_tokens
+        self.timeout = timeout
+
+    def should_compact(self, chat_history: FirebaseChatHistory) -> bool:
+        return chat_history.total_tokens > self.trigger_tokens
+
+    async def compact(self, chat_history: FirebaseChatHistory) -> bool:
+        """
+        Replace the oldest turns of the history with a summary.
+
+        The history is only changed in memory, the caller commits it. Failures
+        are logged and leave the history untouched.
+
+        Args:
+            chat_history: Chat history to compact
+
+        Returns:
+            bool: True if the history was compacted
+        """
+        start, end = chat_history.cut_index(self.keep_tokens)
+        if end == start:
+            return False
+
+        previous = chat_history.summary or "None"
+        transcript = get_buffer_string(
+            chat_history.messages[start:end], human_prefix="User", ai_prefix="Jinja"
+        )
+        prompt = [
+            summary_prompt,
+            HumanMessage(
+                f"Current summary:\n{previous}\n\nMessages to add:\n{transcript}"
+            ),
+        ]
+        try:
+            summary = await llm_service.asummarize(prompt, timeout=self.timeout)
+        except (asyncio.TimeoutError, LimiterTimeoutError):
+            logger.warning(f"Compacting history of {chat_history.user_id} timed out")
+            compactions_total.inc(outcome="timeout")
+            return False
+        except Exception as e:
+            logger.error(f"Failed to compact history of {chat_history.user_id}: {e}")
+            compactions_total.inc(outcome="error")
+            return False
+        if not summary.strip():
+            compactions_total.inc(outcome="empty")
+            return False
+
+        before = chat_history.total_tokens
+        chat_history.replace_with_summary(end, summary.strip())
+        compactions_total.inc(outcome="ok")
+        logger.info(
+            f"Compacted {end - start} messages of {chat_history.user_id}, "
+            f"{before} -> {chat_history.total_tokens} tokens"
+        )
+        return True
+
+
+history_compactor = HistoryCompactor()
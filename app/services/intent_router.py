@@ -0,0 +1,207 @@
+"""
+Deterministic fast path in front of the LLM.
+
+Small talk (greetings, thanks, goodbyes) is matched against precomputed
+keyword tables and answered from templates, and interactive button/list
+replies are dispatched on their reply ID. Anything the router does not
+recognise goes to the LLM as usual.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from app.utils.global_logging import get_logger
+from app.utils.metrics import registry
+
+logger = get_logger(__name__)
+
+fast_path_total = registry.counter(
+    "intent_fast_path_total",
+    "Messages answered by the intent router without an LLM call",
+    ("intent",),
+)
+
+GREETING = "greeting"
+THANKS = "thanks"
+GOODBYE = "goodbye"
+HELP = "help"
+
+# Messages longer than this are never small talk
+MAX_SMALL_TALK_WORDS = 5
+
+KEYWORDS: Dict[str, tuple] = {
+    GREETING: (
+        "hi",
+        "hii",
+        "hey",
+        "hello",
+        "hello there",
+        "hi there",
+        "hey there",
+        "good morning",
+        "good afternoon",
+        "good evening",
+        "namaste",
+        "hola",
+    ),
+    THANKS: (
+        "thanks",
+        "thank you",
+        "thank you so much",
+        "thanks a lot",
+        "thx",
+        "ty",
+        "great thanks",
+        "ok thanks",
+        "okay thanks",
+        "dhanyavad",
+        "shukriya",
+    ),
+    GOODBYE: (
+        "bye",
+        "bye bye",
+        "goodbye",
+        "good bye",
+        "see you",
+        "see ya",
+        "good night",
+        "ok bye",
+        "thanks bye",
+        "thank you bye",
+    ),
+    HELP: (
+        "help",
+        "menu",
+        "what can you do",
+        "how does this work",
+    ),
+}
+
+TEMPLATES: Dict[str, str] = {
+    GREETING: (
+        "Hi! I'm Jinja, your invoice assistant.\n\n"
+        "Send me a PDF invoice and I'll store it for you, or ask me to find one, "
+        'e.g. "show my electricity bills from March".'
+    ),
+    THANKS: "You're welcome! Let me know if you need anything else.",
+    GOODBYE: "Goodbye! Your invoices are safe with me, message me any time.",
+    HELP: (
+        "Here is what I can do:\n\n"
+        "1. Store your PDF invoices, just send them to me.\n"
+        "2. Find invoices by provider, items, category, or month and year.\n"
+        "3. Send stored invoices back to you."
+    ),
+}
+
+# Normalized phrase -> intent, built once at import
+_PHRASES: Dict[str, str] = {
+    phrase: intent for intent, phrases in KEYWORDS.items() for phrase in phrases
+}
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+@dataclass
+class RoutedIntent:
+    name: str
+    reply: str
+    # Delete the conversation context, like the delete_context tool
+    clear_context: bool = False
+
+
+InteractiveHandler = Callable[[str, Dict[str, Any]], Optional[RoutedIntent]]
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and emoji, and collapse whitespace."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def interactive_reply(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Return the reply of a button or list message as {"id", "title"}.
+
+    Template quick reply buttons ("button" messages) carry a payload and text
+    instead of an ID and title.
+    """
+    message_type = message.get("type")
+    if message_type == "interactive":
+        interactive = message.get("interactive", {})
+        interactive_type = interactive.get("type", "")
+        if interactive_type in ("button_reply", "list_reply"):
+            return interactive.get(interactive_type, {})
+        return None
+    if message_type == "button":
+        button = message.get("button", {})
+        return {"id": button.get("payload", ""), "title": button.get("text", "")}
+    return None
+
+
+def message_text(message: Dict[str, Any]) -> Optional[str]:
+    """
+    Text to answer with the LLM, for text messages and interactive replies.
+
+    Returns:
+        Optional[str]: The text, or None for media and other message types
+    """
+    if message.get("type") == "text":
+        return message.get("text", {}).get("body", "")
+    reply = interactive_reply(message)
+    if reply is not None:
+        return reply.get("title", "")
+    return None
+
+
+class IntentRouter:
+    def __init__(self):
+        self._interactive_handlers: Dict[str, InteractiveHandler] = {}
+
+    def register_interactive(self, reply_id: str, handler: InteractiveHandler):
+        """
+        Handle button or list replies with the given ID without the LLM.
+
+        Args:
+            reply_id: ID of the button or list row
+            handler: Called with the sender ID and the reply, returns the intent
+        """
+        self._interactive_handlers[reply_id] = handler
+
+    def route(self, message: Dict[str, Any]) -> Optional[RoutedIntent]:
+        """
+        Find a deterministic answer for a message.
+
+        Args:
+            message: The WhatsApp message object
+
+        Returns:
+            Optional[RoutedIntent]: The intent, or None if the LLM has to answer
+        """
+        intent = self._route(message)
+        if intent is not None:
+            fast_path_total.inc(intent=intent.name)
+            logger.info(f"Routed message {message.get('id')} to {intent.name}")
+        return intent
+
+    def _route(self, message: Dict[str, Any]) -> Optional[RoutedIntent]:
+        reply = interactive_reply(message)
+        if reply is not None:
+            handler = self._interactive_handlers.get(reply.get("id", ""))
+            if handler is not None:
+                return handler(message.get("from", ""), reply)
+            # Unknown replies are answered by the LLM from their title
+            return None
+
+        if message.get("type") != "text":
+            return None
+        text = normalize(message.get("text", {}).get("body", ""))
+        if not text or len(text.split()) > MAX_SMALL_TALK_WORDS:
+            return None
+        name = _PHRASES.get(text)
+        if name is None:
+            return None
+        return RoutedIntent(name, TEMPLATES[name], clear_context=name == GOODBYE)
+
+
+intent_router = IntentRouter()
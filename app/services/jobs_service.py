@@ -1,17 +1,67 @@
-from typing import Any, List
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
-from app.services.db_service import db_service
-from app.utils.constants import DB_COLLECTION
+from app.services.db_service import async_db_service
+from app.utils.background_job import JobStatus
+from app.utils.constants import DB_COLLECTION, DEFAULT_PAGE_SIZE
 
 ORDER_BY = "started_at"
+# Fields of the job list, the progress logs are only needed for a single job
+SUMMARY_FIELDS = [
+    "job_id",
+    "type",
+    "sender_id",
+    "status",
+    "started_at",
+    "completed_at",
+    "doc_filename",
+]
 
 
 class JobsService:
     def __init__(self):
         pass
 
-    def get_jobs(self, page_size: int) -> List[Any]:
-        return db_service.read_list(DB_COLLECTION, page_size, ORDER_BY)
+    async def get_jobs(
+        self,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Read a page of job summaries, newest first.
+
+        Args:
+            page_size: Maximum number of jobs
+            cursor: Cursor of the previous page, None for the first page
+            status: Only jobs with this status
+            since: Only jobs started at or after this time
+            until: Only jobs started before this time
+
+        Raises:
+            ValueError: If the cursor is invalid
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: The jobs and the cursor
+            of the next page, None on the last page
+        """
+        filters = []
+        if status is not None:
+            filters.append(("status", "==", str(status)))
+        if since is not None:
+            filters.append((ORDER_BY, ">=", since))
+        if until is not None:
+            filters.append((ORDER_BY, "<", until))
+        return await async_db_service.read_page(
+            DB_COLLECTION,
+            ORDER_BY,
+            page_size,
+            cursor=cursor,
+            fields=SUMMARY_FIELDS,
+            filters=filters,
+        )
 
 
 job_service = JobsService()
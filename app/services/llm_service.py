@@ -9,7 +9,8 @@ environment variable. Supported providers can be extended easily.
 # Add more imports as needed for other providers
 import logging
 import os
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional
 
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import BaseMessage
@@ -19,7 +20,10 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
 
+from app.utils.concurrency import chat_limiter, structured_limiter
+from app.utils.lazy import LazySingleton
 from app.utils.llm_tools import llm_tools  # Import the tool
+from app.utils.metrics import track_dependency
 from app.utils.prompt import prompt_v1  # Import the prompt template
 from app.utils.types import LLMResponse  # Import the LLMResponse type
 
@@ -71,7 +75,29 @@ class LLMService:
             f"Generating response using {self.provider} provider with model {self.model_name}"
         )
         logger.info(f"Prompt: {prompt}")
-        resp = self.llm_with_tools.invoke(prompt, **kwargs)
+        with chat_limiter.limit_sync(), track_dependency("openai", "chat"):
+            resp = self.llm_with_tools.invoke(prompt, **kwargs)
+        logger.info(f"{resp}")
+        return self._send_resp(resp)
+
+    async def _agenerate(
+        self, prompt: List[BaseMessage], timeout: Optional[float] = None, **kwargs
+    ) -> LLMResponse:
+        """
+        Async variant of _generate, awaiting the model on the event loop.
+
+        The timeout covers both the wait for a concurrency slot and the request.
+        """
+        logger.info(
+            f"Generating response using {self.provider} provider with model {self.model_name}"
+        )
+        logger.info(f"Prompt: {prompt}")
+        deadline = time.monotonic() + timeout if timeout else None
+        async with chat_limiter.limit_async(timeout):
+            if deadline:
+                kwargs["timeout"] = max(deadline - time.monotonic(), 0.001)
+            with track_dependency("openai", "chat"):
+                resp = await self.llm_with_tools.ainvoke(prompt, **kwargs)
         logger.info(f"{resp}")
         return self._send_resp(resp)
 
@@ -85,11 +111,19 @@ class LLMService:
             and isinstance(resp.tool_calls, list)
             and len(resp.tool_calls) > 0
         ):
-            return LLMResponse(type="tool_calls", tool_calls=resp.tool_calls)
+            return LLMResponse(
+                type="tool_calls",
+                tool_calls=resp.tool_calls,
+                usage=getattr(resp, "usage_metadata", None),
+            )
         elif hasattr(resp, "content") and len(resp.content) > 0:
             content_length = len(resp.content) if isinstance(resp.content, str) else 0
             logger.info(f"Response content length: {content_length}")
-            return LLMResponse(type="message", text=resp.content)
+            return LLMResponse(
+                type="message",
+                text=resp.content,
+                usage=getattr(resp, "usage_metadata", None),
+            )
 
         return LLMResponse(type="message", text=str(resp))
 
@@ -103,13 +137,56 @@ class LLMService:
     def format_and_query(self, messages: List[BaseMessage]) -> LLMResponse:
         return self.query(messages)
 
+    async def aquery(
+        self, prompt: List[BaseMessage], timeout: Optional[float] = None, **kwargs
+    ) -> LLMResponse:
+        """
+        Async variant of query.
+        """
+        logger.info(f" Prompt : {prompt}")
+        return await self._agenerate(prompt, timeout=timeout, **kwargs)
+
+    async def aformat_and_query(
+        self, messages: List[BaseMessage], timeout: Optional[float] = None
+    ) -> LLMResponse:
+        return await self.aquery(messages, timeout=timeout)
+
+    async def asummarize(
+        self, prompt: List[BaseMessage], timeout: Optional[float] = None
+    ) -> str:
+        """
+        Generate plain text without tools, used to summarise chat history.
+        """
+        kwargs = {}
+        deadline = time.monotonic() + timeout if timeout else None
+        async with chat_limiter.limit_async(timeout):
+            if deadline:
+                kwargs["timeout"] = max(deadline - time.monotonic(), 0.001)
+            with track_dependency("openai", "summary"):
+                resp = await self.llm.ainvoke(prompt, **kwargs)
+        return resp.content if isinstance(resp.content, str) else str(resp.content)
+
     def query_with_structured_output(self, messages: str, structure: BaseModel):
         structured_llm = self.llm.with_structured_output(structure)
 
-        resp = structured_llm.invoke(messages)
+        with structured_limiter.limit_sync():
+            with track_dependency("openai", "structured_output"):
+                resp = structured_llm.invoke(messages)
+        logger.info(f"Structured response: {resp}")
+        return resp
+
+    async def aquery_with_structured_output(self, messages: str, structure: BaseModel):
+        """
+        Async variant of query_with_structured_output.
+        """
+        structured_llm = self.llm.with_structured_output(structure)
+
+        async with structured_limiter.limit_async():
+            with track_dependency("openai", "structured_output"):
+                resp = await structured_llm.ainvoke(messages)
         logger.info(f"Structured response: {resp}")
         return resp
 
 
 # Singleton instance for app-wide use
-llm_service = LLMService()
+llm_service: LazySingleton[LLMService] = LazySingleton("openai", LLMService)
@@ -0,0 +1,315 @@
+"""
+In-process work queue for incoming WhatsApp messages.
+
+The webhook only validates the payload and enqueues messages here; a pool of
+asyncio workers drains the queue. Coroutine handlers are awaited on the event
+loop, blocking handlers run in a dedicated thread pool so the uvicorn event
+loop is never blocked.
+
+Messages are kept in one mailbox per sender. A mailbox is owned by at most one
+worker at a time, so messages of a conversation are handled strictly in order
+while different conversations run concurrently.
+
+When a coalescing window is configured, consecutive text messages of a sender
+that arrive within the window are merged into a single turn.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import get_settings
+from app.utils.global_logging import get_logger
+
+settings = get_settings()
+
+logger = get_logger(__name__)
+
+# Upper bound of text messages merged into one turn
+MAX_COALESCED_MESSAGES = 10
+
+
+class QueueFullError(Exception):
+    """Raised when a message cannot be enqueued because the queue is full."""
+
+
+@dataclass
+class QueuedMessage:
+    message: Dict[str, Any]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class Mailbox:
+    sender_id: str
+    messages: deque = field(default_factory=deque)
+    # True while the mailbox is waiting in the ready queue or owned by a worker
+    scheduled: bool = False
+    last_active: float = field(default_factory=time.monotonic)
+
+
+def is_text_message(message: Dict[str, Any]) -> bool:
+    return message.get("type") == "text"
+
+
+def merge_text_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge consecutive text messages of a sender into a single message.
+
+    The merged message keeps the id of the latest message and the original
+    messages under the "coalesced" key.
+
+    Args:
+        messages: Text messages in arrival order
+
+    Returns:
+        Dict[str, Any]: The merged message
+    """
+    if len(messages) == 1:
+        return messages[0]
+    body = "\n".join(m.get("text", {}).get("body", "") for m in messages)
+    return messages[-1] | {"text": {"body": body}, "coalesced": messages}
+
+
+class MessageQueue:
+    """
+    Bounded per-sender mailboxes drained by a fixed pool of workers.
+
+    Args:
+        handler: Coroutine function or blocking callable invoked with each message dict
+        max_size: Maximum number of messages waiting across all mailboxes
+        workers: Number of conversations processed concurrently
+        max_conversations: Maximum number of conversations with pending work
+        mailbox_idle_seconds: Idle time after which an empty mailbox is evicted
+        coalesce_window_ms: Debounce window for merging text messages, 0 disables
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Any],
+        max_size: int = settings.message_queue_max_size,
+        workers: int = settings.message_queue_workers,
+        max_conversations: int = settings.message_queue_max_conversations,
+        mailbox_idle_seconds: float = settings.message_queue_mailbox_idle_seconds,
+        coalesce_window_ms: int = settings.message_coalesce_window_ms,
+    ):
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self.max_conversations = max_conversations
+        self.mailbox_idle_seconds = mailbox_idle_seconds
+        self.coalesce_window = coalesce_window_ms / 1000
+        self._mailboxes: Dict[str, Mailbox] = {}
+        # Mailboxes with pending messages, in the order they became ready
+        self._ready: Optional[asyncio.Queue] = None
+        self._pending = 0
+        self._active_conversations = 0
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._started_at: Optional[float] = None
+
+        # Stats
+        self._busy_workers = 0
+        self._busy_time = 0.0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._evicted = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._turns = 0
+        # Number of turns by how many messages each of them absorbed
+        self._messages_per_turn: Dict[int, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._ready is not None
+
+    async def start(self):
+        """Create the ready queue and spawn the workers on the running event loop."""
+        if self.running:
+            return
+        self._ready = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="message-worker"
+        )
+        self._started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"message-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(
+            asyncio.create_task(self._evict_idle_mailboxes(), name="mailbox-evictor")
+        )
+        logger.info(
+            f"Message queue started with {self.workers} workers (max size {self.max_size})"
+        )
+
+    async def stop(self, timeout: float = 10.0):
+        """Wait for queued messages to drain, then stop the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Message queue stopped with {self._pending} messages pending"
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+        self._ready = None
+        self._tasks = []
+        self._mailboxes.clear()
+        self._pending = 0
+        self._active_conversations = 0
+        logger.info("Message queue stopped")
+
+    def submit(self, message: Dict[str, Any]):
+        """
+        Append a message to its sender's mailbox without waiting.
+
+        Raises:
+            QueueFullError: If the queue is at capacity or not running
+        """
+        if not self.running:
+            raise QueueFullError("Message queue is not running")
+        if self._pending >= self.max_size:
+            self._rejected += 1
+            raise QueueFullError(f"Message queue is full ({self.max_size} messages)")
+
+        sender_id = message.get("from", "")
+        mailbox = self._mailboxes.get(sender_id)
+        if mailbox is None or not mailbox.scheduled:
+            if self._active_conversations >= self.max_conversations:
+                self._rejected += 1
+                raise QueueFullError(
+                    f"Too many active conversations ({self.max_conversations})"
+                )
+        if mailbox is None:
+            mailbox = self._mailboxes[sender_id] = Mailbox(sender_id)
+        if not mailbox.scheduled:
+            self._active_conversations += 1
+            mailbox.scheduled = True
+            self._ready.put_nowait(mailbox)
+
+        mailbox.messages.append(QueuedMessage(message))
+        self._pending += 1
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            mailbox: Mailbox = await self._ready.get()
+            item: QueuedMessage = mailbox.messages.popleft()
+            self._pending -= 1
+            wait_time = time.monotonic() - item.enqueued_at
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+
+            messages = [item.message]
+            if self.coalesce_window and is_text_message(item.message):
+                messages = await self._coalesce(mailbox, item)
+            self._record_turn(len(messages))
+
+            self._busy_workers += 1
+            started = time.monotonic()
+            try:
+                if asyncio.iscoroutinefunction(self.handler):
+                    await self.handler(merge_text_messages(messages))
+                else:
+                    await loop.run_in_executor(
+                        self._executor, self.handler, merge_text_messages(messages)
+                    )
+                self._processed += len(messages)
+            except Exception as e:
+                self._failed += len(messages)
+                logger.error(f"Worker {worker_id} failed to process message: {e}")
+            finally:
+                self._busy_time += time.monotonic() - started
+                self._busy_workers -= 1
+                mailbox.last_active = time.monotonic()
+                if mailbox.messages:
+                    # Go to the back of the line so other conversations get a turn
+                    self._ready.put_nowait(mailbox)
+                else:
+                    mailbox.scheduled = False
+                    self._active_conversations -= 1
+                self._ready.task_done()
+
+    async def _coalesce(
+        self, mailbox: Mailbox, first: QueuedMessage
+    ) -> List[Dict[str, Any]]:
+        """
+        Collect consecutive text messages until the sender has been quiet for
+        the coalescing window.
+        """
+        items = [first]
+        while len(items) < MAX_COALESCED_MESSAGES:
+            while (
+                mailbox.messages
+                and is_text_message(mailbox.messages[0].message)
+                and len(items) < MAX_COALESCED_MESSAGES
+            ):
+                items.append(mailbox.messages.popleft())
+                self._pending -= 1
+            if mailbox.messages:
+                # A non-text message ends the turn
+                break
+            remaining = items[-1].enqueued_at + self.coalesce_window - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        return [i.message for i in items]
+
+    def _record_turn(self, absorbed: int):
+        self._turns += 1
+        self._messages_per_turn[absorbed] = self._messages_per_turn.get(absorbed, 0) + 1
+
+    async def _evict_idle_mailboxes(self):
+        interval = max(self.mailbox_idle_seconds / 2, 1)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            idle = [
+                sender_id
+                for sender_id, mailbox in self._mailboxes.items()
+                if not mailbox.scheduled
+                and now - mailbox.last_active > self.mailbox_idle_seconds
+            ]
+            for sender_id in idle:
+                del self._mailboxes[sender_id]
+            self._evicted += len(idle)
+            if idle:
+                logger.debug(f"Evicted {len(idle)} idle mailboxes")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, wait time and worker utilisation figures."""
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        dequeued = self._turns
+        return {
+            "running": self.running,
+            "depth": self._pending,
+            "max_size": self.max_size,
+            "mailboxes": len(self._mailboxes),
+            "active_conversations": self._active_conversations,
+            "max_conversations": self.max_conversations,
+            "evicted_mailboxes": self._evicted,
+            "workers": self.workers,
+            "busy_workers": self._busy_workers,
+            "utilisation": (
+                round(self._busy_time / (uptime * self.workers), 4) if uptime else 0.0
+            ),
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "wait_time_avg_ms": (
+                round(self._wait_time_total / dequeued * 1000, 2) if dequeued else 0.0
+            ),
+            "wait_time_max_ms": round(self._wait_time_max * 1000, 2),
+            "turns": self._turns,
+            "messages_per_turn": dict(sorted(self._messages_per_turn.items())),
+        }
@@ -3,7 +3,7 @@ from datetime import datetime
 
 from pytz import UTC
 
-from app.services.db_service import db_service
+from app.services.db_service import async_db_service
 from app.utils.global_logging import get_logger
 
 OTP_COLLECTION = "otp_codes"
@@ -19,29 +19,29 @@ class OTPService:
     def generate_otp(self):
         return "".join(secrets.choice("0123456789") for _ in range(self.length))
 
-    def save_otp(self, phone_number: str, otp: str):
-        db_service.write_with_ttl(
+    async def save_otp(self, phone_number: str, otp: str):
+        await async_db_service.write_with_ttl(
             OTP_COLLECTION, phone_number, {"phone_number": phone_number, "otp": otp}
         )
         return True
 
-    def generate_otp_and_save(self, phone_number: str) -> str:
+    async def generate_otp_and_save(self, phone_number: str) -> str:
         otp = self.generate_otp()
-        self.save_otp(phone_number, otp)
+        await self.save_otp(phone_number, otp)
         return otp
 
-    def verify_otp(self, phone_number: str, otp: str) -> bool:
-        record = db_service.read(OTP_COLLECTION, phone_number)
+    async def verify_otp(self, phone_number: str, otp: str) -> bool:
+        record = await async_db_service.read(OTP_COLLECTION, phone_number)
 
         if record is None:
             return False
         expire_at = record.get("expires_at")
         if record and record.get("otp") == otp and expire_at > datetime.now(UTC):
-            db_service.delete(OTP_COLLECTION, phone_number)
+            await async_db_service.delete(OTP_COLLECTION, phone_number)
             return True
 
         if record is not None:
-            db_service.delete(OTP_COLLECTION, phone_number)
+            await async_db_service.delete(OTP_COLLECTION, phone_number)
 
         return False
 
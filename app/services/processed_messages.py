@@ -1,11 +1,137 @@
+"""
+Deduplication of inbound WhatsApp messages.
+
+A message is marked processed by creating its document, which fails if the
+document already exists, so concurrent webhook retries cannot both pass the
+check. Recently seen message IDs are also remembered in process, so fast
+retries cost no round trip at all.
+
+Messages are checked by the message queue workers, not by the webhook, so
+that the webhook is answered without waiting for Firestore and a message
+rejected by a full queue is not marked processed before WhatsApp retries it.
+Several IDs are therefore only checked together for a turn of coalesced
+messages; WhatsApp sends one message per webhook in practice.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
 from app.config import get_settings
-from app.services.db_service import db_service
+from app.services.db_service import BatchWrite, DocumentChangedError, db_service
 from app.utils.global_logging import get_logger
+from app.utils.helpers import get_ttl_key
 
 settings = get_settings()
 
 logger = get_logger(__name__)
 
+PROCESSED_TTL_SECONDS = 3600
+
+
+class RecentIds:
+    """
+    Thread-safe set of IDs that forgets them after a TTL or when full.
+
+    Args:
+        ttl_seconds: How long an ID is remembered
+        max_size: Maximum number of IDs, the oldest are dropped first
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, item: str) -> bool:
+        with self._lock:
+            expires_at = self._expiry.get(item)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._expiry[item]
+                return False
+            return True
+
+    def add(self, item: str):
+        with self._lock:
+            self._expiry[item] = time.monotonic() + self.ttl_seconds
+            self._expiry.move_to_end(item)
+            while len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False)
+
+
+recent_message_ids = RecentIds(
+    PROCESSED_TTL_SECONDS, settings.processed_messages_cache_size
+)
+
+
+def _create_processed(message_id: str, data: Dict) -> bool:
+    # True if the message was already processed
+    try:
+        db_service.create(
+            settings.firestore_collection_processed_messages, message_id, data
+        )
+        return False
+    except DocumentChangedError:
+        return True
+
+
+def check_messages_status_and_save(message_ids: List[str]) -> List[bool]:
+    """
+    Check which messages were already processed and mark the others processed.
+
+    A single new message costs one atomic create, several are created in one
+    batch. The batch is atomic, so if any of them exists none is written and
+    they are settled by one create each.
+
+    Args:
+        message_ids (List[str]): The IDs of the messages to check.
+
+    Returns:
+        List[bool]: True for every message that was already processed.
+    """
+    collection = settings.firestore_collection_processed_messages
+    processed: Dict[str, bool] = {}
+    unseen = []
+    for message_id in dict.fromkeys(message_ids):
+        if message_id in recent_message_ids:
+            processed[message_id] = True
+        else:
+            unseen.append(message_id)
+
+    data = {"status": "processed"} | get_ttl_key(ttl_seconds=PROCESSED_TTL_SECONDS)
+    if len(unseen) == 1:
+        processed[unseen[0]] = _create_processed(unseen[0], data)
+    elif unseen:
+        try:
+            db_service.commit_writes(
+                [
+                    BatchWrite("create", (collection, message_id), data)
+                    for message_id in unseen
+                ]
+            )
+            processed.update(dict.fromkeys(unseen, False))
+        except DocumentChangedError:
+            # Some were processed before and the batch wrote none of them
+            for message_id in unseen:
+                processed[message_id] = _create_processed(message_id, data)
+
+    for message_id in unseen:
+        recent_message_ids.add(message_id)
+
+    result = []
+    seen = set()
+    for message_id in message_ids:
+        # A message repeated in the same webhook is processed once
+        result.append(processed[message_id] or message_id in seen)
+        seen.add(message_id)
+        if result[-1]:
+            logger.warning(f"message with message_id={message_id} already processed")
+    return result
+
 
 def check_message_status_and_save(message_id: str) -> bool:
     """
@@ -15,21 +141,4 @@ def check_message_status_and_save(message_id: str) -> bool:
     Args:
         message_id (str): The ID of the message to check.
     """
-    # Check the message status
-    message = db_service.read(
-        settings.firestore_collection_processed_messages, message_id
-    )
-
-    if message is not None:
-        # Message already processed
-        logger.warning(f"message with message_id={message_id} already processed")
-        return True
-
-    db_service.write_with_ttl(
-        settings.firestore_collection_processed_messages,
-        message_id,
-        {"status": "processed"},
-        ttl_seconds=3600,
-    )
-
-    return False
+    return check_messages_status_and_save([message_id])[0]
@@ -0,0 +1,156 @@
+"""
+Turn executor for the LLM tool loop.
+
+A text turn alternates between querying the LLM and running the tools it asks
+for until it answers with a message. The executor bounds that loop by number of
+LLM calls, wall-clock time and tokens, passes the remaining time on to every
+LLM and tool call, and answers with a fallback message once a limit is hit.
+"""
+
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from app.config import get_settings
+from app.services.llm_service import llm_service
+from app.utils.concurrency import LimiterTimeoutError
+from app.utils.global_logging import get_logger
+from app.utils.llm_tools import run_llm_tools
+from app.utils.metrics import (
+    tool_loop_iterations,
+    turn_budget_exhausted_total,
+    turn_tokens,
+)
+from app.utils.types import LLMResponse
+
+settings = get_settings()
+
+logger = get_logger(__name__)
+
+FALLBACK_MESSAGE = (
+    "Sorry, I couldn't finish working on that in time. "
+    "Please try again, or ask for something a bit simpler."
+)
+
+
+@dataclass
+class TurnResult:
+    text: str
+    iterations: int
+    tokens: int
+    elapsed: float
+    # Limit that ended the turn early: "iterations", "deadline" or "tokens"
+    exhausted: Optional[str] = None
+
+
+class TurnExecutor:
+    """
+    Runs the LLM tool loop of a turn within an iteration, time and token budget.
+
+    Args:
+        executor: Executor the blocking tool calls run in
+        max_iterations: Maximum number of LLM calls per turn
+        deadline_seconds: Wall-clock budget of a turn
+        token_budget: Maximum total tokens reported by the LLM per turn
+        fallback_message: Reply sent when the turn runs out of budget
+    """
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        max_iterations: int = settings.turn_max_iterations,
+        deadline_seconds: float = settings.turn_deadline_seconds,
+        token_budget: int = settings.turn_token_budget,
+        fallback_message: str = FALLBACK_MESSAGE,
+    ):
+        self.executor = executor
+        self.max_iterations = max_iterations
+        self.deadline_seconds = deadline_seconds
+        self.token_budget = token_budget
+        self.fallback_message = fallback_message
+
+    def _exhausted(self, iterations: int, tokens: int, deadline: float):
+        if iterations >= self.max_iterations:
+            return "iterations"
+        if tokens >= self.token_budget:
+            return "tokens"
+        if time.monotonic() >= deadline:
+            return "deadline"
+        return None
+
+    async def run(self, chat_history: Any, sender_id: str) -> TurnResult:
+        """
+        Query the LLM and run its tools until it replies or the budget runs out.
+
+        The reply, or the fallback message, is added to the chat history as the
+        last AI message so the history stays valid for the next turn.
+
+        Args:
+            chat_history: Chat history ending with the user's messages
+            sender_id: WhatsApp ID of the user
+
+        Returns:
+            TurnResult: The reply and the budget used
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds
+        iterations = 0
+        tokens = 0
+        text = None
+        exhausted = None
+
+        while text is None:
+            exhausted = self._exhausted(iterations, tokens, deadline)
+            if exhausted:
+                break
+
+            iterations += 1
+            # Counts are kept per message, so trimming before every call is cheap
+            chat_history.trim()
+            remaining = deadline - time.monotonic()
+            try:
+                resp: LLMResponse = await asyncio.wait_for(
+                    llm_service.aformat_and_query(
+                        chat_history.messages, timeout=remaining
+                    ),
+                    remaining,
+                )
+            except (asyncio.TimeoutError, LimiterTimeoutError):
+                exhausted = "deadline"
+                break
+            tokens += (resp.get("usage") or {}).get("total_tokens", 0)
+
+            if resp["type"] == "tool_calls":
+                chat_history.add_ai_message("", resp["tool_calls"])
+                # Tool calls are bounded by the deadline and their own timeouts
+                chat_history = await loop.run_in_executor(
+                    self.executor,
+                    run_llm_tools,
+                    resp["tool_calls"],
+                    chat_history,
+                    sender_id,
+                    deadline,
+                )
+            elif resp["type"] == "message":
+                text = resp["text"]
+
+        if text is None:
+            logger.warning(
+                f"Turn for {sender_id} ran out of {exhausted} budget after "
+                f"{iterations} LLM calls and {tokens} tokens"
+            )
+            turn_budget_exhausted_total.inc(reason=exhausted)
+            text = self.fallback_message
+        chat_history.add_ai_message(text)
+
+        elapsed = time.monotonic() - started
+        tool_loop_iterations.observe(iterations)
+        turn_tokens.observe(tokens)
+        logger.info(
+            f"Turn for {sender_id} took {elapsed:.2f}s, "
+            f"{iterations} LLM calls and {tokens} tokens"
+        )
+        return TurnResult(text, iterations, tokens, elapsed, exhausted)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
@@ -6,9 +6,63 @@ from langchain_pinecone import PineconeVectorStore
 from pinecone import Pinecone, ServerlessSpec
 
 from app.config import get_settings
+from app.utils.concurrency import embedding_limiter
+from app.utils.lazy import LazySingleton
+from app.utils.metrics import track_dependency
 
 settings = get_settings()
 
+# Dimension of the OpenAI embeddings stored in the index
+EMBEDDING_DIMENSION = 1536
+
+
+class TimedOpenAIEmbeddings(OpenAIEmbeddings):
+    """
+    OpenAIEmbeddings recording the duration of each embedding call and
+    sharing the embedding concurrency limit.
+    """
+
+    def embed_documents(self, texts, chunk_size=None, **kwargs):
+        # embed_query goes through here as well
+        with embedding_limiter.limit_sync():
+            with track_dependency("openai", "embeddings"):
+                return super().embed_documents(texts, chunk_size, **kwargs)
+
+    async def aembed_documents(self, texts, chunk_size=None, **kwargs):
+        async with embedding_limiter.limit_async():
+            with track_dependency("openai", "embeddings"):
+                return await super().aembed_documents(texts, chunk_size, **kwargs)
+
+
+class TimedIndex:
+    """Pinecone index wrapper recording the duration of data plane calls."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def upsert(self, *args, **kwargs):
+        with track_dependency("pinecone", "upsert"):
+            return self._index.upsert(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        with track_dependency("pinecone", "query"):
+            return self._index.query(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with track_dependency("pinecone", "delete"):
+            return self._index.delete(*args, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        with track_dependency("pinecone", "fetch"):
+            return self._index.fetch(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        with track_dependency("pinecone", "update"):
+            return self._index.update(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
 
 class VectorDB:
     def __init__(self):
@@ -16,21 +70,24 @@ class VectorDB:
             api_key=settings.pinecone_api_key,
         )
 
-        existing_indexes = [index_info["name"] for index_info in self.pc.list_indexes()]
+        with track_dependency("pinecone", "list_indexes"):
+            existing_indexes = [
+                index_info["name"] for index_info in self.pc.list_indexes()
+            ]
         index_name = settings.pinecone_index_name
 
         if index_name not in existing_indexes:
             self.pc.create_index(
                 name=index_name,
-                dimension=1536,
+                dimension=EMBEDDING_DIMENSION,
                 metric="cosine",
                 spec=ServerlessSpec(cloud="aws", region="us-east-1"),
                 deletion_protection="enabled",  # Defaults to "disabled"
             )
 
-        index = self.pc.Index(index_name)
+        self.index = TimedIndex(self.pc.Index(index_name))
         self.vector_store = PineconeVectorStore(
-            index=index, embedding=OpenAIEmbeddings()
+            index=self.index, embedding=TimedOpenAIEmbeddings()
         )
 
     def add_documents(self, documents: list):
@@ -39,8 +96,31 @@ class VectorDB:
     def delete_document(self, doc_ids: List[str]):
         self.vector_store.delete(doc_ids)
 
-    def search(self, query: str, top_k: int = 100):
-        return self.vector_store.similarity_search(query, k=top_k)
+    def search(self, query: str, top_k: int = 100, filter: Optional[Dict] = None):
+        return self.vector_store.similarity_search(query, k=top_k, filter=filter)
+
+    def find_metadata(self, filter: Dict) -> Optional[Dict]:
+        """
+        Return the metadata of a stored vector matching a metadata filter.
+
+        Nothing is embedded, the query vector is a fixed probe and only the
+        filter selects the match.
+        """
+        probe = [1.0] + [0.0] * (EMBEDDING_DIMENSION - 1)
+        matches = self.index.query(
+            vector=probe, top_k=1, filter=filter, include_metadata=True
+        ).matches
+        return (matches[0].metadata or {}) if matches else None
+
+    def iter_metadata(self) -> Iterator[Tuple[str, Dict]]:
+        """Yield the ID and metadata of every stored vector."""
+        for ids in self.index.list():
+            for vector_id, vector in self.index.fetch(ids).vectors.items():
+                yield vector_id, vector.metadata or {}
+
+    def set_metadata(self, vector_id: str, metadata: Dict):
+        """Add or overwrite metadata fields of a stored vector."""
+        self.index.update(id=vector_id, set_metadata=metadata)
 
 
-vdb = VectorDB()
+vdb: LazySingleton[VectorDB] = LazySingleton("pinecone", VectorDB)
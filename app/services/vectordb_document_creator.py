@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict
 
 from langchain_core.documents import Document
 
@@ -19,7 +19,7 @@ class DocumentCreator:
 
     @classmethod
     def create_document_from_pdf(
-        cls, pdf_path: str, gcp_blob_path: str
+        cls, pdf_path: str | BinaryIO, gcp_blob_path: str, user_id: str
     ) -> Dict[str, Any]:
         pdf_info = process_pdf_document(pdf_path)
 
@@ -35,8 +35,10 @@ class DocumentCreator:
         document = Document(
             page_content=page_content,
             metadata={
-                "source": pdf_path,
+                "source": pdf_path if isinstance(pdf_path, str) else gcp_blob_path,
                 "gcp_blob_path": gcp_blob_path,
+                # Owner of the invoice, searches and sends are limited to it
+                "user_id": user_id,
                 "invoice_id": llm_resp.invoice_id,
                 "invoice_date": llm_resp.invoice_date,
                 "invoice_category": llm_resp.invoice_category,
@@ -0,0 +1,106 @@
+"""
+One-off backfill of the owner of invoices indexed without one.
+
+Invoice searches and sends only match vectors whose user_id metadata is the
+user. Vectors indexed before the owner was recorded have no user_id, and the
+duplicate check stops the user from simply sending them again, so their
+owner is written onto them here. The owner is read from:
+
+- the documents/<sender>/<file> layout of the blob path,
+- the document index, which records the blob path of each user's documents,
+- done WhatsApp document jobs, stored at documents/<doc_filename>.
+
+A path claimed by more than one user, and web uploads whose final path is
+not recorded anywhere, are logged and left unowned.
+
+Run once per environment:
+
+    python -m app.utils.backfill_invoice_owners [--dry-run]
+"""
+
+import argparse
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+from app.services.db_service import db_service
+from app.services.document_index import DOCUMENT_INDEX_COLLECTION
+from app.services.vector_db import vdb
+from app.utils.background_job import DB_COLLECTION, JobStatus
+from app.utils.constants import DOCUMENTS_FOLDER
+from app.utils.global_logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def _path_owner(gcp_blob_path: str) -> Optional[str]:
+    # documents/<sender>/<file> is the per-user layout
+    parts = gcp_blob_path.split("/")
+    if len(parts) == 3 and parts[0] == DOCUMENTS_FOLDER and parts[1]:
+        return parts[1]
+    return None
+
+
+def load_owners_by_path() -> Dict[str, Set[str]]:
+    """Map each recorded blob path to the users that stored a document there."""
+    owners: Dict[str, Set[str]] = defaultdict(set)
+    for entry in db_service.read_all(
+        DOCUMENT_INDEX_COLLECTION, fields=["user_id", "gcp_blob_path"]
+    ):
+        if entry.get("user_id") and entry.get("gcp_blob_path"):
+            owners[entry["gcp_blob_path"]].add(entry["user_id"])
+    for job in db_service.read_all(
+        DB_COLLECTION, fields=["sender_id", "doc_filename", "status"]
+    ):
+        # Only WhatsApp document jobs have a sender_id
+        if job.get("status") != str(JobStatus.DONE):
+            continue
+        if job.get("sender_id") and job.get("doc_filename"):
+            path = f"{DOCUMENTS_FOLDER}/{job['doc_filename']}"
+            owners[path].add(job["sender_id"])
+    return owners
+
+
+def backfill_invoice_owners(dry_run: bool = False) -> Dict[str, int]:
+    """
+    Write the owner onto every vector without a user_id.
+
+    Args:
+        dry_run: Only count and log, do not update the vectors
+
+    Returns:
+        Dict[str, int]: Number of vectors updated, ambiguous and unknown
+    """
+    owners_by_path = load_owners_by_path()
+    counts = {"updated": 0, "ambiguous": 0, "unknown": 0}
+    for vector_id, metadata in vdb.iter_metadata():
+        if metadata.get("user_id"):
+            continue
+        gcp_blob_path = metadata.get("gcp_blob_path") or ""
+        owner = _path_owner(gcp_blob_path)
+        if owner is None:
+            candidates = owners_by_path.get(gcp_blob_path, set())
+            if len(candidates) > 1:
+                logger.warning(
+                    f"Vector {vector_id} at {gcp_blob_path} has several owners, skipped"
+                )
+                counts["ambiguous"] += 1
+                continue
+            owner = next(iter(candidates), None)
+        if owner is None:
+            logger.warning(f"No owner found for vector {vector_id} at {gcp_blob_path}")
+            counts["unknown"] += 1
+            continue
+        if not dry_run:
+            vdb.set_metadata(vector_id, {"user_id": owner})
+        logger.info(f"Vector {vector_id} at {gcp_blob_path} belongs to {owner}")
+        counts["updated"] += 1
+    logger.info(f"Invoice owner backfill finished: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only log the owners found"
+    )
+    backfill_invoice_owners(parser.parse_args().dry_run)
@@ -1,22 +1,28 @@
+import tempfile
 from datetime import UTC, datetime
 from enum import Enum
-from typing import Dict
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional
 from uuid import uuid4
 
+from firebase_admin import firestore
 from pydantic import BaseModel
 
-from app.services.db_service import db_service
+from app.config import get_settings
+from app.services.db_service import CoalescingWriter
+from app.services.document_index import document_index
 from app.services.gcp_storage import gcp_storage
 from app.services.vectordb_document_creator import DocumentCreator
+from app.utils.constants import DOCUMENTS_FOLDER
 from app.utils.global_logging import get_logger
 from app.utils.helpers import remove_file_if_exists
-from app.utils.whatsapp import download_whatsapp_media, send_whatsapp_message
+from app.utils.whatsapp import iter_whatsapp_media, send_whatsapp_message
 
 
 class JobStatus(Enum):
     IN_PROGRESS = "in-progress"
     DONE = "done"
     FAILED = "failed"
+    DUPLICATE = "duplicate"
 
 
 class Job(BaseModel):
@@ -42,25 +48,37 @@ class WebDocumentJob(BaseModel):
 
 DB_COLLECTION = "background_jobs"
 
+settings = get_settings()
+
 logger = get_logger(__name__)
 
 
 class BackgroundJob:
-    def __init__(self):
+    def __init__(self, writer: Optional[CoalescingWriter] = None):
         self.job_id = str(uuid4())
         self.data = {}
+        # Updates within JOB_WRITE_WINDOW_SECONDS are merged into one write
+        self.writer = writer or CoalescingWriter()
 
     def add_job_to_db(self, data: Dict):
         data.update({"job_id": self.job_id})
         data.update({"started_at": datetime.now(UTC)})
-        db_service.write(DB_COLLECTION, self.job_id, data)
+        self.writer.write(DB_COLLECTION, self.job_id, data)
         self.data = self.data | data
 
-    def update_job_status(self, status: JobStatus):
-        if status == JobStatus.DONE or status == JobStatus.FAILED:
-            self.data.update({"completed_at": datetime.now(UTC)})
-        self.data.update({"status": str(status)})
-        self.add_job_to_db(self.data)
+    def update_job_status(self, status: JobStatus, fields: Optional[Dict] = None):
+        """
+        Update the status, and any other fields, of the job.
+
+        A status change ends a stage of the job, so it is written right away
+        with the progress before it.
+        """
+        fields = (fields or {}) | {"status": str(status)}
+        if status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.DUPLICATE):
+            fields.update({"completed_at": datetime.now(UTC)})
+        self.data.update(fields)
+        self.writer.update(DB_COLLECTION, self.job_id, fields)
+        self.writer.flush()
 
     def update_job_progress(self, progress: Dict):
         if progress is not None and isinstance(progress, dict):
@@ -69,81 +87,105 @@ class BackgroundJob:
             self.data["logs"].append(progress)
         else:
             self.data.update({"logs": [progress]})
-        self.add_job_to_db(self.data)
+        # Only the new event is sent, not the logs written before it
+        self.writer.update(
+            DB_COLLECTION, self.job_id, {"logs": firestore.ArrayUnion([progress])}
+        )
+
+    def close(self):
+        """Write the pending updates of the job."""
+        self.writer.flush()
+
+
+def tee_chunks(chunks: Iterable[bytes], file: BinaryIO) -> Iterator[bytes]:
+    """Yield chunks unchanged while also writing them to file."""
+    for chunk in chunks:
+        file.write(chunk)
+        yield chunk
+
+
+def stream_document_to_gcs(
+    document: DocumentJob, gcp_blob_path: str
+) -> Optional[tempfile.SpooledTemporaryFile]:
+    """
+    Stream a WhatsApp document into GCS and a spooled buffer in a single pass.
+
+    The buffer stays in memory up to MEDIA_SPOOL_MAX_BYTES and only spills to
+    TEMP_FILE_PATH for larger documents.
+
+    Args:
+        document: The document job
+        gcp_blob_path: Destination path in GCS
+
+    Returns:
+        Optional[SpooledTemporaryFile]: Buffer positioned at the start of the
+        document, or None if streaming failed
+    """
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=settings.media_spool_max_bytes, dir=settings.temp_file_path
+    )
+    try:
+        gcp_storage.upload_chunks(
+            tee_chunks(iter_whatsapp_media(document.doc_id), spool),
+            gcp_blob_path,
+            document.doc_mime,
+            settings.media_chunk_size,
+        )
+    except Exception as e:
+        logger.error(f"Error streaming document {document.doc_id} to GCS: {e}")
+        spool.close()
+        return None
+    spool.seek(0)
+    return spool
 
 
 def process_document(document: DocumentJob):
+    job = BackgroundJob()
     try:
         logger.info(f"Processing document job: {document.doc_id}")
-        job = BackgroundJob()
         job.add_job_to_db(
             document.model_dump() | {"status": str(JobStatus.IN_PROGRESS)}
         )
         logger.info(f"Started processing document job: {job.job_id}")
-        # Download the document from WhatsApp
-        job.update_job_progress({"message": "Downloading document from WhatsApp..."})
 
-        file_path = download_whatsapp_media(
-            document.doc_id, "document", document.sender_id
-        )
+        if document.doc_mime != "application/pdf":
+            # Handle other document types
+            logger.info(f"Unsupported document type: {document.doc_mime}")
+            job.update_job_status(JobStatus.FAILED)
+            job.update_job_progress({"message": "Unsupported document type."})
+            send_whatsapp_message(
+                document.sender_id,
+                f"I received your document ({document.doc_filename}) but I don't know how to process this type of file yet.",
+            )
+            return
 
-        job.update_job_progress({"message": "Downloaded document."})
-        if file_path:
-            # Process based on document type
-            if document.doc_mime == "application/pdf":
-                # Upload file to GCP Storage
-                job.update_job_progress(
-                    {"message": "Uploading document to GCP Storage..."}
-                )
-                gcp_blob_path = f"documents/{document.doc_filename}"
-                job.update_job_progress({"message": f"Uploading to {gcp_blob_path}..."})
-                gcp_storage.upload_file(file_path, gcp_blob_path)
-                job.update_job_progress(
-                    {"message": "Uploaded document to GCP Storage."}
-                )
-                # Process PDF document (e.g., extract bill information)
-                # Index document in Vector DB
-                job.update_job_progress(
-                    {"message": "Indexing the document in pinecone..."}
-                )
-                bill_data = DocumentCreator.create_document_from_pdf(
-                    file_path, gcp_blob_path
-                )
-                job.update_job_progress(
-                    {"message": "Indexed the document in pinecone."}
-                )
+        # Skip the whole pipeline for a document the user has sent before
+        indexed = document_index.find(document.sender_id, document.doc_hash)
+        if indexed:
+            logger.info(
+                f"Document {document.doc_id} already processed in job {indexed.get('job_id')}"
+            )
+            job.update_job_status(
+                JobStatus.DUPLICATE, {"duplicate_of": indexed.get("job_id")}
+            )
+            job.update_job_progress({"message": "Document was already processed."})
+            send_whatsapp_message(
+                document.sender_id,
+                f"I've already processed this document earlier.\n*Summary:* {indexed.get('summary', '')}",
+            )
+            return
 
-                # Send a response back to the user
-                if bill_data.get("processed", False):
-                    summary = bill_data.get("page_content", "")
-                    job.update_job_status(JobStatus.DONE)
-                    job.update_job_progress({"message": "Sending response to user..."})
-                    response_msg = f"I've received your PDF document and processed it.\n*Summary:* {summary}"
-                    # You could add more details from the processed data here
-                else:
-                    job.update_job_status(JobStatus.FAILED)
-                    job.update_job_progress(
-                        {"message": "Failed to process the document."}
-                    )
-                    response_msg = (
-                        "I received your document but had trouble processing it."
-                    )
-
-                job.update_job_progress({"message": "Sending response to user..."})
-                send_whatsapp_message(document.sender_id, response_msg)
-                # Remove temporary files
-                job.update_job_progress({"message": "Cleaning up temporary files..."})
-                remove_file_if_exists(file_path)
-            else:
-                # Handle other document types
-                logger.info(f"Unsupported document type: {document.doc_mime}")
-                job.update_job_status(JobStatus.FAILED)
-                job.update_job_progress({"message": "Unsupported document type."})
-                send_whatsapp_message(
-                    document.sender_id,
-                    f"I received your document ({document.doc_filename}) but I don't know how to process this type of file yet.",
-                )
-        else:
+        # Stream the document from WhatsApp to GCP Storage
+        # Per user, so that two users' files of the same name do not collide
+        gcp_blob_path = (
+            f"{DOCUMENTS_FOLDER}/{document.sender_id}/{document.doc_filename}"
+        )
+        job.update_job_progress(
+            {"message": f"Streaming document from WhatsApp to {gcp_blob_path}..."}
+        )
+        pdf_file = stream_document_to_gcs(document, gcp_blob_path)
+
+        if pdf_file is None:
             logger.error(f"Failed to download document: {document.doc_id}")
             job.update_job_status(JobStatus.FAILED)
             job.update_job_progress({"message": "Failed to download the document."})
@@ -151,6 +193,41 @@ def process_document(document: DocumentJob):
                 document.sender_id,
                 "I had trouble downloading your document. Please try sending it again.",
             )
+            return
+
+        with pdf_file:
+            job.update_job_progress({"message": "Uploaded document to GCP Storage."})
+            # Process PDF document (e.g., extract bill information)
+            # Index document in Vector DB
+            job.update_job_progress({"message": "Indexing the document in pinecone..."})
+            bill_data = DocumentCreator.create_document_from_pdf(
+                pdf_file, gcp_blob_path, document.sender_id
+            )
+            job.update_job_progress({"message": "Indexed the document in pinecone."})
+
+        # Send a response back to the user
+        if bill_data.get("processed", False):
+            summary = bill_data.get("page_content", "")
+            job.update_job_status(JobStatus.DONE)
+            document_index.save(
+                document.sender_id,
+                document.doc_hash,
+                {
+                    "job_id": job.job_id,
+                    "doc_filename": document.doc_filename,
+                    "gcp_blob_path": gcp_blob_path,
+                    "summary": summary,
+                },
+            )
+            response_msg = f"I've received your PDF document and processed it.\n*Summary:* {summary}"
+            # You could add more details from the processed data here
+        else:
+            job.update_job_status(JobStatus.FAILED)
+            job.update_job_progress({"message": "Failed to process the document."})
+            response_msg = "I received your document but had trouble processing it."
+
+        job.update_job_progress({"message": "Sending response to user..."})
+        send_whatsapp_message(document.sender_id, response_msg)
     except Exception as e:
         logger.error(f"Error processing document job {document.doc_id}: {e}")
         job.update_job_status(JobStatus.FAILED)
@@ -161,6 +238,8 @@ def process_document(document: DocumentJob):
             document.sender_id,
             "An error occurred while processing your document. Please try again later.",
         )
+    finally:
+        job.close()
 
 
 def process_web_document(
@@ -174,9 +253,9 @@ def process_web_document(
         gcs_file_path: Path to the file in GCS
         temp_file_path: Temporary local file path
     """
+    job = BackgroundJob()
     try:
         logger.info(f"Processing web document job: {web_document.gcs_path}")
-        job = BackgroundJob()
         job.add_job_to_db(
             web_document.model_dump() | {"status": str(JobStatus.IN_PROGRESS)}
         )
@@ -190,7 +269,7 @@ def process_web_document(
             job.update_job_progress({"message": "Indexing the document in pinecone..."})
             gcp_document = gcp_storage.move_to_documents_folder(gcs_file_path)
             bill_data = DocumentCreator.create_document_from_pdf(
-                temp_file_path, gcp_document
+                temp_file_path, gcp_document, web_document.user_id
             )
             job.update_job_progress({"message": "Indexed the document in pinecone."})
 
@@ -225,3 +304,4 @@ def process_web_document(
         # Clean up temporary file
         job.update_job_progress({"message": "Cleaning up temporary files..."})
         remove_file_if_exists(temp_file_path)
+        job.close()
@@ -0,0 +1,176 @@
+"""
+Concurrency limits for calls to the LLM provider.
+
+A ConcurrencyLimiter is a counting semaphore that can be acquired both from
+worker threads and from coroutines, so sync and async callers share the same
+limit. Waiters are served in arrival order and the time each of them spends
+waiting is recorded, so bursts queue up here instead of hitting the provider's
+rate limits all at once.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from app.config import get_settings
+from app.utils.metrics import limiter_in_flight, limiter_wait_seconds, limiter_waiting
+
+settings = get_settings()
+
+
+class LimiterTimeoutError(Exception):
+    """Raised when a slot could not be acquired before the timeout."""
+
+
+class _ThreadWaiter:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def wake(self, limiter: "ConcurrencyLimiter"):
+        self.event.set()
+
+
+class _AsyncWaiter:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def wake(self, limiter: "ConcurrencyLimiter"):
+        def hand_over():
+            if self.future.cancelled():
+                # The waiter gave up after it was handed the slot
+                limiter.release()
+            else:
+                self.future.set_result(None)
+
+        self.loop.call_soon_threadsafe(hand_over)
+
+
+class ConcurrencyLimiter:
+    """
+    Fair counting semaphore shared by threads and coroutines.
+
+    Args:
+        name: Name used as the metrics label
+        limit: Maximum number of slots held at the same time
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._available = limit
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, waiter) -> bool:
+        """Take a free slot, or queue the waiter behind the others."""
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                self._update_gauges()
+                return True
+            self._waiters.append(waiter)
+            self._update_gauges()
+            return False
+
+    def _abandon(self, waiter) -> bool:
+        """
+        Remove a waiter that timed out or was cancelled.
+
+        Returns:
+            bool: False if the waiter had already been handed a slot
+        """
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._update_gauges()
+                return True
+            return False
+
+    def release(self):
+        """Free a slot, handing it to the longest waiting caller if any."""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+            else:
+                waiter = None
+                self._available += 1
+            self._update_gauges()
+        if waiter is not None:
+            waiter.wake(self)
+
+    def _update_gauges(self):
+        limiter_in_flight.set(self.limit - self._available, limiter=self.name)
+        limiter_waiting.set(len(self._waiters), limiter=self.name)
+
+    def _record_wait(self, started: float):
+        limiter_wait_seconds.observe(time.perf_counter() - started, limiter=self.name)
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Block the calling thread until a slot is free.
+
+        Raises:
+            LimiterTimeoutError: If no slot was free within timeout seconds
+        """
+        started = time.perf_counter()
+        waiter = _ThreadWaiter()
+        if not self._try_acquire(waiter):
+            if not waiter.event.wait(timeout) and self._abandon(waiter):
+                self._record_wait(started)
+                raise LimiterTimeoutError(
+                    f"No {self.name} slot free within {timeout:.1f}s"
+                )
+        self._record_wait(started)
+
+    async def acquire_async(self, timeout: Optional[float] = None):
+        """
+        Wait on the event loop until a slot is free.
+
+        Raises:
+            LimiterTimeoutError: If no slot was free within timeout seconds
+        """
+        started = time.perf_counter()
+        waiter = _AsyncWaiter()
+        if not self._try_acquire(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if not self._abandon(waiter) and not waiter.future.cancel():
+                    # The slot was handed over before we gave up
+                    self.release()
+                self._record_wait(started)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise LimiterTimeoutError(
+                        f"No {self.name} slot free within {timeout:.1f}s"
+                    )
+                raise
+        self._record_wait(started)
+
+    @contextmanager
+    def limit_sync(self, timeout: Optional[float] = None) -> Iterator[None]:
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def limit_async(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire_async(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+chat_limiter = ConcurrencyLimiter("chat", settings.openai_chat_concurrency)
+structured_limiter = ConcurrencyLimiter(
+    "structured", settings.openai_structured_concurrency
+)
+embedding_limiter = ConcurrencyLimiter(
+    "embedding", settings.openai_embedding_concurrency
+)
@@ -1,4 +1,8 @@
 DB_COLLECTION = "background_jobs"
 DEFAULT_PAGE_SIZE = 15
+# Response header with the cursor of the next page of a list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+# GCS folder of stored documents, WhatsApp documents go in a folder per sender
+DOCUMENTS_FOLDER = "documents"
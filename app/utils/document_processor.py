@@ -9,19 +9,19 @@ billing information.
 import logging
 import os
 import tempfile
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict
 
 from PyPDF2 import PdfReader
 
 logger = logging.getLogger(__name__)
 
 
-def process_pdf_document(file_path: str) -> Dict[str, Any]:
+def process_pdf_document(file_path: str | BinaryIO) -> Dict[str, Any]:
     """
     Process a PDF document to extract text information.
 
     Args:
-        file_path (str): Path to the PDF file
+        file_path (str | BinaryIO): Path to the PDF file or a binary file object
     Returns:
         Dict[str, Any]: Extracted text information
     """
@@ -1,9 +1,13 @@
+import base64
+import json
 import logging
 import os
 import uuid
 from datetime import UTC, datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import msgpack
+import zstandard
 from langchain_core.messages import (
     AIMessage,
     BaseMessage,
@@ -57,6 +61,112 @@ def list_to_langchain_msg(_list: List[Dict]) -> List[BaseMessage]:
     return lang_chain_msgs
 
 
+# Header of encoded histories: magic, codec version and serializer
+HISTORY_BLOB_MAGIC = b"JH"
+HISTORY_BLOB_VERSION = 1
+HISTORY_SERIALIZERS = {"msgpack": 1, "json": 2}
+HISTORY_ZSTD_LEVEL = 3
+
+
+def encode_history(msg_dicts: List[Dict], serializer: str = "msgpack") -> bytes:
+    """
+    Encodes messages from langchain_msg_to_dict as a zstd compressed blob.
+
+    Args:
+        msg_dicts (List[Dict]): The messages as dicts.
+        serializer (str): "msgpack" or "json".
+
+    Returns:
+        bytes: A 4 byte header followed by the compressed messages.
+    """
+    if serializer == "msgpack":
+        payload = msgpack.packb(msg_dicts, use_bin_type=True)
+    elif serializer == "json":
+        payload = json.dumps(msg_dicts, separators=(",", ":")).encode()
+    else:
+        raise ValueError(f"Unsupported history serializer: {serializer}")
+
+    header = HISTORY_BLOB_MAGIC + bytes(
+        [HISTORY_BLOB_VERSION, HISTORY_SERIALIZERS[serializer]]
+    )
+    compressor = zstandard.ZstdCompressor(level=HISTORY_ZSTD_LEVEL)
+    return header + compressor.compress(payload)
+
+
+def decode_history(blob: bytes) -> List[Dict]:
+    """
+    Decodes a blob from encode_history back into message dicts.
+
+    Args:
+        blob (bytes): The encoded messages.
+
+    Returns:
+        List[Dict]: The messages, ready for list_to_langchain_msg.
+    """
+    if blob[:2] != HISTORY_BLOB_MAGIC:
+        raise ValueError("Not an encoded chat history")
+    version, serializer = blob[2], blob[3]
+    if version != HISTORY_BLOB_VERSION:
+        raise ValueError(f"Unsupported chat history codec version: {version}")
+
+    payload = zstandard.ZstdDecompressor().decompress(blob[4:])
+    if serializer == HISTORY_SERIALIZERS["msgpack"]:
+        return msgpack.unpackb(payload, raw=False)
+    if serializer == HISTORY_SERIALIZERS["json"]:
+        return json.loads(payload)
+    raise ValueError(f"Unsupported chat history serializer: {serializer}")
+
+
+def encode_cursor(value: Any, document_id: str) -> str:
+    """
+    Encodes the position after a document as an opaque page token.
+
+    Args:
+        value (Any): The document's value of the ordering field, a datetime,
+            string or number.
+        document_id (str): The document's ID, orders documents of equal value.
+
+    Returns:
+        str: A URL safe token for decode_cursor.
+    """
+    if isinstance(value, datetime):
+        payload = {"t": value.isoformat(), "id": document_id}
+    else:
+        payload = {"v": value, "id": document_id}
+    token = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(",", ":")).encode()
+    )
+    return token.decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[Any, str]:
+    """
+    Decodes a token from encode_cursor.
+
+    Args:
+        token (str): The page token.
+
+    Raises:
+        ValueError: If the token was not made by encode_cursor.
+
+    Returns:
+        Tuple[Any, str]: The ordering value and the document ID.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        document_id = payload["id"]
+        if "t" in payload:
+            value = datetime.fromisoformat(payload["t"])
+        else:
+            value = payload["v"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid page cursor") from e
+    if not isinstance(document_id, str):
+        raise ValueError("Invalid page cursor")
+    return value, document_id
+
+
 def get_ttl_key(ttl_seconds: Optional[int] = 300) -> Dict:
     """
     Returns a dictionary with a TTL key for Firebase database.
@@ -0,0 +1,81 @@
+"""
+Lazily initialized singletons.
+
+Service modules expose their singletons through LazySingleton so that
+importing them does no network work. The wrapped object is built on first
+attribute access, or ahead of time by warm_up() once the server is listening.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+from app.utils.global_logging import get_logger
+from app.utils.startup_profile import startup_profile
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# All lazy singletons by name, in creation order
+lazy_singletons: Dict[str, "LazySingleton"] = {}
+
+
+class LazySingleton(Generic[T]):
+    """
+    Proxy that builds the wrapped object on first use.
+
+    Args:
+        name: Name used in logs and the startup profile
+        factory: Callable creating the wrapped object
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        lazy_singletons[name] = self
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        """Return the wrapped object, creating it if needed."""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    elapsed = time.perf_counter() - started
+                    startup_profile.record_init(self._name, elapsed)
+                    logger.info(f"Initialized {self._name} in {elapsed * 1000:.1f} ms")
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        # Private and dunder probes (abc, mock, inspect, pickle) must not
+        # trigger initialization
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        return f"LazySingleton({self._name}, initialized={self.initialized})"
+
+
+def warm_up(stop: Optional[threading.Event] = None):
+    """
+    Initialize every lazy singleton, logging failures instead of raising.
+
+    Args:
+        stop: Set on shutdown, no further singleton is initialized once it is
+    """
+    for name, singleton in list(lazy_singletons.items()):
+        if stop is not None and stop.is_set():
+            logger.info("Warm-up stopped")
+            return
+        try:
+            singleton.get()
+        except Exception as e:
+            logger.error(f"Failed to initialize {name}: {e}")
@@ -1,17 +1,25 @@
 import logging
-from typing import Any, Dict, List, Optional
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.documents import Document
 from langchain_core.tools import tool
 
-from app.services.db_service import db_service
+from app.config import get_settings
+from app.services.chat_history_cache import chat_history_cache
 from app.services.gcp_storage import gcp_storage
 from app.services.vector_db import vdb
-from app.utils.helpers import remove_file_if_exists
-from app.utils.whatsapp import send_reactions, send_whatsapp_media
+from app.utils.constants import DOCUMENTS_FOLDER
+from app.utils.metrics import tool_seconds
+from app.utils.whatsapp import send_reactions, send_whatsapp_document
 
 logger = logging.getLogger(__name__)
-DB_COLLECTION_NAME = "chat_history"
+settings = get_settings()
+# Upper bound of invoices sent by one search_and_send_invoices call
+MAX_INVOICES_PER_SEND = 5
 
 
 @tool
@@ -24,15 +32,31 @@ def delete_context(user_id: str) -> str:
     logger.info("Deleting user context")
     logger.info(f"User ID: {user_id}")
     logger.info(f"Clearing chat history for user {user_id}")
-    db_service.delete(DB_COLLECTION_NAME, user_id)
+    chat_history_cache.delete(user_id)
     logger.info(f"Chat history cleared for user {user_id}")
     # Code to delete user context from database goes here
 
     return "Current discussion context has been deleted from DB. We can send leaving greeting to the user."
 
 
+def _owner_filter(user_id: str, **metadata: Any) -> Dict[str, Any]:
+    # Vector DB filter limiting a search to the invoices of one user
+    owner: Dict[str, Any] = {"user_id": user_id}
+    if settings.invoice_unowned_fallback:
+        # Invoices indexed before owners were recorded, until backfilled
+        owner = {"$or": [owner, {"user_id": {"$exists": False}}]}
+    return owner | metadata
+
+
+def _is_owner(user_id: str, metadata: Dict[str, Any]) -> bool:
+    owner = metadata.get("user_id")
+    if owner is None:
+        return settings.invoice_unowned_fallback
+    return owner == user_id
+
+
 @tool
-def query_for_invoices(query: str) -> List[Document]:
+def query_for_invoices(user_id: str, query: str) -> List[Document]:
     """
     User will be able to search/find/query the invoices by
 
@@ -41,17 +65,19 @@ def query_for_invoices(query: str) -> List[Document]:
     - Invoice by month and year
     - Invoice Category
 
+    Only the invoices of the user are searched.
+
     Vector DB is storing information in following format.
 
     "Provider: Acme Inc. Date: 2024-06-15(YYYY-MM-DD) Item: Laptop Model XYZ Category: Electronics"
 
     Every invoice have some meta information stored with it.
 
-    meta key 'gcp_blob_path' is Google cloud storage file path.
-    this GCP path is to get the document from cloud storage.
+    Use send_invoice with the invoice_cloud_location of a result to send that
+    invoice to the user, or search_and_send_invoices to search and send at once.
     """
     logger.info(f"Searching vector DB for query: {query}")
-    results = vdb.search(query)
+    results = vdb.search(query, filter=_owner_filter(user_id))
 
     logger.info(f"Found {len(results)} documents")
     page_content: List[str] = [
@@ -61,52 +87,137 @@ def query_for_invoices(query: str) -> List[Document]:
     return f"Found {len(results)} documents matching your query. Here is the content: ```{page_content}```"
 
 
+def _invoice_file_name(metadata: Dict[str, Any]) -> str:
+    provider = metadata.get("provider") or "invoice"
+    invoice_date = metadata.get("invoice_date") or ""
+    name = "_".join(part for part in (provider, invoice_date) if part)
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + ".pdf"
+
+
+def _owns_invoice(
+    user_id: str, gcp_blob_path: str, metadata: Optional[Dict[str, Any]] = None
+) -> bool:
+    """
+    Check that an invoice belongs to the user.
+
+    Args:
+        user_id: WhatsApp ID of the user
+        gcp_blob_path: Location of the invoice in GCS
+        metadata: Vector DB metadata of the invoice if the caller has it,
+            e.g. a search hit. Otherwise the path tells the owner of a
+            WhatsApp document, and other invoices are looked up by metadata
+            without a similarity search
+    """
+    if metadata is None:
+        if gcp_blob_path.startswith(f"{DOCUMENTS_FOLDER}/{user_id}/"):
+            return True
+        metadata = (
+            vdb.find_metadata(_owner_filter(user_id, gcp_blob_path=gcp_blob_path))
+            or {}
+        )
+    return (
+        _is_owner(user_id, metadata)
+        and metadata.get("gcp_blob_path") == gcp_blob_path
+    )
+
+
+def _send_stored_invoice(
+    user_id: str,
+    gcp_blob_path: str,
+    caption: str,
+    file_name: str,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Tuple[bool, str]:
+    """Download an invoice of the user from GCS into memory and send it."""
+    if not _owns_invoice(user_id, gcp_blob_path, metadata):
+        logger.warning(f"User {user_id} does not own invoice {gcp_blob_path}")
+        return False, "Invoice not found."
+    content = gcp_storage.read_bytes(gcp_blob_path)
+    return send_whatsapp_document(
+        user_id, content, os.path.basename(gcp_blob_path), caption, file_name
+    )
+
+
 @tool
-def download_invoice(gcp_blob_path: str) -> str:
+def search_and_send_invoices(user_id: str, query: str, max_invoices: int = 1) -> str:
     """
-    Download invoice document from Google Cloud Storage.
+    Search the stored invoices and send the best matching invoice documents to
+    the user as WhatsApp documents, in one step.
+
+    Use this when the user asks to be sent an invoice, e.g. "send me my
+    electricity bill for March". Search the same way as query_for_invoices.
 
     Args:
-        gcp_blob_path (str): The GCP blob path of the invoice document.
+        user_id (str): The ID of the user to send the invoices to.
+        query (str): What to search for, e.g. provider, items, month and year.
+        max_invoices (int): How many of the best matches to send, at most 5.
 
     Returns:
-        str: Confirmation message.
+        str: The invoices that were sent.
     """
-    logger.info(f"Downloading invoice from GCP: {gcp_blob_path}")
-    temp_file_path = gcp_storage.read_file(gcp_blob_path)
-    # Code to download the invoice from GCP goes here
-    return f"Invoice downloaded from GCP to this local file {temp_file_path}"
+    max_invoices = min(max(max_invoices, 1), MAX_INVOICES_PER_SEND)
+    logger.info(f"Searching vector DB to send invoices for query: {query}")
+    results = vdb.search(query, top_k=max_invoices * 2, filter=_owner_filter(user_id))
+
+    sent: List[str] = []
+    failed: List[str] = []
+    seen = set()
+    for doc in results:
+        gcp_blob_path = doc.metadata.get("gcp_blob_path")
+        if not gcp_blob_path or gcp_blob_path in seen:
+            continue
+        seen.add(gcp_blob_path)
+        success, message = _send_stored_invoice(
+            user_id,
+            gcp_blob_path,
+            doc.metadata.get("summary") or doc.page_content,
+            _invoice_file_name(doc.metadata),
+            doc.metadata,
+        )
+        if success:
+            sent.append(doc.page_content)
+        else:
+            logger.error(f"Failed to send invoice to user {user_id}: {message}")
+            failed.append(doc.page_content)
+        if len(seen) == max_invoices:
+            break
+
+    if not seen:
+        return "No invoices found matching the query, nothing was sent."
+    response = f"Sent {len(sent)} invoice(s) to the user: ```{sent}```"
+    if failed:
+        response += f" Failed to send {len(failed)} invoice(s): ```{failed}```"
+    return response
 
 
 @tool
-def send_downloaded_invoice_user(
+def send_invoice(
     user_id: str,
-    invoice_path: str,
+    invoice_cloud_location: str,
     whats_app_file_caption: str,
     whats_app_file_name: str,
 ) -> str:
     """
-    Send the downloaded invoice document to the user as WhatsApp message.
+    Send an invoice found with query_for_invoices to the user as a WhatsApp
+    document, in one step.
 
     Args:
         user_id (str): The ID of the user to send the invoice to.
-        invoice_path (str): The local path to the downloaded invoice document.
+        invoice_cloud_location (str): The invoice_cloud_location of the invoice.
         whats_app_file_caption (str): The caption for the WhatsApp file message.
         whats_app_file_name (str): The filename for the WhatsApp file message.
 
     Returns:
         str: Confirmation message.
     """
-    logger.info(f"Sending downloaded invoice to user {user_id}: {invoice_path}")
-    success, message = send_whatsapp_media(
-        user_id, invoice_path, whats_app_file_caption, whats_app_file_name
+    logger.info(f"Sending invoice {invoice_cloud_location} to user {user_id}")
+    success, message = _send_stored_invoice(
+        user_id, invoice_cloud_location, whats_app_file_caption, whats_app_file_name
     )
     if not success:
         logger.error(f"Failed to send invoice to user {user_id}: {message}")
         return f"Failed to send invoice to user {user_id}: {message}"
-    # Remove temporary files
-    remove_file_if_exists(invoice_path)
-    return f"Invoice sent to user {user_id}: {invoice_path}"
+    return f"Invoice sent to user {user_id}."
 
 
 @tool
@@ -134,33 +245,160 @@ def send_message_reaction(user_id: str, message_id: str, reaction: str) -> str:
 functions = {
     "delete_context": delete_context,
     "query_for_invoices": query_for_invoices,
-    "download_invoice": download_invoice,
-    "send_downloaded_invoice_user": send_downloaded_invoice_user,
+    "search_and_send_invoices": search_and_send_invoices,
+    "send_invoice": send_invoice,
     "send_message_reaction": send_message_reaction,
 }
 
 llm_tools: List[Any] = [
     delete_context,
     query_for_invoices,
-    download_invoice,
-    send_downloaded_invoice_user,
+    search_and_send_invoices,
+    send_invoice,
     send_message_reaction,
 ]
 
 
-def run_llm_tools(tools: List[Dict[str, Any]], history: Any, user_id: str) -> Any:
+# Tool result recorded for calls skipped because the turn ran out of time
+TOOL_SKIPPED_MESSAGE = "Tool call skipped: the turn ran out of time."
+
+# Per-tool timeouts in seconds, other tools use settings.tool_timeout_seconds
+TOOL_TIMEOUTS: Dict[str, float] = {
+    "delete_context": 10,
+    "send_message_reaction": 10,
+    "query_for_invoices": 20,
+    "search_and_send_invoices": 90,
+    "send_invoice": 60,
+}
+
+# Tools that message the user, a call that timed out may still deliver
+SENDING_TOOLS = {"search_and_send_invoices", "send_invoice", "send_message_reaction"}
+
+# Tool calls of one LLM response run concurrently in this pool
+tool_executor = ThreadPoolExecutor(
+    max_workers=settings.tool_executor_workers, thread_name_prefix="llm-tool"
+)
+
+
+class _ToolTiming:
+    """
+    Records the tool_seconds sample of a call once.
+
+    A call that times out keeps running, so the timeout and the call's own
+    completion race to record it and only the first one does.
+    """
+
+    def __init__(self, tool_name: str):
+        self.tool_name = tool_name
+        # The call's timeout counts from its submission
+        self.submitted_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._recorded = False
+
+    def record(self, seconds: float, outcome: str):
+        with self._lock:
+            if self._recorded:
+                return
+            self._recorded = True
+        tool_seconds.observe(seconds, tool=self.tool_name, outcome=outcome)
+
+
+def _invoke_tool(
+    tool_name: str, tool_func: Any, tool_args: Dict[str, Any], timing: _ToolTiming
+) -> Any:
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        logger.info(f"Invoking tool: {tool_name} with args: {tool_args}")
+        return tool_func.invoke(tool_args)
+    except Exception as e:
+        outcome = "error"
+        logger.error(f"Error invoking tool {tool_name}: {str(e)}")
+        return str(e)
+    finally:
+        timing.record(time.perf_counter() - started, outcome)
+
+
+def run_llm_tools(
+    tools: List[Dict[str, Any]],
+    history: Any,
+    user_id: str,
+    deadline: Optional[float] = None,
+) -> Any:
+    """
+    Run the tool calls of an LLM response and add their results to the history.
+
+    The calls run concurrently, each with its own timeout counted from its
+    submission, and their results
+    are added in the order the LLM requested them. A call that times out is
+    left running and its result is discarded. The model is told a timed out
+    send may still be delivered, so that it does not send it twice.
+
+    Args:
+        tools: Tool calls from the LLM response
+        history: Chat history to add the tool messages to
+        user_id: WhatsApp ID of the user the turn belongs to
+        deadline: time.monotonic() value after which calls are no longer waited for
+
+    Returns:
+        Any: The chat history
+    """
+    futures: List[Optional[Future]] = []
+    timings: List[Optional[_ToolTiming]] = []
     for tool in tools:
         tool_name = tool.get("name")
         tool_args = tool.get("args", {})
-        tool_call_id = tool.get("id", "")
         tool_func = functions.get(tool_name, None)
 
-        if callable(tool_func):
-            try:
-                logger.info(f"Invoking tool: {tool_name} with args: {tool_args}")
-                resp = tool_func.invoke(tool_args | {"user_id": user_id})
-            except Exception as e:
-                logger.error(f"Error invoking tool {tool_name}: {str(e)}")
-                resp = str(e)
+        if tool_func is None or (deadline is not None and time.monotonic() >= deadline):
+            futures.append(None)
+            timings.append(None)
+            continue
+        timing = _ToolTiming(tool_name)
+        timings.append(timing)
+        futures.append(
+            tool_executor.submit(
+                _invoke_tool,
+                tool_name,
+                tool_func,
+                tool_args | {"user_id": user_id},
+                timing,
+            )
+        )
+
+    # Every tool call needs a result for the history to stay valid
+    for tool, future, timing in zip(tools, futures, timings):
+        tool_name = tool.get("name")
+        tool_call_id = tool.get("id", "")
+
+        if future is None:
+            if tool_name in functions:
+                logger.warning(f"Skipping tool {tool_name}, turn deadline reached")
+                resp = TOOL_SKIPPED_MESSAGE
+            else:
+                logger.error(f"LLM requested unknown tool {tool_name}")
+                resp = f"Unknown tool {tool_name}."
             history.add_tool_message(resp, tool_call_id=tool_call_id)
+            continue
+
+        # Earlier calls were waited for while this one ran, not before it
+        now = time.monotonic()
+        timeout = TOOL_TIMEOUTS.get(tool_name, settings.tool_timeout_seconds)
+        timeout -= now - timing.submitted_at
+        if deadline is not None:
+            timeout = min(timeout, deadline - now)
+        try:
+            resp = future.result(timeout=max(timeout, 0))
+        except TimeoutError:
+            elapsed = time.monotonic() - timing.submitted_at
+            logger.error(f"Tool {tool_name} timed out after {elapsed:.1f}s")
+            timing.record(elapsed, "timeout")
+            resp = f"Tool call timed out after {elapsed:.0f} seconds."
+            if tool_name in SENDING_TOOLS:
+                # The call keeps running, a retry could send the user a duplicate
+                resp += (
+                    " It is still running and may still be delivered to the user,"
+                    " do not call it again for this request."
+                )
+        history.add_tool_message(resp, tool_call_id=tool_call_id)
     return history
@@ -0,0 +1,339 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are kept in a module-level registry and
+rendered by the /metrics endpoint. Calls to external dependencies are timed
+with track_dependency(), which also adds the call to the Server-Timing header
+of the API request it was made from.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, covering fast Firestore reads up to slow LLM completions
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+# Durations of dependency calls made while serving the current API request
+_server_timing: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "server_timing", default=None
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Return the sample lines of the metric."""
+
+    def render(self) -> str:
+        header = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        return "\n".join(header + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(Metric):
+    """
+    Gauge set explicitly or read from a callback when rendered.
+
+    Args:
+        function: Callable returning the current value, for unlabelled gauges
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets)) + (float("inf"),)
+        # Per label set: non-cumulative bucket counts, sum and count
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels) -> int:
+        values = self._values.get(self._label_values(labels))
+        return values[2] if values else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {k: (list(c), s, n) for k, (c, s, n) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, le=_format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+dependency_request_seconds = registry.histogram(
+    "dependency_request_duration_seconds",
+    "Duration of calls to external dependencies",
+    ("dependency", "operation", "outcome"),
+)
+dependency_requests_total = registry.counter(
+    "dependency_requests_total",
+    "Calls to external dependencies",
+    ("dependency", "operation", "outcome"),
+)
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds",
+    "Duration of API requests",
+    ("method", "route", "status"),
+)
+limiter_wait_seconds = registry.histogram(
+    "llm_limiter_wait_seconds",
+    "Time spent waiting for an LLM concurrency slot",
+    ("limiter",),
+)
+limiter_in_flight = registry.gauge(
+    "llm_limiter_in_flight", "LLM calls holding a concurrency slot", ("limiter",)
+)
+limiter_waiting = registry.gauge(
+    "llm_limiter_waiting", "LLM calls waiting for a concurrency slot", ("limiter",)
+)
+turn_seconds = registry.histogram(
+    "whatsapp_turn_duration_seconds",
+    "Time to handle a WhatsApp turn, from dequeue to the last reply",
+    ("message_type",),
+)
+tool_loop_iterations = registry.histogram(
+    "llm_tool_loop_iterations",
+    "LLM calls made per WhatsApp text turn",
+    (),
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15),
+)
+tool_seconds = registry.histogram(
+    "llm_tool_duration_seconds",
+    "Duration of LLM tool calls, timeouts are recorded at the timeout",
+    ("tool", "outcome"),
+)
+turn_tokens = registry.histogram(
+    "llm_turn_tokens",
+    "Total tokens reported by the LLM per WhatsApp text turn",
+    (),
+    buckets=(1000, 2500, 5000, 10000, 20000, 40000, 80000, 160000),
+)
+turn_budget_exhausted_total = registry.counter(
+    "llm_turn_budget_exhausted_total",
+    "Text turns answered with the fallback message, by exhausted budget",
+    ("reason",),
+)
+
+
+class DependencyCall:
+    """Handle yielded by track_dependency, set outcome to override it."""
+
+    def __init__(self):
+        self.outcome: Optional[str] = None
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str) -> Iterator[DependencyCall]:
+    """
+    Time a call to an external dependency.
+
+    Records the duration and outcome, and adds the duration to the
+    Server-Timing header of the current API request if there is one. The
+    outcome is "error" if the block raises and "ok" otherwise, unless the
+    caller sets it on the yielded DependencyCall.
+
+    Args:
+        dependency: Dependency name, e.g. "firestore"
+        operation: Operation name, e.g. "read"
+    """
+    call = DependencyCall()
+    started = time.perf_counter()
+    succeeded = False
+    try:
+        yield call
+        succeeded = True
+    finally:
+        elapsed = time.perf_counter() - started
+        outcome = call.outcome or ("ok" if succeeded else "error")
+        dependency_request_seconds.observe(
+            elapsed, dependency=dependency, operation=operation, outcome=outcome
+        )
+        dependency_requests_total.inc(
+            dependency=dependency, operation=operation, outcome=outcome
+        )
+        timings = _server_timing.get()
+        if timings is not None:
+            name = f"{dependency}_{operation}"
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def collect_server_timing() -> Iterator[Dict[str, float]]:
+    """Collect dependency durations in seconds for the duration of a request."""
+    token = _server_timing.set({})
+    try:
+        yield _server_timing.get()
+    finally:
+        _server_timing.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    """
+    Format durations as a Server-Timing header value.
+
+    Args:
+        timings: Seconds spent per dependency operation
+        total: Seconds spent on the whole request
+
+    Returns:
+        str: Header value with durations in milliseconds
+    """
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
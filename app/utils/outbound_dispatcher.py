@@ -0,0 +1,331 @@
+"""
+Outbound dispatcher for WhatsApp Graph API sends.
+
+Sends are rate limited with a token bucket per WhatsApp phone number, retried
+with jittered exponential backoff on 429/503 responses and failed connection
+attempts (honouring Retry-After), and buffered in a bounded queue that pushes
+back on callers once it is full. Other 5xx responses and connections dropped
+after the request was sent may come after the Graph API accepted a message,
+so they are only retried for idempotent requests.
+"""
+
+import asyncio
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import httpx
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from app.config import get_settings
+from app.utils.global_logging import get_logger
+
+settings = get_settings()
+
+logger = get_logger(__name__)
+
+# Responses to requests the Graph API rejected without processing them
+RETRYABLE_STATUS_CODES = {429, 503}
+# Also retried for requests that are safe to repeat, such as read receipts
+IDEMPOTENT_RETRYABLE_STATUS_CODES = RETRYABLE_STATUS_CODES | {500, 502, 504}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+
+class DispatcherFullError(Exception):
+    """Raised when a send cannot be queued before the enqueue timeout."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum burst size
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, going into debt if the bucket is empty.
+
+        Returns:
+            float: Seconds the caller has to wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Full-jitter exponential backoff, never shorter than a Retry-After header.
+
+    Args:
+        attempt: Zero based number of the attempt that failed
+        retry_after: Value of the Retry-After response header, if any
+
+    Returns:
+        float: Seconds to wait before the next attempt
+    """
+    delay = random.uniform(
+        0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), BACKOFF_MAX_SECONDS))
+        except ValueError:
+            # HTTP-date values are rare for the Graph API, fall back to jitter
+            pass
+    return delay
+
+
+def _retryable_status_codes(idempotent: bool) -> Set[int]:
+    if idempotent:
+        return IDEMPOTENT_RETRYABLE_STATUS_CODES
+    return RETRYABLE_STATUS_CODES
+
+
+def _never_sent(error: requests.ConnectionError) -> bool:
+    # True if the connection failed before the request was sent
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps the urllib3 error in a MaxRetryError
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+
+class OutboundDispatcher:
+    """
+    Rate-limited, retrying dispatcher for outbound Graph API requests.
+
+    Args:
+        rate_per_second: Sends allowed per second for each phone number
+        max_retries: Retries after the first attempt for retryable failures
+        queue_size: Maximum number of sends waiting for a dispatcher thread
+        workers: Number of dispatcher threads
+        enqueue_timeout: Seconds a caller waits for room in a full queue
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float = settings.whatsapp_rate_limit_per_second,
+        max_retries: int = settings.whatsapp_max_retries,
+        queue_size: int = settings.whatsapp_dispatch_queue_size,
+        workers: int = settings.whatsapp_dispatch_workers,
+        enqueue_timeout: float = 5.0,
+    ):
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._threads_lock = threading.Lock()
+
+        # Stats, updated from the dispatcher threads and the event loop
+        self._stats_lock = threading.Lock()
+        self._sent = 0
+        self._retries = 0
+        self._rejected = 0
+        self._throttled_time = 0.0
+
+    def _count(self, stat: str, amount: float = 1):
+        with self._stats_lock:
+            setattr(self, stat, getattr(self, stat) + amount)
+
+    def _bucket(self, key: str) -> TokenBucket:
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(
+                    self.rate_per_second, self.rate_per_second
+                )
+            return bucket
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._threads_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"whatsapp-dispatcher-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def send(
+        self,
+        key: str,
+        request: Callable[[], requests.Response],
+        idempotent: bool = False,
+    ) -> requests.Response:
+        """
+        Queue a request and wait for its final response.
+
+        Args:
+            key: Rate limit key, the WhatsApp phone number ID
+            request: Callable performing the HTTP request, called once per attempt
+            idempotent: The request may be repeated, so any 5xx is retried
+
+        Returns:
+            requests.Response: The last response received
+
+        Raises:
+            DispatcherFullError: If the queue stays full for enqueue_timeout
+        """
+        self._ensure_started()
+        future: Future = Future()
+        try:
+            self._queue.put(
+                (key, request, idempotent, future), timeout=self.enqueue_timeout
+            )
+        except queue.Full:
+            self._count("_rejected")
+            raise DispatcherFullError(
+                f"WhatsApp dispatch queue is full ({self._queue.maxsize} sends)"
+            )
+        return future.result()
+
+    def _worker(self):
+        while True:
+            key, request, idempotent, future = self._queue.get()
+            try:
+                future.set_result(self._execute(key, request, idempotent))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _execute(
+        self,
+        key: str,
+        request: Callable[[], requests.Response],
+        idempotent: bool,
+    ) -> requests.Response:
+        retryable = _retryable_status_codes(idempotent)
+        bucket = self._bucket(key)
+        for attempt in range(self.max_retries + 1):
+            wait = bucket.reserve()
+            if wait:
+                self._count("_throttled_time", wait)
+                time.sleep(wait)
+            try:
+                response = request()
+            except requests.ConnectionError as e:
+                # A dropped connection or read timeout may come after the
+                # message was sent, only a failed connect is safe to repeat
+                if attempt == self.max_retries or not (idempotent or _never_sent(e)):
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    f"Graph API connection error, retrying in {delay:.2f}s: {e}"
+                )
+                self._count("_retries")
+                time.sleep(delay)
+                continue
+
+            if (
+                response.status_code in retryable
+                and attempt < self.max_retries
+            ):
+                delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                logger.warning(
+                    f"Graph API returned {response.status_code}, retrying in {delay:.2f}s"
+                )
+                self._count("_retries")
+                time.sleep(delay)
+                continue
+
+            self._count("_sent")
+            return response
+
+    async def asend(
+        self,
+        key: str,
+        request: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool = False,
+    ) -> httpx.Response:
+        """
+        Async variant of send, sharing the same token buckets.
+
+        The request runs on the caller's event loop instead of the queue.
+        """
+        retryable = _retryable_status_codes(idempotent)
+        bucket = self._bucket(key)
+        for attempt in range(self.max_retries + 1):
+            wait = bucket.reserve()
+            if wait:
+                self._count("_throttled_time", wait)
+                await asyncio.sleep(wait)
+            try:
+                response = await request()
+            except (
+                httpx.NetworkError,
+                httpx.ConnectTimeout,
+                httpx.RemoteProtocolError,
+            ) as e:
+                # Same as in _execute, read timeouts are never retried
+                never_sent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt == self.max_retries or not (idempotent or never_sent):
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    f"Graph API connection error, retrying in {delay:.2f}s: {e}"
+                )
+                self._count("_retries")
+                await asyncio.sleep(delay)
+                continue
+
+            if (
+                response.status_code in retryable
+                and attempt < self.max_retries
+            ):
+                delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                logger.warning(
+                    f"Graph API returned {response.status_code}, retrying in {delay:.2f}s"
+                )
+                self._count("_retries")
+                await asyncio.sleep(delay)
+                continue
+
+            self._count("_sent")
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Return dispatcher queue depth, retry and throttling figures."""
+        with self._stats_lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_size": self._queue.maxsize,
+                "workers": self.workers,
+                "sent": self._sent,
+                "retries": self._retries,
+                "rejected": self._rejected,
+                "throttled_seconds": round(self._throttled_time, 3),
+            }
+
+
+outbound_dispatcher = OutboundDispatcher()
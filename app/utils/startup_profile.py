@@ -0,0 +1,135 @@
+"""
+Startup profiling for cold starts.
+
+Records how long each module takes to import and how long each lazily created
+client takes to initialize, so cold start time can be attributed.
+
+This module only depends on the standard library so that it can be imported
+first and time every import that follows. Import timing is off by default and
+enabled with STARTUP_PROFILE_IMPORTS=true. The flag is read from the process
+environment only, not from .env, as it is needed before the settings load.
+The timer is removed once the web server is ready and when a Celery worker
+starts, so imports after startup are not slowed down.
+"""
+
+import importlib.abc
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Number of slowest imports listed in the report
+REPORT_TOP_IMPORTS = 30
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Loader wrapper that records how long a module takes to execute."""
+
+    def __init__(self, loader, profile: "StartupProfile"):
+        self._loader = loader
+        self._profile = profile
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profile.record_import(module.__name__, time.perf_counter() - started)
+            # Hand the real loader back so resource lookups see the usual type
+            module.__loader__ = self._loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self._loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Meta path finder that wraps the loaders found by the other finders."""
+
+    def __init__(self, profile: "StartupProfile"):
+        self._profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            # Another timer would search the path again, starting with this one
+            if isinstance(finder, ImportTimer) or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._profile)
+                return spec
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready_at: Optional[float] = None
+        # Cumulative import time per module, including its own imports
+        self._imports: Dict[str, float] = {}
+        self._inits: Dict[str, float] = {}
+        self._timer: Optional[ImportTimer] = None
+        self._lock = threading.Lock()
+
+    def install_import_timer(self):
+        if self._timer is None:
+            self._timer = ImportTimer(self)
+            sys.meta_path.insert(0, self._timer)
+
+    def uninstall_import_timer(self):
+        if self._timer is not None:
+            sys.meta_path.remove(self._timer)
+            self._timer = None
+
+    def record_import(self, module: str, seconds: float):
+        with self._lock:
+            self._imports[module] = seconds
+
+    def record_init(self, name: str, seconds: float):
+        with self._lock:
+            self._inits[name] = seconds
+
+    def mark_ready(self):
+        """Mark the application as ready to serve and stop timing imports."""
+        self.ready_at = time.perf_counter()
+        self.uninstall_import_timer()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Build the startup report.
+
+        Returns:
+            dict: Time to ready, slowest imports and client init times in ms
+        """
+        with self._lock:
+            imports = sorted(self._imports.items(), key=lambda i: i[1], reverse=True)
+            inits = dict(self._inits)
+        return {
+            "ready_ms": (
+                round((self.ready_at - self.started_at) * 1000, 1)
+                if self.ready_at
+                else None
+            ),
+            "imports_ms": {
+                module: round(seconds * 1000, 1)
+                for module, seconds in imports[:REPORT_TOP_IMPORTS]
+            },
+            "client_init_ms": {
+                name: round(seconds * 1000, 1) for name, seconds in inits.items()
+            },
+        }
+
+
+startup_profile = StartupProfile()
+
+if os.getenv("STARTUP_PROFILE_IMPORTS", "false").lower() == "true":
+    startup_profile.install_import_timer()
@@ -7,6 +7,7 @@ class LLMResponse(TypedDict, total=False):
     type: Literal["tool_calls", "message"]
     text: Optional[str]  # Present if type is "message"
     tool_calls: Optional[Any]  # Present if type is "tool_calls"
+    usage: Optional[Dict[str, int]]  # input_tokens, output_tokens, total_tokens
 
 
 class VectorDBInvoiceData(BaseModel):
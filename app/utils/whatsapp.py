@@ -3,21 +3,222 @@ WhatsApp API Utilities
 
 This module provides utility functions for interacting with the WhatsApp Cloud API,
 including downloading media, sending messages, and processing webhook events.
+
+All calls go through a shared client that keeps a pool of keep-alive
+connections to the Graph API, so small outbound messages do not pay for a new
+TLS handshake every time. Sends are routed through the outbound dispatcher,
+which rate limits and retries them.
 """
 
 import logging
 import mimetypes
 import os
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 from app.config import Settings, get_settings
+from app.utils.metrics import track_dependency
+from app.utils.outbound_dispatcher import OutboundDispatcher, outbound_dispatcher
 
 logger = logging.getLogger(__name__)
 settings: Settings = get_settings()
 
+GRAPH_API_URL = "https://graph.facebook.com/v18.0"
+# Media transfers can be much larger than JSON messages
+MEDIA_DOWNLOAD_TIMEOUT = 60
+MEDIA_UPLOAD_TIMEOUT = 60
+
+
+def http_outcome(status_code: int) -> str:
+    return "ok" if status_code < 400 else f"http_{status_code}"
+
+
+class WhatsAppClient:
+    """
+    Pooled, keep-alive HTTP client for the WhatsApp Graph API.
+
+    Args:
+        settings: Application settings with WhatsApp API credentials
+        dispatcher: Dispatcher that rate limits and retries POST requests
+        pool_size: Maximum number of connections kept alive to the Graph API
+        timeout: Default (connect, read) timeout in seconds for each call
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        dispatcher: OutboundDispatcher = outbound_dispatcher,
+        pool_size: int = settings.whatsapp_http_pool_size,
+        timeout: float = settings.whatsapp_http_timeout_seconds,
+    ):
+        self.dispatcher = dispatcher
+        self.phone_number_id = settings.whatsapp_phone_number_id
+        self.timeout = (min(timeout, 5.0), timeout)
+        self.messages_url = (
+            f"{GRAPH_API_URL}/{settings.whatsapp_phone_number_id}/messages"
+        )
+        self.media_url = f"{GRAPH_API_URL}/{settings.whatsapp_phone_number_id}/media"
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Authorization": f"Bearer {settings.whatsapp_api_token}"}
+        )
+
+    def get(
+        self,
+        url: str,
+        timeout: Optional[float] = None,
+        operation: str = "get",
+        **kwargs,
+    ) -> requests.Response:
+        """
+        GET a Graph API URL, recorded under the given metrics operation.
+
+        For streamed responses only the time to the response headers is recorded.
+        """
+        with track_dependency("whatsapp", operation) as call:
+            response = self.session.get(url, timeout=timeout or self.timeout, **kwargs)
+            call.outcome = http_outcome(response.status_code)
+            return response
+
+    def post(
+        self,
+        url: str,
+        timeout: Optional[float] = None,
+        operation: str = "send",
+        idempotent: bool = False,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        POST through the outbound dispatcher, which may retry the request.
+
+        Only idempotent requests are retried on every 5xx response.
+        """
+        with track_dependency("whatsapp", operation) as call:
+            response = self.dispatcher.send(
+                self.phone_number_id,
+                lambda: self.session.post(
+                    url, timeout=timeout or self.timeout, **kwargs
+                ),
+                idempotent=idempotent,
+            )
+            call.outcome = http_outcome(response.status_code)
+            return response
+
+    def post_message(
+        self,
+        data: Dict[str, Any],
+        timeout: Optional[float] = None,
+        idempotent: bool = False,
+    ) -> requests.Response:
+        """POST a JSON payload to the phone number's messages endpoint."""
+        return self.post(
+            self.messages_url, json=data, timeout=timeout, idempotent=idempotent
+        )
+
+
+class AsyncWhatsAppClient:
+    """
+    Async flavour of WhatsAppClient for use from FastAPI handlers.
+
+    The underlying httpx client is created on first use so that it is bound to
+    the running event loop, and must be closed with aclose() on shutdown.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        dispatcher: OutboundDispatcher = outbound_dispatcher,
+        pool_size: int = settings.whatsapp_http_pool_size,
+        timeout: float = settings.whatsapp_http_timeout_seconds,
+    ):
+        self.settings = settings
+        self.dispatcher = dispatcher
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.messages_url = (
+            f"{GRAPH_API_URL}/{settings.whatsapp_phone_number_id}/messages"
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"Authorization": f"Bearer {self.settings.whatsapp_api_token}"},
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post_message(
+        self, data: Dict[str, Any], timeout: Optional[float] = None
+    ) -> httpx.Response:
+        """POST a JSON payload to the phone number's messages endpoint."""
+        with track_dependency("whatsapp", "send") as call:
+            response = await self.dispatcher.asend(
+                self.settings.whatsapp_phone_number_id,
+                lambda: self.client.post(
+                    self.messages_url, json=data, timeout=timeout or self.timeout
+                ),
+            )
+            call.outcome = http_outcome(response.status_code)
+            return response
+
+    async def send_whatsapp_message(
+        self, recipient_id: str, message_text: str
+    ) -> Tuple[bool, str]:
+        """Async variant of send_whatsapp_message."""
+        try:
+            logger.info(f"Sending message to {recipient_id} via WhatsApp API")
+            response = await self.post_message(
+                text_message_payload(recipient_id, message_text)
+            )
+
+            if response.status_code != 200:
+                logger.error(
+                    f"WhatsApp API error: {response.status_code} - {response.text}"
+                )
+
+            response.raise_for_status()
+
+            message_id = response.json().get("messages", [{}])[0].get("id")
+            logger.info(f"Message sent to {recipient_id}, ID: {message_id}")
+            return True, message_id
+
+        except Exception as e:
+            error_msg = f"Error sending message: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+
+def text_message_payload(recipient_id: str, message_text: str) -> Dict[str, Any]:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient_id,
+        "type": "text",
+        "text": {"body": message_text},
+    }
+
+
+whatsapp_client = WhatsAppClient(settings)
+async_whatsapp_client = AsyncWhatsAppClient(settings)
+
 
 def check_whatsapp_token(settings) -> bool:
     """
@@ -31,9 +232,8 @@ def check_whatsapp_token(settings) -> bool:
     """
     try:
         url = f"https://graph.facebook.com/v23.0/{settings.whatsapp_phone_number_id}"
-        headers = {"Authorization": f"Bearer {settings.whatsapp_api_token}"}
 
-        response = requests.get(url, headers=headers)
+        response = whatsapp_client.get(url)
 
         if response.status_code == 200:
             logger.info("WhatsApp API token is valid")
@@ -69,12 +269,11 @@ def download_whatsapp_media(
         os.makedirs(media_dir, exist_ok=True)
 
         # Step 1: Get the media URL
-        url = f"https://graph.facebook.com/v18.0/{media_id}"
-        headers = {"Authorization": f"Bearer {settings.whatsapp_api_token}"}
+        url = f"{GRAPH_API_URL}/{media_id}"
 
         # Log details for debugging
         logger.info(f"Attempting to get media URL for {media_type} with ID: {media_id}")
-        response = requests.get(url, headers=headers)
+        response = whatsapp_client.get(url, operation="media_url")
 
         # Log the response for debugging
         if response.status_code != 200:
@@ -134,13 +333,15 @@ def download_whatsapp_media(
         file_path = media_dir / f"{sender_id}_{media_id}{extension}"
 
         # Step 2: Download the media
-        response = requests.get(media_url, headers=headers, stream=True)
-        response.raise_for_status()
+        with whatsapp_client.get(
+            media_url, stream=True, timeout=MEDIA_DOWNLOAD_TIMEOUT, operation="download"
+        ) as response:
+            response.raise_for_status()
 
-        # Save the media to a file
-        with open(file_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            # Save the media to a file
+            with open(file_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
 
         logger.info(
             f"Downloaded {media_type} to {file_path} with extension {extension}"
@@ -152,6 +353,40 @@ def download_whatsapp_media(
         return None
 
 
+def iter_whatsapp_media(
+    media_id: str, chunk_size: int = settings.media_chunk_size
+) -> Iterator[bytes]:
+    """
+    Stream media content from WhatsApp Cloud API without touching local disk.
+
+    Args:
+        media_id (str): The WhatsApp media ID
+        chunk_size (int): Size of the chunks to yield
+
+    Yields:
+        bytes: Chunks of the media content
+
+    Raises:
+        requests.HTTPError: If the Graph API or media download fails
+        ValueError: If the Graph API does not return a media URL
+    """
+    logger.info(f"Attempting to get media URL for media ID: {media_id}")
+    response = whatsapp_client.get(f"{GRAPH_API_URL}/{media_id}", operation="media_url")
+    if response.status_code != 200:
+        logger.error(f"Media URL fetch error: {response.status_code} - {response.text}")
+    response.raise_for_status()
+
+    media_url = response.json().get("url")
+    if not media_url:
+        raise ValueError(f"Failed to get URL for media ID: {media_id}")
+
+    with whatsapp_client.get(
+        media_url, stream=True, timeout=MEDIA_DOWNLOAD_TIMEOUT, operation="download"
+    ) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=chunk_size)
+
+
 def send_whatsapp_message(
     recipient_id: str, message_text: str, settings: Settings = settings
 ) -> Tuple[bool, str]:
@@ -167,22 +402,10 @@ def send_whatsapp_message(
         Tuple[bool, str]: (Success status, Message or error)
     """
     try:
-        url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/messages"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.whatsapp_api_token}",
-        }
-
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": recipient_id,
-            "type": "text",
-            "text": {"body": message_text},
-        }
-
         logger.info(f"Sending message to {recipient_id} via WhatsApp API")
-        response = requests.post(url, headers=headers, json=data)
+        response = whatsapp_client.post_message(
+            text_message_payload(recipient_id, message_text)
+        )
 
         # Log the response for debugging
         if response.status_code != 200:
@@ -217,18 +440,55 @@ def send_whatsapp_media(
     Send a media message via WhatsApp Cloud API.
     """
     try:
-        media_url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/media"
-        headers = {
-            "Authorization": f"Bearer {settings.whatsapp_api_token}",
-        }
-
-        mime_type, _ = mimetypes.guess_type(local_file_path)
         with open(local_file_path, "rb") as f:
-            files = {
-                "file": (os.path.basename(local_file_path), f, mime_type),
-            }
-            data = {"messaging_product": "whatsapp", "type": "document"}
-            response = requests.post(media_url, headers=headers, files=files, data=data)
+            content = f.read()
+    except Exception as e:
+        error_msg = f"Error sending media: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+    return send_whatsapp_document(
+        recipient_id,
+        content,
+        os.path.basename(local_file_path),
+        whats_app_file_caption,
+        whats_app_file_name,
+    )
+
+
+def send_whatsapp_document(
+    recipient_id: str,
+    content: bytes,
+    upload_file_name: str,
+    whats_app_file_caption: str = "File caption",
+    whats_app_file_name: str = "File name",
+) -> Tuple[bool, str]:
+    """
+    Upload in-memory document content and send it as a WhatsApp document message.
+
+    Args:
+        recipient_id (str): The recipient's WhatsApp ID
+        content (bytes): The document content
+        upload_file_name (str): File name used for the upload and its mime type
+        whats_app_file_caption (str): Caption shown with the document
+        whats_app_file_name (str): File name shown to the recipient
+
+    Returns:
+        Tuple[bool, str]: (Success status, Message ID or error)
+    """
+    try:
+        mime_type, _ = mimetypes.guess_type(upload_file_name)
+        # Content is in memory so the upload can be retried by the dispatcher
+        files = {"file": (upload_file_name, content, mime_type)}
+        data = {"messaging_product": "whatsapp", "type": "document"}
+        response = whatsapp_client.post(
+            whatsapp_client.media_url,
+            files=files,
+            data=data,
+            timeout=MEDIA_UPLOAD_TIMEOUT,
+            operation="upload",
+            # A repeated upload only leaves an unused media ID behind
+            idempotent=True,
+        )
 
         if response.status_code != 200:
             logger.error(
@@ -242,8 +502,6 @@ def send_whatsapp_media(
         logger.info(f"Media sent to {recipient_id}, ID: {media_id}")
         # Send media message
 
-        message_url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/messages"
-        headers["Content-Type"] = "application/json"
         message_data = {
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
@@ -256,7 +514,7 @@ def send_whatsapp_media(
             },
         }
 
-        response = requests.post(message_url, headers=headers, json=message_data)
+        response = whatsapp_client.post_message(message_data)
 
         if response.status_code != 200:
             logger.error(
@@ -279,65 +537,40 @@ def send_whatsapp_media(
 def send_typing_indicator(whatsapp_msg_id: str) -> Tuple[bool, str]:
     """
     Send a typing indicator via WhatsApp Cloud API.
-    """
-    try:
-        url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/messages"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.whatsapp_api_token}",
-        }
-
-        data = {
-            "messaging_product": "whatsapp",
-            "status": "read",
-            "message_id": whatsapp_msg_id,
-            "typing_indicator": {"type": "text"},
-        }
-
-        logger.info(f"Sending typing indicator via WhatsApp API")
-        response = requests.post(url, headers=headers, json=data)
-
-        # Log the response for debugging
-        if response.status_code != 200:
-            logger.error(
-                f"WhatsApp API error: {response.status_code} - {response.text}"
-            )
-
-        response.raise_for_status()
-
-        result = response.json()
-        message_id = result.get("messages", [{}])[0].get("id")
-
-        logger.info(f"Typing indicator sent ID: {message_id}")
-        return True, message_id
 
-    except Exception as e:
-        error_msg = f"Error sending typing indicator: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
+    WhatsApp shows the typing indicator as part of a read receipt, so this
+    also marks the message as read.
+    """
+    return send_read_receipt(whatsapp_msg_id, typing_indicator=True)
 
 
-def send_read_receipt(whatsapp_msg_id: str) -> Tuple[bool, str]:
+def send_read_receipt(
+    whatsapp_msg_id: str, typing_indicator: bool = False
+) -> Tuple[bool, str]:
     """
     Send a read receipt via WhatsApp Cloud API.
+
+    Args:
+        whatsapp_msg_id (str): The ID of the message to mark as read
+        typing_indicator (bool): Also show the typing indicator in the same call
+
+    Returns:
+        Tuple[bool, str]: (Success status, Message ID or error)
     """
     try:
-        url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/messages"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.whatsapp_api_token}",
-        }
-
         data = {
             "messaging_product": "whatsapp",
             "status": "read",
             "message_id": whatsapp_msg_id,
         }
+        if typing_indicator:
+            data["typing_indicator"] = {"type": "text"}
 
         logger.info(
             f"Sending read receipt for message {whatsapp_msg_id} via WhatsApp API"
         )
-        response = requests.post(url, headers=headers, json=data)
+        # Marking a message read twice is harmless
+        response = whatsapp_client.post_message(data, idempotent=True)
 
         # Log the response for debugging
         if response.status_code != 200:
@@ -369,12 +602,6 @@ def send_reactions(recipient_id: str, message_id: str, reaction: str) -> str:
         Tuple[bool, str]: (Success status, Message or error)
     """
     try:
-        url = f"https://graph.facebook.com/v18.0/{settings.whatsapp_phone_number_id}/messages"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.whatsapp_api_token}",
-        }
-
         data = {
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
@@ -386,7 +613,8 @@ def send_reactions(recipient_id: str, message_id: str, reaction: str) -> str:
         logger.info(
             f"Sending reaction '{reaction}' to message {message_id} for recipient {recipient_id}"
         )
-        response = requests.post(url, headers=headers, json=data)
+        # A message has one reaction per sender, sending it again replaces it
+        response = whatsapp_client.post_message(data, idempotent=True)
 
         if response.status_code != 200:
             logger.error(
@@ -359,3 +359,33 @@ resource "google_firestore_field" "celery_ttl" {
   ttl_config {
   }
 }
+
+# Chat history messages stored one document per message (CHAT_HISTORY_STORAGE=messages)
+resource "google_firestore_field" "chat_history_messages_ttl" {
+  project    = var.gcp_project_id
+  database   = google_firestore_database.default.name
+  collection = "messages"
+  field      = "expires_at"
+  ttl_config {
+  }
+}
+
+# Job list of the admin dashboard filtered by status (app/services/jobs_service.py)
+resource "google_firestore_index" "background_jobs_status_started_at" {
+  project    = var.gcp_project_id
+  database   = google_firestore_database.default.name
+  collection = "background_jobs"
+
+  fields {
+    field_path = "status"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "started_at"
+    order      = "DESCENDING"
+  }
+  fields {
+    field_path = "__name__"
+    order      = "DESCENDING"
+  }
+}
@@ -0,0 +1,92 @@
+"""
+Benchmark of the compressed chat history codec against the messages array.
+
+Builds a history of search turns, each with a query_for_invoices result of 100
+documents, and compares encode/decode time and stored bytes of today's format
+(message dicts, measured as their JSON size) with encode_history.
+
+Run with: python -m tests.benchmark_history_codec [turns]
+"""
+
+import json
+import sys
+import time
+from typing import Callable, List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+from app.utils.helpers import (
+    decode_history,
+    encode_history,
+    langchain_msg_to_dict,
+    list_to_langchain_msg,
+)
+from app.utils.prompt import system_prompt
+
+ROUNDS = 20
+
+
+def build_history(turns: int) -> List[BaseMessage]:
+    messages: List[BaseMessage] = [system_prompt]
+    for turn in range(turns):
+        documents = [
+            f"Document(id='invoice-{turn}-{i}', metadata={{'provider': 'Hydro One', "
+            f"'category': 'electricity', 'month': {i % 12 + 1}, 'year': 2025, "
+            f"'cloud_location': 'invoices/1234567890/{turn}-{i}.pdf'}}, "
+            f"page_content='Electricity bill {i} for 2025, amount {i * 7.5:.2f} CAD')"
+            for i in range(100)
+        ]
+        messages += [
+            HumanMessage(
+                f"Show my electricity bills from 2025  |  "
+                f"latest_whatsapp_msg_id=wamid.{turn}"
+            ),
+            AIMessage(
+                "",
+                tool_calls=[
+                    {
+                        "name": "query_for_invoices",
+                        "args": {"query": "electricity bills 2025"},
+                        "id": f"call_{turn}",
+                    }
+                ],
+            ),
+            ToolMessage(str(documents), tool_call_id=f"call_{turn}"),
+            AIMessage("I found 100 electricity bills from 2025."),
+        ]
+    return messages
+
+
+def timed(func: Callable, rounds: int = ROUNDS) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main(turns: int = 10):
+    messages = build_history(turns)
+    msg_dicts = langchain_msg_to_dict(messages)
+
+    print(f"{len(messages)} messages, {turns} turns with 100 document results\n")
+    print(f"{'format':<16}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+
+    array_bytes = len(json.dumps(msg_dicts).encode())
+    encode_ms = timed(lambda: langchain_msg_to_dict(messages))
+    decode_ms = timed(lambda: list_to_langchain_msg(msg_dicts))
+    print(f"{'array':<16}{array_bytes:>12}{encode_ms:>12.2f}{decode_ms:>12.2f}")
+
+    for serializer in ("msgpack", "json"):
+        blob = encode_history(msg_dicts, serializer)
+        encode_ms = timed(
+            lambda: encode_history(langchain_msg_to_dict(messages), serializer)
+        )
+        decode_ms = timed(lambda: list_to_langchain_msg(decode_history(blob)))
+        print(
+            f"{serializer + '+zstd':<16}{len(blob):>12}"
+            f"{encode_ms:>12.2f}{decode_ms:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
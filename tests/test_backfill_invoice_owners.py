@@ -0,0 +1,74 @@
+"""
+Tests for the backfill of invoice owners.
+"""
+
+from unittest.mock import patch
+
+from app.services.document_index import DOCUMENT_INDEX_COLLECTION
+from app.utils import backfill_invoice_owners as backfill
+from app.utils.background_job import DB_COLLECTION, JobStatus
+
+VECTORS = {
+    # Already owned
+    "owned": {"gcp_blob_path": "documents/111/a.pdf", "user_id": "111"},
+    # Per-user layout without user_id
+    "layout": {"gcp_blob_path": "documents/222/b.pdf"},
+    # Recorded in the document index
+    "indexed": {"gcp_blob_path": "documents/c.pdf"},
+    # Stored by a done WhatsApp job
+    "job": {"gcp_blob_path": "documents/d.pdf"},
+    # Same file name sent by two users
+    "ambiguous": {"gcp_blob_path": "documents/e.pdf"},
+    # Web upload, the moved path is not recorded
+    "web": {"gcp_blob_path": "documents/9f1c.pdf"},
+}
+
+COLLECTIONS = {
+    DOCUMENT_INDEX_COLLECTION: [
+        {"user_id": "333", "gcp_blob_path": "documents/c.pdf"},
+    ],
+    DB_COLLECTION: [
+        {"sender_id": "444", "doc_filename": "d.pdf", "status": str(JobStatus.DONE)},
+        {"sender_id": "555", "doc_filename": "e.pdf", "status": str(JobStatus.DONE)},
+        {"sender_id": "666", "doc_filename": "e.pdf", "status": str(JobStatus.DONE)},
+        # Never stored, so it does not claim the path
+        {
+            "sender_id": "777",
+            "doc_filename": "d.pdf",
+            "status": str(JobStatus.DUPLICATE),
+        },
+        # Web upload job
+        {"user_id": "888", "doc_filename": "f.pdf", "status": str(JobStatus.DONE)},
+    ],
+}
+
+
+def run_backfill(dry_run=False):
+    with (
+        patch.object(backfill, "vdb") as vdb,
+        patch.object(backfill, "db_service") as db,
+    ):
+        vdb.iter_metadata.return_value = iter(VECTORS.items())
+        db.read_all.side_effect = lambda collection, fields=None: COLLECTIONS[
+            collection
+        ]
+        counts = backfill.backfill_invoice_owners(dry_run)
+    return counts, vdb
+
+
+def test_owners_are_written_onto_unowned_vectors():
+    counts, vdb = run_backfill()
+
+    updates = {
+        call.args[0]: call.args[1]["user_id"]
+        for call in vdb.set_metadata.call_args_list
+    }
+    assert updates == {"layout": "222", "indexed": "333", "job": "444"}
+    assert counts == {"updated": 3, "ambiguous": 1, "unknown": 1}
+
+
+def test_dry_run_does_not_update():
+    counts, vdb = run_backfill(dry_run=True)
+
+    vdb.set_metadata.assert_not_called()
+    assert counts["updated"] == 3
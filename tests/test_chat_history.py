@@ -0,0 +1,288 @@
+"""
+Tests for the token accounting of the Firebase chat history.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from app.services.chat_history_cache import ChatHistoryCache
+from app.services.chat_history_store import DocumentChatHistoryStore
+from app.services.db_service import MAX_WRITE_ATTEMPTS, DocumentChangedError
+from app.services.firebase_chat_history import FirebaseChatHistory
+from app.services.history_compactor import HistoryCompactor
+
+UPDATE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def db():
+    """Firestore mock behind a fresh write-through cache."""
+    db = MagicMock()
+    db.read_with_update_time.return_value = (None, None)
+    db.create.return_value = UPDATE_TIME
+    db.update_if_unchanged.return_value = UPDATE_TIME
+    cache = ChatHistoryCache(DocumentChatHistoryStore(db=db), flush_delay=0)
+    with patch("app.services.firebase_chat_history.chat_history_cache", cache):
+        yield db
+
+
+def load_history(db, messages, max_tokens=18000, update_time=None):
+    db.read_with_update_time.return_value = ({"messages": messages}, update_time)
+    return FirebaseChatHistory("1234567890", max_tokens=max_tokens)
+
+
+def turn(index):
+    return [
+        {"type": "human", "text": f"question {index} " + "x" * 400},
+        {
+            "type": "ai",
+            "text": "",
+            "tool_calls": [
+                {"name": "query_for_invoices", "args": {}, "id": f"c{index}"}
+            ],
+        },
+        {"type": "tool", "text": "y" * 400, "tool_call_id": f"c{index}"},
+        {"type": "ai", "text": f"answer {index}"},
+    ]
+
+
+def test_stored_token_counts_are_reused(db):
+    """Counts stored with the messages are used instead of recounting them."""
+    history = load_history(
+        db,
+        [
+            {"type": "system", "text": "prompt", "tokens": 7},
+            {"type": "human", "text": "hello", "tokens": 11},
+        ],
+    )
+    history.add_ai_message("hi")
+
+    assert history.message_tokens[:2] == [7, 11]
+    assert history.total_tokens == 18 + count_tokens_approximately(
+        history.messages[-1:]
+    )
+
+
+def test_trim_drops_whole_turns_and_keeps_system_prompt(db):
+    """Trimming restarts on a human message and keeps the running total exact."""
+    stored = [{"type": "system", "text": "prompt"}]
+    for index in range(10):
+        stored.extend(turn(index))
+    history = load_history(db, stored, max_tokens=1000)
+    history.add_human_message("latest question " + "z" * 5000, "wamid.1")
+
+    history.commit()
+
+    assert isinstance(history.messages[0], SystemMessage)
+    assert isinstance(history.messages[1], HumanMessage)
+    # The current turn is kept even though it is over the budget on its own
+    assert history.messages[1].content.startswith("latest question")
+    assert history.total_tokens == count_tokens_approximately(history.messages)
+
+    written = db.create.call_args.args[2]["messages"]
+    assert [msg["tokens"] for msg in written] == history.message_tokens
+
+
+def test_trim_keeps_history_within_budget(db):
+    """Older turns are dropped until the history fits in max_tokens."""
+    stored = [{"type": "system", "text": "prompt"}]
+    for index in range(10):
+        stored.extend(turn(index))
+    history = load_history(db, stored, max_tokens=1000)
+
+    history.trim()
+
+    assert history.total_tokens <= 1000
+    assert history.messages[1].content.startswith("question ")
+    assert history.messages[-1].content == "answer 9"
+
+
+def test_compaction_replaces_oldest_turns_with_summary(db):
+    """Old turns become a summary message kept after the system prompt."""
+    stored = [{"type": "system", "text": "prompt"}]
+    for index in range(10):
+        stored.extend(turn(index))
+    history = load_history(db, stored)
+    compactor = HistoryCompactor(trigger_tokens=2000, keep_tokens=1000)
+
+    with patch("app.services.history_compactor.llm_service") as mock_llm:
+        mock_llm.asummarize = AsyncMock(return_value="- Asked for invoices")
+        assert compactor.should_compact(history)
+        assert asyncio.run(compactor.compact(history))
+
+    assert history.summary == "- Asked for invoices"
+    assert isinstance(history.messages[2], HumanMessage)
+    assert history.messages[-1].content == "answer 9"
+    assert history.total_tokens == count_tokens_approximately(history.messages)
+    assert not compactor.should_compact(history)
+
+
+def test_cached_history_is_not_read_again(db):
+    """A hot conversation costs no read and one conditional write per turn."""
+    history = load_history(db, turn(0), update_time=UPDATE_TIME)
+    history.add_human_message("next question", "wamid.1")
+    history.commit()
+
+    history = FirebaseChatHistory("1234567890")
+
+    assert db.read_with_update_time.call_count == 1
+    assert history.messages[-1].content.startswith("next question")
+    db.update_if_unchanged.assert_called_once()
+    assert db.update_if_unchanged.call_args.args[3] == UPDATE_TIME
+    db.read.assert_not_called()
+
+
+def test_commit_after_clear_is_dropped(db):
+    """A turn that cleared the history does not write it back."""
+    history = load_history(db, turn(0), update_time=UPDATE_TIME)
+    history.clear()
+    history.add_ai_message("Goodbye!")
+    history.commit()
+
+    db.delete.assert_called_once()
+    db.update_if_unchanged.assert_not_called()
+    db.create.assert_not_called()
+
+
+def test_write_behind_coalesces_commits(db):
+    """Commits within the flush delay become a single write."""
+    cache = ChatHistoryCache(DocumentChatHistoryStore(db=db), flush_delay=60)
+    with patch("app.services.firebase_chat_history.chat_history_cache", cache):
+        history = load_history(db, turn(0), update_time=UPDATE_TIME)
+        history.add_human_message("first", "wamid.1")
+        history.commit()
+        history.add_ai_message("second")
+        history.commit()
+        db.update_if_unchanged.assert_not_called()
+
+        cache.close()
+
+    db.update_if_unchanged.assert_called_once()
+    written = db.update_if_unchanged.call_args.args[2]["messages"]
+    assert written[-1]["text"] == "second"
+
+
+def test_history_changed_by_another_instance_is_merged(db):
+    """A stale cached copy is rebased on the stored history, not dropped."""
+    history = load_history(db, turn(0), update_time=UPDATE_TIME)
+    stale = FirebaseChatHistory("1234567890")
+    # Another instance answered a turn since the history was cached
+    newer = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    db.read_with_update_time.return_value = ({"messages": turn(0) + turn(1)}, newer)
+    db.update_if_unchanged.side_effect = [DocumentChangedError("changed"), newer]
+
+    history.add_human_message("question 2", "wamid.2")
+    history.add_ai_message("answer 2")
+    history.commit()
+
+    assert db.update_if_unchanged.call_count == 2
+    _, _, data, update_time = db.update_if_unchanged.call_args.args
+    assert update_time == newer
+    texts = [msg["text"] for msg in data["messages"]]
+    assert texts[-2:] == ["question 2  |  latest_whatsapp_msg_id=wamid.2", "answer 2"]
+    assert texts[-3] == "answer 1"
+    assert texts.count("answer 0") == 1
+
+    # Copies taken before the merge are rebased onto it, not written over it
+    db.update_if_unchanged.side_effect = None
+    stale.add_ai_message("late")
+    stale.commit()
+    texts = [m.content for m in FirebaseChatHistory("1234567890").messages]
+    assert texts[-4:] == [
+        "answer 1",
+        "question 2  |  latest_whatsapp_msg_id=wamid.2",
+        "answer 2",
+        "late",
+    ]
+    assert texts.count("answer 0") == 1
+
+
+def test_compaction_after_a_merge_is_kept(db):
+    """Commit, a flush merging another instance's turn, then a second commit."""
+    history = load_history(db, turn(0) + turn(1), update_time=UPDATE_TIME)
+    newer = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    db.read_with_update_time.return_value = (
+        {"messages": turn(0) + turn(1) + turn(2)},
+        newer,
+    )
+    db.update_if_unchanged.side_effect = [DocumentChangedError("changed"), newer, newer]
+
+    history.add_human_message("question 3", "wamid.3")
+    history.add_ai_message("answer 3")
+    history.commit()
+    # Compaction of the same copy, like the turn in process_whatsapp_message
+    history.replace_with_summary(5, "turn 0 happened")
+    history.commit()
+
+    assert db.update_if_unchanged.call_count == 3
+    texts = [msg["text"] for msg in db.update_if_unchanged.call_args.args[2]["messages"]]
+    assert "turn 0 happened" in texts[1]
+    assert "answer 0" not in texts
+    assert texts.count("answer 1") == 1
+    assert "answer 2" in texts
+    assert texts[-1] == "answer 3"
+
+
+def test_failed_write_is_retried_with_later_commits(db):
+    """A transient write error keeps the commit and retries it after a backoff."""
+    cache = ChatHistoryCache(DocumentChatHistoryStore(db=db), flush_delay=0)
+    db.update_if_unchanged.side_effect = [Exception("unavailable"), UPDATE_TIME]
+    with (
+        patch("app.services.firebase_chat_history.chat_history_cache", cache),
+        patch("app.services.chat_history_cache.FLUSH_RETRY_DELAY_SECONDS", 60),
+    ):
+        history = load_history(db, turn(0), update_time=UPDATE_TIME)
+        history.add_human_message("question 1", "wamid.1")
+        history.commit()
+        assert db.update_if_unchanged.call_count == 1
+
+        # Read from the pending copy and written together with it
+        history = FirebaseChatHistory("1234567890")
+        history.add_ai_message("answer 1")
+        history.commit()
+        cache.close()
+
+    assert db.update_if_unchanged.call_count == 2
+    written = db.update_if_unchanged.call_args.args[2]["messages"]
+    assert written[-1]["text"] == "answer 1"
+
+
+def test_write_is_dropped_after_repeated_failures(db):
+    """A history that cannot be written is given up on after a few attempts."""
+    cache = ChatHistoryCache(DocumentChatHistoryStore(db=db), flush_delay=0)
+    db.update_if_unchanged.side_effect = Exception("unavailable")
+    with (
+        patch("app.services.firebase_chat_history.chat_history_cache", cache),
+        patch("app.services.chat_history_cache.FLUSH_RETRY_DELAY_SECONDS", 0),
+    ):
+        history = load_history(db, turn(0), update_time=UPDATE_TIME)
+        history.add_human_message("question 1", "wamid.1")
+        history.commit()
+        cache.close()
+
+    assert db.update_if_unchanged.call_count == MAX_WRITE_ATTEMPTS
+    assert not cache._entries
+
+
+def test_async_load_reads_through_the_async_client(db):
+    """aload awaits the async client and commits through the sync one."""
+    async_db = MagicMock()
+    async_db.read_with_update_time = AsyncMock(
+        return_value=({"messages": turn(0)}, UPDATE_TIME)
+    )
+    store = DocumentChatHistoryStore(db=db, async_db=async_db)
+    cache = ChatHistoryCache(store, flush_delay=0)
+    with patch("app.services.firebase_chat_history.chat_history_cache", cache):
+        history = asyncio.run(FirebaseChatHistory.aload("1234567890"))
+        history.add_ai_message("done")
+        history.commit()
+
+    async_db.read_with_update_time.assert_awaited_once()
+    db.read_with_update_time.assert_not_called()
+    assert history.messages[-2].content == "answer 0"
+    assert db.update_if_unchanged.call_args.args[3] == UPDATE_TIME
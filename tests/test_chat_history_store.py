@@ -0,0 +1,92 @@
+"""
+Tests for the append-only messages layout of the chat history store.
+"""
+
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+from firebase_admin import firestore
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app.services.chat_history_store import (
+    SUMMARY_PREFIX,
+    MessagesChatHistoryStore,
+    message_document_id,
+)
+
+UPDATE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+LEGACY = {
+    "messages": [
+        {"type": "system", "text": "prompt", "tokens": 5},
+        {"type": "human", "text": "hello", "tokens": 6},
+        {"type": "ai", "text": "hi", "tokens": 7},
+    ]
+}
+
+
+def make_store(doc=None, tail=None):
+    db = MagicMock()
+    db.read_with_update_time.return_value = (doc, UPDATE_TIME if doc else None)
+    db.read_subcollection.return_value = tail or []
+    db.commit_writes.return_value = UPDATE_TIME
+    return MessagesChatHistoryStore(collection="chat_history", db=db), db
+
+
+def writes_by_op(db):
+    writes = db.commit_writes.call_args.args[0]
+    return {op: [w for w in writes if w.op == op] for op in ("set", "delete", "update")}
+
+
+def test_legacy_document_is_migrated_on_save():
+    """A history in the document layout is appended and its array dropped."""
+    store, db = make_store(LEGACY)
+    messages, tokens, update_time, ids = store.load("1234567890")
+    messages.append(HumanMessage("invoices?"))
+    tokens.append(8)
+
+    _, ids = store.save("1234567890", messages, tokens, update_time, ids)
+
+    writes = writes_by_op(db)
+    assert [w.data["text"] for w in writes["set"]] == ["hello", "hi", "invoices?"]
+    parent = writes["update"][0]
+    assert parent.last_update_time == UPDATE_TIME
+    assert parent.data["messages"] is firestore.DELETE_FIELD
+    assert parent.data["head"] == int(ids[0])
+    assert [message.id for message in messages[1:]] == ids
+
+
+def test_save_appends_new_messages_and_deletes_trimmed_ones():
+    """Only new messages are written, trimmed ones are deleted."""
+    store, db = make_store(LEGACY)
+    messages, tokens, update_time, ids = store.load("1234567890")
+    update_time, ids = store.save("1234567890", messages, tokens, update_time, ids)
+
+    # Trim the first turn and add a new one
+    kept = [messages[0], HumanMessage("next"), AIMessage("answer")]
+    update_time, new_ids = store.save("1234567890", kept, [5, 4, 6], update_time, ids)
+
+    writes = writes_by_op(db)
+    assert [w.data["text"] for w in writes["set"]] == ["next", "answer"]
+    assert sorted(w.path[-1] for w in writes["delete"]) == sorted(ids)
+    assert writes["update"][0].data["head"] == int(new_ids[0])
+
+
+def test_load_reads_tail_and_summary():
+    """Loads start from the system prompt, the summary and a human message."""
+    doc = {"format": "messages", "head": 10, "summary": "- Asked for bills"}
+    tail = [
+        {"type": "tool", "text": "result", "tool_call_id": "c1", "seq": 10},
+        {"type": "human", "text": "thanks", "seq": 11, "tokens": 3},
+        {"type": "ai", "text": "welcome", "seq": 12, "tokens": 4},
+    ]
+    store, db = make_store(doc, tail)
+
+    messages, tokens, _, ids = store.load("1234567890")
+
+    assert db.read_subcollection.call_args.kwargs["start_at"] == 10
+    assert isinstance(messages[1], SystemMessage)
+    assert messages[1].content == f"{SUMMARY_PREFIX}\n- Asked for bills"
+    assert [m.content for m in messages[2:]] == ["thanks", "welcome"]
+    assert tokens[2:] == [3, 4]
+    assert ids == [message_document_id(11), message_document_id(12)]
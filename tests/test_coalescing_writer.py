@@ -0,0 +1,114 @@
+"""
+Tests for the coalescing Firestore writer of background jobs.
+"""
+
+from unittest.mock import MagicMock
+
+from firebase_admin import firestore
+
+from app.services.db_service import MAX_WRITE_ATTEMPTS, CoalescingWriter
+from app.utils.background_job import DB_COLLECTION, BackgroundJob, JobStatus
+
+
+def test_job_updates_are_merged_into_one_write():
+    """A burst of progress updates becomes one write, flushed by the status."""
+    db = MagicMock()
+    job = BackgroundJob(CoalescingWriter(db=db, window=60))
+    job.add_job_to_db({"status": str(JobStatus.IN_PROGRESS)})
+    for step in range(5):
+        job.update_job_progress({"message": f"step {step}"})
+    db.commit_writes.assert_not_called()
+
+    job.update_job_status(JobStatus.DONE)
+
+    db.commit_writes.assert_called_once()
+    (write,) = db.commit_writes.call_args.args[0]
+    assert write.op == "set"
+    assert write.path == (DB_COLLECTION, job.job_id)
+    assert write.data["status"] == str(JobStatus.DONE)
+    assert [log["message"] for log in write.data["logs"]][-1] == "step 4"
+
+
+def test_later_progress_only_sends_new_events():
+    """Later progress is appended with ArrayUnion, status is a partial update."""
+    db = MagicMock()
+    job = BackgroundJob(CoalescingWriter(db=db, window=60))
+    job.add_job_to_db({"status": str(JobStatus.IN_PROGRESS)})
+    job.update_job_progress({"message": "step 0"})
+    job.close()
+
+    job.update_job_progress({"message": "step 1"})
+    job.update_job_progress({"message": "step 2"})
+    job.update_job_status(JobStatus.FAILED, {"error": "boom"})
+
+    (write,) = db.commit_writes.call_args.args[0]
+    assert write.op == "update"
+    assert set(write.data) == {"logs", "status", "completed_at", "error"}
+    assert isinstance(write.data["logs"], firestore.ArrayUnion)
+    assert [log["message"] for log in write.data["logs"].values] == [
+        "step 1",
+        "step 2",
+    ]
+    assert len(job.data["logs"]) == 3
+
+
+def test_writes_are_copied_and_flushed_on_exit():
+    """Changes after a write are not written, pending writes are flushed on exit."""
+    db = MagicMock()
+    data = {"logs": ["first"]}
+    with CoalescingWriter(db=db, window=60) as writer:
+        writer.write("jobs", "a", data)
+        writer.write("jobs", "b", {"status": "done"})
+        data["logs"].append("second")
+
+    writes = db.commit_writes.call_args.args[0]
+    assert [w.path for w in writes] == [("jobs", "a"), ("jobs", "b")]
+    assert writes[0].data == {"logs": ["first"]}
+
+
+def test_zero_window_writes_immediately():
+    db = MagicMock()
+    writer = CoalescingWriter(db=db, window=0)
+    writer.write("jobs", "a", {"status": "done"})
+    writer.write("jobs", "a", {"status": "failed"})
+
+    assert db.commit_writes.call_count == 2
+
+
+def test_failed_flush_is_retried_with_later_writes():
+    """A failed flush loses no events and a failed creation stays a set."""
+    db = MagicMock()
+    db.commit_writes.side_effect = [Exception("unavailable"), None]
+    job = BackgroundJob(CoalescingWriter(db=db, window=60))
+    job.add_job_to_db({"status": str(JobStatus.IN_PROGRESS)})
+    job.update_job_progress({"message": "step 0"})
+    job.close()
+
+    job.update_job_progress({"message": "step 1"})
+    job.update_job_status(JobStatus.DONE)
+
+    assert db.commit_writes.call_count == 2
+    (write,) = db.commit_writes.call_args.args[0]
+    assert write.op == "set"
+    assert write.data["status"] == str(JobStatus.DONE)
+    assert [log["message"] for log in write.data["logs"]] == [
+        log["message"] for log in job.data["logs"]
+    ]
+
+
+def test_failed_updates_are_merged_and_eventually_dropped():
+    db = MagicMock()
+    db.commit_writes.side_effect = Exception("unavailable")
+    writer = CoalescingWriter(db=db, window=60)
+    writer.update("jobs", "a", {"logs": firestore.ArrayUnion(["one"])})
+    writer.flush()
+    writer.update("jobs", "a", {"logs": firestore.ArrayUnion(["two"])})
+    writer.flush()
+
+    (write,) = db.commit_writes.call_args.args[0]
+    assert write.op == "update"
+    assert write.data["logs"].values == ["one", "two"]
+
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        writer.flush()
+    assert db.commit_writes.call_count == MAX_WRITE_ATTEMPTS
@@ -0,0 +1,76 @@
+"""
+Tests for the LLM concurrency limiter.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.utils.concurrency import ConcurrencyLimiter, LimiterTimeoutError
+
+
+def test_limiter_caps_concurrent_threads():
+    """No more than limit threads hold a slot at the same time."""
+    limiter = ConcurrencyLimiter("test-threads", 2)
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def call():
+        nonlocal active, peak
+        with limiter.limit_sync():
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda _: call(), range(12)))
+
+    assert peak == 2
+
+
+def test_limiter_shares_slots_between_threads_and_coroutines():
+    """A slot released by a thread is handed to a waiting coroutine."""
+    limiter = ConcurrencyLimiter("test-mixed", 1)
+    order = []
+
+    async def scenario():
+        limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        await asyncio.to_thread(limiter.release)
+        await asyncio.wait_for(waiter, 1)
+        order.append("coroutine")
+        limiter.release()
+
+    asyncio.run(scenario())
+
+    assert order == ["coroutine"]
+    with limiter.limit_sync(timeout=0.1):
+        pass
+
+
+def test_limiter_timeout_gives_up_its_place():
+    """Timed out waiters raise and do not leak a slot."""
+    limiter = ConcurrencyLimiter("test-timeout", 1)
+
+    async def scenario():
+        async with limiter.limit_async():
+            with pytest.raises(LimiterTimeoutError):
+                await limiter.acquire_async(timeout=0.01)
+        with pytest.raises(LimiterTimeoutError):
+            with limiter.limit_sync():
+                limiter.acquire(timeout=0.01)
+
+    asyncio.run(scenario())
+
+    with limiter.limit_sync(timeout=0.1):
+        pass
@@ -0,0 +1,71 @@
+"""
+Tests for the index of already ingested documents.
+"""
+
+from unittest.mock import MagicMock, patch
+
+from app.services import document_index as document_index_module
+from app.services.document_index import DOCUMENT_INDEX_COLLECTION, document_index
+from app.utils import background_job
+from app.utils.background_job import DocumentJob, JobStatus, process_document
+
+WHATSAPP_HASH = "Kx2/9fOq+T1e/8vS0wZ3g4h5j6k7l8m9n0p1q2r3s4t="
+
+
+def test_document_ids_are_safe_and_per_user():
+    """Hashes with "/" map to a plain ID, the same hash differs per user."""
+    with patch.object(document_index_module, "db_service") as db:
+        db.read.return_value = {"job_id": "job-1"}
+        assert document_index.find("111", WHATSAPP_HASH) == {"job_id": "job-1"}
+        document_index.save("111", WHATSAPP_HASH, {"job_id": "job-1"})
+        document_index.find("222", WHATSAPP_HASH)
+
+    (collection, found_id), _ = db.read.call_args_list[0]
+    (_, saved_id, data), _ = db.write.call_args
+    (_, other_user_id), _ = db.read.call_args_list[1]
+    assert collection == DOCUMENT_INDEX_COLLECTION
+    assert "/" not in found_id
+    assert found_id == saved_id != other_user_id
+    assert data["doc_hash"] == WHATSAPP_HASH
+    assert data["user_id"] == "111"
+
+
+def test_documents_without_hash_are_not_indexed():
+    with patch.object(document_index_module, "db_service") as db:
+        assert document_index.find("111", "") is None
+        document_index.save("111", "", {})
+
+    db.read.assert_not_called()
+    db.write.assert_not_called()
+
+
+def test_duplicate_document_skips_streaming_and_indexing():
+    """A document sent before is answered from the index."""
+    document = DocumentJob(
+        sender_id="111",
+        type="document",
+        whatsapp_id="wamid.1",
+        doc_caption="",
+        doc_filename="bill.pdf",
+        doc_mime="application/pdf",
+        doc_id="media-1",
+        doc_hash=WHATSAPP_HASH,
+    )
+    job = MagicMock()
+    with (
+        patch.object(background_job, "BackgroundJob", return_value=job),
+        patch.object(background_job, "document_index") as index,
+        patch.object(background_job, "stream_document_to_gcs") as stream,
+        patch.object(background_job, "DocumentCreator") as creator,
+        patch.object(background_job, "send_whatsapp_message") as send,
+    ):
+        index.find.return_value = {"job_id": "job-1", "summary": "Hydro bill"}
+        process_document(document)
+
+    stream.assert_not_called()
+    creator.create_document_from_pdf.assert_not_called()
+    index.save.assert_not_called()
+    job.update_job_status.assert_called_once_with(
+        JobStatus.DUPLICATE, {"duplicate_of": "job-1"}
+    )
+    assert "Hydro bill" in send.call_args.args[1]
@@ -0,0 +1,75 @@
+"""
+Round-trip tests for the compressed chat history codec.
+"""
+
+from unittest.mock import MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.services.chat_history_store import DocumentChatHistoryStore
+from app.utils.helpers import (
+    HISTORY_BLOB_MAGIC,
+    HISTORY_BLOB_VERSION,
+    decode_history,
+    encode_history,
+    langchain_msg_to_dict,
+    list_to_langchain_msg,
+)
+
+MESSAGES = [
+    SystemMessage("You are Jinja"),
+    HumanMessage("Show my bills from März ₹  |  latest_whatsapp_msg_id=wamid.1"),
+    AIMessage(
+        "",
+        tool_calls=[
+            {
+                "name": "query_for_invoices",
+                "args": {"query": "bills from March", "limit": 3},
+                "id": "call_1",
+            }
+        ],
+    ),
+    ToolMessage("[Document(page_content='Hydro bill')]" * 100, tool_call_id="call_1"),
+    AIMessage("Here are your bills."),
+]
+
+
+@pytest.mark.parametrize("serializer", ["msgpack", "json"])
+def test_history_round_trips(serializer):
+    """Decoding an encoded history gives back the same messages."""
+    msg_dicts = langchain_msg_to_dict(MESSAGES)
+    msg_dicts[0]["tokens"] = 7
+
+    blob = encode_history(msg_dicts, serializer)
+
+    assert blob[:3] == HISTORY_BLOB_MAGIC + bytes([HISTORY_BLOB_VERSION])
+    assert decode_history(blob) == msg_dicts
+    assert list_to_langchain_msg(decode_history(blob)) == MESSAGES
+    assert len(blob) < len(str(msg_dicts))
+
+
+def test_unknown_versions_are_rejected():
+    """Blobs of another codec version or format are not decoded."""
+    blob = encode_history(langchain_msg_to_dict(MESSAGES))
+
+    with pytest.raises(ValueError):
+        decode_history(blob[:2] + bytes([HISTORY_BLOB_VERSION + 1]) + blob[3:])
+    with pytest.raises(ValueError):
+        decode_history(b"{}")
+
+
+def test_document_store_reads_and_writes_blobs():
+    """With a codec the document store writes a blob and reads it back."""
+    db = MagicMock()
+    db.read_with_update_time.return_value = (None, None)
+    store = DocumentChatHistoryStore(collection="chat_history", db=db, codec="msgpack")
+
+    store.save("1234567890", MESSAGES, [1] * len(MESSAGES), None, [])
+    data = db.create.call_args.args[2]
+    assert "messages" not in data
+
+    db.read_with_update_time.return_value = ({"blob": data["blob"]}, None)
+    messages, tokens, _, _ = store.load("1234567890")
+    assert messages == MESSAGES
+    assert tokens == [1] * len(MESSAGES)
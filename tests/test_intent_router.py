@@ -0,0 +1,188 @@
+"""
+Tests for the deterministic intent router.
+"""
+
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.services.intent_router import (
+    GOODBYE,
+    GREETING,
+    TEMPLATES,
+    THANKS,
+    IntentRouter,
+    RoutedIntent,
+    fast_path_total,
+    intent_router,
+    message_text,
+)
+
+
+def text_message(body):
+    return {
+        "from": "1234567890",
+        "id": "wamid.1",
+        "type": "text",
+        "text": {"body": body},
+    }
+
+
+def list_reply(reply_id, title):
+    return {
+        "from": "1234567890",
+        "id": "wamid.2",
+        "type": "interactive",
+        "interactive": {
+            "type": "list_reply",
+            "list_reply": {"id": reply_id, "title": title},
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "body, intent",
+    [
+        ("Hi!", GREETING),
+        ("  Good   morning 👋", GREETING),
+        ("Thank you!!", THANKS),
+        ("ok bye", GOODBYE),
+    ],
+)
+def test_small_talk_is_answered_from_templates(body, intent):
+    """Small talk maps to its template, goodbyes also clear the context."""
+    routed = intent_router.route(text_message(body))
+
+    assert routed.name == intent
+    assert routed.reply == TEMPLATES[intent]
+    assert routed.clear_context == (intent == GOODBYE)
+
+
+@pytest.mark.parametrize(
+    "body", ["hi, send me my hydro bill for March", "thanks for the invoices of 2024"]
+)
+def test_other_messages_go_to_the_llm(body):
+    """Anything beyond plain small talk is left to the LLM."""
+    assert intent_router.route(text_message(body)) is None
+
+
+def test_interactive_replies_are_dispatched_by_id():
+    """Registered reply IDs run their handler, others fall back to the title."""
+    router = IntentRouter()
+    router.register_interactive(
+        "show_march", lambda sender_id, reply: RoutedIntent("show", reply["title"])
+    )
+
+    assert router.route(list_reply("show_march", "March bills")).reply == "March bills"
+    assert router.route(list_reply("other", "Other bills")) is None
+    assert message_text(list_reply("other", "Other bills")) == "Other bills"
+
+
+def test_no_interactive_replies_are_registered_by_default():
+    """No message the bot sends has buttons, their replies go to the LLM."""
+    assert intent_router.route(list_reply(GOODBYE, "Goodbye")) is None
+
+
+@pytest.fixture
+def webhook_deps():
+    """Dependencies of process_whatsapp_message, with a fake chat history."""
+    history = MagicMock()
+    with (
+        patch("app.main.check_messages_status_and_save") as dedup,
+        patch("app.main.send_read_receipt"),
+        patch("app.main.FirebaseChatHistory.aload", AsyncMock(return_value=history)),
+        patch("app.main.async_whatsapp_client") as client,
+        patch("app.main.turn_executor") as executor,
+    ):
+        client.send_whatsapp_message = AsyncMock(return_value=(True, None))
+        executor.run = AsyncMock()
+        yield dedup, history, client, executor
+
+
+def test_fast_path_reply_is_recorded_in_the_history(webhook_deps):
+    """The next LLM turn sees the small talk exchange."""
+    from app.main import process_whatsapp_message
+
+    dedup, history, client, executor = webhook_deps
+    dedup.return_value = [False]
+
+    asyncio.run(process_whatsapp_message(text_message("Thanks!"), None))
+
+    history.add_human_messages_as_turn.assert_called_once_with([("Thanks!", "wamid.1")])
+    history.add_ai_message.assert_called_once_with(TEMPLATES[THANKS])
+    history.commit.assert_called_once()
+    client.send_whatsapp_message.assert_awaited_once()
+    executor.run.assert_not_called()
+
+
+def test_retried_messages_are_not_routed(webhook_deps):
+    from app.main import process_whatsapp_message
+
+    dedup, history, client, _ = webhook_deps
+    dedup.return_value = [True]
+    before = fast_path_total.value(intent=THANKS)
+
+    asyncio.run(process_whatsapp_message(text_message("Thanks!"), None))
+
+    assert fast_path_total.value(intent=THANKS) == before
+    client.send_whatsapp_message.assert_not_called()
+    history.commit.assert_not_called()
+
+
+def test_duplicate_cancels_history_load_and_sends_no_read_receipt(webhook_deps):
+    """Tasks started before the dedup answer are not left dangling."""
+    from app import main
+
+    dedup, _, _, _ = webhook_deps
+    dedup.return_value = [True]
+    load_cancelled = []
+
+    async def slow_load(sender_id):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            load_cancelled.append(sender_id)
+            raise
+
+    async def run():
+        with (
+            patch("app.main.FirebaseChatHistory.aload", slow_load),
+            patch("app.main.send_read_receipt") as receipt,
+        ):
+            await main.process_whatsapp_message(text_message("Thanks!"), None)
+        await asyncio.sleep(0)
+        return receipt
+
+    receipt = asyncio.run(run())
+
+    assert load_cancelled == ["1234567890"]
+    receipt.assert_not_called()
+    assert not main._background_tasks
+
+
+def test_read_receipt_of_new_message_is_kept_until_sent(webhook_deps):
+    from app import main
+
+    dedup, _, _, _ = webhook_deps
+    dedup.return_value = [False]
+    receipt_sent = threading.Event()
+
+    async def run():
+        with patch(
+            "app.main.send_read_receipt",
+            lambda *args, **kwargs: receipt_sent.wait(1),
+        ):
+            await main.process_whatsapp_message(text_message("Thanks!"), None)
+            # The read receipt is referenced until it is done
+            pending = set(main._background_tasks)
+            receipt_sent.set()
+            await asyncio.gather(*pending)
+        await asyncio.sleep(0)
+        return pending
+
+    pending = asyncio.run(run())
+
+    assert pending
+    assert not main._background_tasks
@@ -0,0 +1,61 @@
+"""
+Tests for the cursor pagination of the admin job list.
+"""
+
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.api.admin.admin import current_user
+from app.main import app
+from app.utils.background_job import JobStatus
+from app.utils.helpers import decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def jobs():
+    app.dependency_overrides[current_user] = lambda: None
+    with patch("app.api.admin.admin.job_service") as job_service:
+        job_service.get_jobs = AsyncMock()
+        yield job_service.get_jobs
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize(
+    "value",
+    [datetime(2025, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), "abc", 42],
+)
+def test_cursor_round_trips(value):
+    assert decode_cursor(encode_cursor(value, "job-1")) == (value, "job-1")
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor", encode_cursor(1, "a")[:-2]])
+def test_invalid_cursors_are_rejected(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_runs_return_the_next_cursor_in_a_header(client, jobs):
+    """The body stays a list and the next page is in X-Next-Cursor."""
+    jobs.return_value = ([{"job_id": "a"}], "next")
+
+    response = client.get(
+        "/api/admin/runs",
+        params={"page_size": 1, "cursor": "prev", "status": "done"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [{"job_id": "a"}]
+    assert response.headers["X-Next-Cursor"] == "next"
+    assert jobs.call_args.args[:3] == (1, "prev", JobStatus.DONE)
+
+
+def test_last_page_has_no_cursor_and_bad_cursors_are_rejected(client, jobs):
+    jobs.return_value = ([], None)
+    response = client.get("/api/admin/runs")
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+    jobs.side_effect = ValueError("Invalid page cursor")
+    assert client.get("/api/admin/runs", params={"cursor": "x"}).status_code == 400
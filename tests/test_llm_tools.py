@@ -0,0 +1,230 @@
+"""
+Tests for running LLM tool calls.
+"""
+
+import threading
+import time
+from unittest.mock import patch
+
+from app.utils.llm_tools import run_llm_tools, settings
+
+
+class FakeTool:
+    def __init__(self, result, delay=0.0, barrier=None):
+        self.result = result
+        self.delay = delay
+        self.barrier = barrier
+
+    def invoke(self, args):
+        if self.barrier:
+            self.barrier.wait(timeout=1)
+        time.sleep(self.delay)
+        return self.result
+
+
+class FakeHistory:
+    def __init__(self):
+        self.tool_messages = []
+
+    def add_tool_message(self, msg, tool_call_id):
+        self.tool_messages.append((tool_call_id, msg))
+
+
+def tool_call(name, call_id):
+    return {"name": name, "args": {}, "id": call_id}
+
+
+def test_tool_calls_run_concurrently_in_order():
+    """Independent calls overlap and their results keep the requested order."""
+    # Both tools must be running at the same time to pass the barrier
+    barrier = threading.Barrier(2)
+    functions = {
+        "slow": FakeTool("slow result", delay=0.05, barrier=barrier),
+        "fast": FakeTool("fast result", barrier=barrier),
+    }
+    history = FakeHistory()
+
+    with patch.dict("app.utils.llm_tools.functions", functions, clear=True):
+        run_llm_tools(
+            [tool_call("slow", "1"), tool_call("fast", "2")], history, "1234567890"
+        )
+
+    assert history.tool_messages == [("1", "slow result"), ("2", "fast result")]
+
+
+def test_tool_call_timeout_and_unknown_tool():
+    """Timed out and unknown calls still get a result message."""
+    functions = {"hang": FakeTool("late", delay=0.5)}
+    history = FakeHistory()
+
+    with (
+        patch.dict("app.utils.llm_tools.functions", functions, clear=True),
+        patch.dict("app.utils.llm_tools.TOOL_TIMEOUTS", {"hang": 0.05}),
+    ):
+        run_llm_tools(
+            [tool_call("hang", "1"), tool_call("missing", "2")], history, "1234567890"
+        )
+
+    assert [call_id for call_id, _ in history.tool_messages] == ["1", "2"]
+    assert "timed out" in history.tool_messages[0][1]
+    assert "Unknown tool" in history.tool_messages[1][1]
+
+
+def test_timeouts_count_from_submission():
+    """Concurrent calls that hang time out together, not one after the other."""
+    functions = {"hang": FakeTool("late", delay=0.5)}
+    history = FakeHistory()
+
+    with (
+        patch.dict("app.utils.llm_tools.functions", functions, clear=True),
+        patch.dict("app.utils.llm_tools.TOOL_TIMEOUTS", {"hang": 0.1}),
+    ):
+        started = time.monotonic()
+        run_llm_tools(
+            [tool_call("hang", str(i)) for i in range(3)], history, "1234567890"
+        )
+        elapsed = time.monotonic() - started
+
+    assert all("timed out" in msg for _, msg in history.tool_messages)
+    assert elapsed < 0.2
+
+
+def test_timed_out_send_is_recorded_once_and_not_retried():
+    """A late send is one timeout sample and the model is told not to retry."""
+    functions = {"send_invoice": FakeTool("sent", delay=0.2)}
+    history = FakeHistory()
+
+    with (
+        patch.dict("app.utils.llm_tools.functions", functions, clear=True),
+        patch.dict("app.utils.llm_tools.TOOL_TIMEOUTS", {"send_invoice": 0.05}),
+        patch("app.utils.llm_tools.tool_seconds") as tool_seconds,
+    ):
+        run_llm_tools([tool_call("send_invoice", "1")], history, "1234567890")
+        time.sleep(0.3)
+
+    assert "do not call it again" in history.tool_messages[0][1]
+    tool_seconds.observe.assert_called_once()
+    assert tool_seconds.observe.call_args.kwargs["outcome"] == "timeout"
+
+
+def test_search_and_send_invoices_sends_without_local_files():
+    """Matching invoices are sent from memory and no path reaches the model."""
+    from langchain_core.documents import Document
+
+    from app.utils.llm_tools import search_and_send_invoices
+
+    doc = Document(
+        page_content="Provider: Hydro, Invoice Date: 2024-03-01",
+        metadata={
+            "gcp_blob_path": "documents/abc.pdf",
+            "user_id": "1234567890",
+            "provider": "Hydro One",
+            "invoice_date": "2024-03-01",
+        },
+    )
+    with (
+        patch("app.utils.llm_tools.vdb") as mock_vdb,
+        patch("app.utils.llm_tools.gcp_storage") as mock_storage,
+        patch("app.utils.llm_tools.send_whatsapp_document") as mock_send,
+        patch.object(settings, "invoice_unowned_fallback", True),
+    ):
+        mock_vdb.search.return_value = [doc, doc]
+        mock_storage.read_bytes.return_value = b"%PDF"
+        mock_send.return_value = (True, "wamid.1")
+
+        result = search_and_send_invoices.func("1234567890", "hydro march")
+
+    mock_send.assert_called_once_with(
+        "1234567890", b"%PDF", "abc.pdf", doc.page_content, "Hydro_One_2024-03-01.pdf"
+    )
+    assert "Sent 1 invoice(s)" in result
+    assert "documents/abc.pdf" not in result
+    assert mock_vdb.search.call_args.kwargs["filter"] == {
+        "$or": [{"user_id": "1234567890"}, {"user_id": {"$exists": False}}]
+    }
+
+
+def test_invoices_of_other_users_are_never_sent():
+    """A hit or a location of another user's invoice is rejected."""
+    from langchain_core.documents import Document
+
+    from app.utils.llm_tools import search_and_send_invoices, send_invoice
+
+    other = Document(
+        page_content="Provider: Hydro",
+        metadata={"gcp_blob_path": "documents/x.pdf", "user_id": "999"},
+    )
+    with (
+        patch("app.utils.llm_tools.vdb") as mock_vdb,
+        patch("app.utils.llm_tools.gcp_storage") as mock_storage,
+        patch("app.utils.llm_tools.send_whatsapp_document") as mock_send,
+    ):
+        mock_vdb.search.return_value = [other]
+        search_and_send_invoices.func("1234567890", "hydro")
+
+        mock_vdb.find_metadata.return_value = None
+        result = send_invoice.func("1234567890", "documents/x.pdf", "Bill", "x.pdf")
+
+    # The location is checked by metadata, without a second similarity search
+    mock_vdb.search.assert_called_once()
+    lookup = mock_vdb.find_metadata.call_args.args[0]
+    assert lookup["gcp_blob_path"] == "documents/x.pdf"
+    assert "Failed" in result
+    mock_storage.read_bytes.assert_not_called()
+    mock_send.assert_not_called()
+
+
+def test_own_whatsapp_document_is_sent_without_a_lookup():
+    """A path in the user's own document folder needs no vector DB call."""
+    from app.utils.llm_tools import send_invoice
+
+    with (
+        patch("app.utils.llm_tools.vdb") as mock_vdb,
+        patch("app.utils.llm_tools.gcp_storage") as mock_storage,
+        patch("app.utils.llm_tools.send_whatsapp_document") as mock_send,
+    ):
+        mock_storage.read_bytes.return_value = b"%PDF"
+        mock_send.return_value = (True, "wamid.1")
+        send_invoice.func("1234567890", "documents/1234567890/a.pdf", "Bill", "a.pdf")
+
+        # Another user's folder is not taken on trust
+        mock_vdb.find_metadata.return_value = None
+        send_invoice.func("1234567890", "documents/999/a.pdf", "Bill", "a.pdf")
+
+    mock_vdb.search.assert_not_called()
+    mock_vdb.find_metadata.assert_called_once()
+    mock_send.assert_called_once()
+
+
+def test_unowned_invoices_match_until_the_fallback_is_off():
+    """Invoices indexed without an owner stay findable until backfilled."""
+    from langchain_core.documents import Document
+
+    from app.utils.llm_tools import search_and_send_invoices
+
+    legacy = Document(
+        page_content="Provider: Hydro", metadata={"gcp_blob_path": "documents/x.pdf"}
+    )
+    with (
+        patch("app.utils.llm_tools.vdb") as mock_vdb,
+        patch("app.utils.llm_tools.gcp_storage"),
+        patch("app.utils.llm_tools.send_whatsapp_document") as mock_send,
+        patch.object(settings, "invoice_unowned_fallback", False),
+    ):
+        mock_vdb.search.return_value = [legacy]
+        search_and_send_invoices.func("1234567890", "hydro")
+
+    assert mock_vdb.search.call_args.kwargs["filter"] == {"user_id": "1234567890"}
+    mock_send.assert_not_called()
+
+    with (
+        patch("app.utils.llm_tools.vdb") as mock_vdb,
+        patch("app.utils.llm_tools.gcp_storage"),
+        patch("app.utils.llm_tools.send_whatsapp_document") as mock_send,
+        patch.object(settings, "invoice_unowned_fallback", True),
+    ):
+        mock_vdb.search.return_value = [legacy]
+        mock_send.return_value = (True, "wamid.1")
+        search_and_send_invoices.func("1234567890", "hydro")
+
+    mock_send.assert_called_once()
@@ -0,0 +1,127 @@
+"""
+Tests for streaming WhatsApp documents to GCS.
+"""
+
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.gcp_storage import GCPStorage
+from app.utils import background_job
+from app.utils.background_job import DocumentJob, stream_document_to_gcs, tee_chunks
+
+CHUNKS = [b"%PDF-1.4\n", b"x" * 1024, b"%%EOF"]
+
+
+class FakeBlobWriter:
+    """Stands in for BlobWriter, which cancels the upload on an error."""
+
+    def __init__(self):
+        self.data = b""
+        self.finalized = False
+        self.cancelled = False
+
+    def write(self, chunk):
+        self.data += chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.cancelled = True
+        else:
+            self.finalized = True
+
+
+def document_job():
+    return DocumentJob(
+        sender_id="111",
+        type="document",
+        whatsapp_id="wamid.1",
+        doc_caption="",
+        doc_filename="bill.pdf",
+        doc_mime="application/pdf",
+        doc_id="media-1",
+        doc_hash="hash",
+    )
+
+
+def stream(chunks):
+    """Stream a document through a real GCPStorage with a fake bucket."""
+    writer = FakeBlobWriter()
+    storage = GCPStorage.__new__(GCPStorage)
+    storage.bucket = MagicMock()
+    storage.bucket.blob.return_value.open.return_value = writer
+    spools = []
+    spooled_file = tempfile.SpooledTemporaryFile
+
+    def make_spool(**kwargs):
+        spools.append(spooled_file(**kwargs))
+        return spools[-1]
+
+    with (
+        patch.object(background_job, "gcp_storage", storage),
+        patch.object(background_job, "iter_whatsapp_media", return_value=chunks),
+        patch.object(background_job.tempfile, "SpooledTemporaryFile", make_spool),
+    ):
+        result = stream_document_to_gcs(document_job(), "documents/111/bill.pdf")
+    return result, writer, spools[0], storage.bucket
+
+
+def test_tee_chunks_yields_and_writes_every_chunk():
+    with tempfile.SpooledTemporaryFile() as file:
+        assert list(tee_chunks(iter(CHUNKS), file)) == CHUNKS
+        file.seek(0)
+        assert file.read() == b"".join(CHUNKS)
+
+
+def test_document_reaches_gcs_and_spool_in_one_pass():
+    """The same bytes are uploaded and buffered, the buffer is rewound."""
+    result, writer, spool, bucket = stream(iter(CHUNKS))
+
+    assert result is spool
+    assert spool.tell() == 0
+    with result:
+        assert result.read() == b"".join(CHUNKS)
+    assert writer.data == b"".join(CHUNKS)
+    assert writer.finalized
+    bucket.blob.assert_called_once_with("documents/111/bill.pdf")
+    assert bucket.blob.return_value.open.call_args.kwargs["content_type"] == (
+        "application/pdf"
+    )
+
+
+def test_failed_download_cancels_the_upload():
+    """A download error leaves no partial blob and closes the buffer."""
+
+    def failing_chunks():
+        yield CHUNKS[0]
+        raise ConnectionError("media download interrupted")
+
+    result, writer, spool, _ = stream(failing_chunks())
+
+    assert result is None
+    assert spool.closed
+    assert writer.cancelled
+    assert not writer.finalized
+
+
+def test_job_creation_error_is_not_hidden():
+    """The error is raised as is, not as an unbound job in the cleanup."""
+    web_document = background_job.WebDocumentJob(
+        user_id="111",
+        doc_filename="bill.pdf",
+        doc_mime="application/pdf",
+        gcs_path="uploads/bill.pdf",
+    )
+    with patch.object(
+        background_job, "BackgroundJob", side_effect=RuntimeError("no firestore")
+    ):
+        with pytest.raises(RuntimeError, match="no firestore"):
+            background_job.process_document(document_job())
+        with pytest.raises(RuntimeError, match="no firestore"):
+            background_job.process_web_document(
+                web_document, "uploads/bill.pdf", "/tmp/bill.pdf"
+            )
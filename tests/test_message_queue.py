@@ -0,0 +1,174 @@
+"""
+Tests for the in-process message queue.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.message_queue import MessageQueue, QueueFullError
+
+
+def test_message_queue_processes_messages():
+    """Test that queued messages are handled by the workers."""
+    handled = []
+
+    async def run():
+        queue = MessageQueue(handled.append, max_size=10, workers=2)
+        await queue.start()
+        for i in range(5):
+            queue.submit({"id": f"msg_{i}", "from": "1"})
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+
+    assert sorted(m["id"] for m in handled) == [f"msg_{i}" for i in range(5)]
+    assert stats["processed"] == 5
+    assert stats["failed"] == 0
+    assert stats["running"] is False
+
+
+def test_message_queue_rejects_when_full():
+    """Test that submit raises once the queue reaches its maximum size."""
+    release = threading.Event()
+
+    async def run():
+        queue = MessageQueue(lambda m: release.wait(5), max_size=1, workers=1)
+        await queue.start()
+        queue.submit({"id": "busy", "from": "1"})
+        # Give the worker a chance to pick up the first message
+        await asyncio.sleep(0.05)
+        queue.submit({"id": "waiting", "from": "1"})
+        with pytest.raises(QueueFullError):
+            queue.submit({"id": "rejected", "from": "1"})
+        stats = queue.stats()
+        release.set()
+        await queue.stop()
+        return stats
+
+    stats = asyncio.run(run())
+
+    assert stats["depth"] == 1
+    assert stats["busy_workers"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_message_queue_survives_handler_errors():
+    """Test that a failing handler does not stop the worker."""
+    handled = []
+
+    def handler(message):
+        if message["id"] == "bad":
+            raise ValueError("boom")
+        time.sleep(0.01)
+        handled.append(message["id"])
+
+    async def run():
+        queue = MessageQueue(handler, max_size=10, workers=1)
+        await queue.start()
+        queue.submit({"id": "bad", "from": "1"})
+        queue.submit({"id": "good", "from": "1"})
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+
+    assert handled == ["good"]
+    assert stats["failed"] == 1
+    assert stats["processed"] == 1
+
+
+def test_message_queue_keeps_sender_order_and_runs_senders_concurrently():
+    """Test per-sender ordering while different senders are handled in parallel."""
+    handled = []
+    running = set()
+    overlap = []
+    lock = threading.Lock()
+
+    def handler(message):
+        with lock:
+            assert message["from"] not in running
+            running.add(message["from"])
+            if len(running) > 1:
+                overlap.append(True)
+        time.sleep(0.02)
+        with lock:
+            running.discard(message["from"])
+            handled.append((message["from"], message["id"]))
+
+    async def run():
+        queue = MessageQueue(handler, max_size=20, workers=4)
+        await queue.start()
+        for i in range(4):
+            queue.submit({"id": i, "from": "alice"})
+            queue.submit({"id": i, "from": "bob"})
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+
+    assert [i for sender, i in handled if sender == "alice"] == [0, 1, 2, 3]
+    assert [i for sender, i in handled if sender == "bob"] == [0, 1, 2, 3]
+    assert overlap
+    assert stats["processed"] == 8
+
+
+def test_message_queue_caps_active_conversations():
+    """Test that new senders are rejected once the conversation cap is reached."""
+    release = threading.Event()
+
+    async def run():
+        queue = MessageQueue(
+            lambda m: release.wait(5), max_size=10, workers=1, max_conversations=1
+        )
+        await queue.start()
+        queue.submit({"id": "1", "from": "alice"})
+        # The same conversation can keep queueing messages
+        queue.submit({"id": "2", "from": "alice"})
+        with pytest.raises(QueueFullError):
+            queue.submit({"id": "3", "from": "bob"})
+        release.set()
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["processed"] == 2
+    assert stats["rejected"] == 1
+
+
+def test_message_queue_coalesces_text_bursts():
+    """Test that a burst of text messages is merged into one turn."""
+    handled = []
+
+    async def run():
+        queue = MessageQueue(
+            handled.append, max_size=10, workers=1, coalesce_window_ms=50
+        )
+        await queue.start()
+        for i in range(3):
+            queue.submit(
+                {
+                    "id": f"msg_{i}",
+                    "from": "1",
+                    "type": "text",
+                    "text": {"body": f"{i}"},
+                }
+            )
+            await asyncio.sleep(0.01)
+        queue.submit({"id": "doc", "from": "1", "type": "document"})
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+
+    assert len(handled) == 2
+    assert handled[0]["id"] == "msg_2"
+    assert handled[0]["text"]["body"] == "0\n1\n2"
+    assert [m["id"] for m in handled[0]["coalesced"]] == ["msg_0", "msg_1", "msg_2"]
+    assert handled[1]["id"] == "doc"
+    assert stats["processed"] == 4
+    assert stats["messages_per_turn"] == {1: 1, 3: 1}
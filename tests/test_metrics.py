@@ -0,0 +1,61 @@
+"""
+Tests for the metrics registry, dependency tracking and the /metrics endpoint.
+"""
+
+import pytest
+
+from app.utils.metrics import (
+    Histogram,
+    collect_server_timing,
+    dependency_request_seconds,
+    track_dependency,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Buckets are cumulative and end with +Inf, sum and count."""
+    histogram = Histogram("test_seconds", "Test", ("operation",), buckets=(0.1, 1))
+    histogram.observe(0.05, operation="read")
+    histogram.observe(0.5, operation="read")
+    histogram.observe(5, operation="read")
+
+    rendered = histogram.render().splitlines()
+
+    assert rendered[:2] == ["# HELP test_seconds Test", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{operation="read",le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{operation="read",le="1.0"} 2' in rendered
+    assert 'test_seconds_bucket{operation="read",le="+Inf"} 3' in rendered
+    assert 'test_seconds_count{operation="read"} 3' in rendered
+
+
+def test_track_dependency_records_outcome_and_server_timing():
+    """Dependency calls are recorded with their outcome and in Server-Timing."""
+    labels = {"dependency": "test", "operation": "call"}
+    ok_before = dependency_request_seconds.count(**labels, outcome="ok")
+    error_before = dependency_request_seconds.count(**labels, outcome="error")
+
+    with collect_server_timing() as timings:
+        with track_dependency("test", "call"):
+            pass
+        with pytest.raises(RuntimeError):
+            with track_dependency("test", "call"):
+                raise RuntimeError("boom")
+
+    assert dependency_request_seconds.count(**labels, outcome="ok") == ok_before + 1
+    assert (
+        dependency_request_seconds.count(**labels, outcome="error") == error_before + 1
+    )
+    assert list(timings) == ["test_call"]
+
+
+def test_metrics_endpoint(client):
+    """The /metrics endpoint serves Prometheus text and responses carry timings."""
+    client.get("/health")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'route="/health"' in response.text
+    assert "message_queue_depth 0" in response.text
+    assert "total;dur=" in response.headers["server-timing"]
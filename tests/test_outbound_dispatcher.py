@@ -0,0 +1,140 @@
+"""
+Tests for the outbound WhatsApp dispatcher.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.client import RemoteDisconnected
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from app.utils.outbound_dispatcher import OutboundDispatcher, TokenBucket
+
+
+def make_response(status_code, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_token_bucket_spreads_requests_over_time():
+    """Test that a drained bucket asks callers to wait for new tokens."""
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0.09 < bucket.reserve() <= 0.1
+    assert 0.19 < bucket.reserve() <= 0.2
+
+
+@patch("app.utils.outbound_dispatcher.time.sleep")
+def test_dispatcher_retries_and_honours_retry_after(mock_sleep):
+    """Test that 429 responses are retried after the Retry-After delay."""
+    responses = [
+        make_response(429, {"Retry-After": "2"}),
+        make_response(503),
+        make_response(200),
+    ]
+    dispatcher = OutboundDispatcher(rate_per_second=100, max_retries=3, workers=1)
+
+    response = dispatcher.send("phone", lambda: responses.pop(0))
+
+    assert response.status_code == 200
+    assert mock_sleep.call_args_list[0].args[0] >= 2
+    assert dispatcher.stats()["retries"] == 2
+
+
+@patch("app.utils.outbound_dispatcher.time.sleep")
+def test_dispatcher_returns_last_response_when_retries_exhausted(mock_sleep):
+    """Test that the final failing response is handed back to the caller."""
+    dispatcher = OutboundDispatcher(rate_per_second=100, max_retries=1, workers=1)
+
+    response = dispatcher.send("phone", lambda: make_response(503))
+
+    assert response.status_code == 503
+    assert dispatcher.stats()["retries"] == 1
+
+
+@patch("app.utils.outbound_dispatcher.time.sleep")
+def test_other_5xx_are_only_retried_when_idempotent(mock_sleep):
+    """A 500 may come after the message was accepted, so sends are not repeated."""
+    dispatcher = OutboundDispatcher(rate_per_second=100, max_retries=3, workers=1)
+
+    send = dispatcher.send("phone", lambda: make_response(500))
+    responses = [make_response(500), make_response(200)]
+    receipt = dispatcher.send("phone", lambda: responses.pop(0), idempotent=True)
+
+    assert send.status_code == 500
+    assert receipt.status_code == 200
+    assert dispatcher.stats()["retries"] == 1
+
+
+@patch("app.utils.outbound_dispatcher.asyncio.sleep", new_callable=AsyncMock)
+def test_async_send_retries_connect_timeouts(mock_sleep):
+    """A connect timeout never reached the Graph API and is retried."""
+    dispatcher = OutboundDispatcher(rate_per_second=100, max_retries=3, workers=1)
+    outcomes = [httpx.ConnectTimeout("timed out"), make_response(200)]
+
+    async def request():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    response = asyncio.run(dispatcher.asend("phone", request))
+
+    assert response.status_code == 200
+    assert dispatcher.stats()["retries"] == 1
+
+
+def test_dispatcher_counts_concurrent_sends():
+    """Sends finished by several dispatcher threads are all counted."""
+    dispatcher = OutboundDispatcher(rate_per_second=10000, workers=8)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            executor.map(
+                lambda _: dispatcher.send("phone", lambda: make_response(200)),
+                range(400),
+            )
+        )
+
+    assert dispatcher.stats()["sent"] == 400
+
+
+@patch("app.utils.outbound_dispatcher.time.sleep")
+def test_dropped_connection_is_only_retried_when_idempotent(mock_sleep):
+    """A disconnect after the request was sent could deliver a send twice."""
+    dispatcher = OutboundDispatcher(rate_per_second=100, max_retries=3, workers=1)
+    dropped = requests.ConnectionError(
+        ProtocolError("Connection aborted.", RemoteDisconnected("closed"))
+    )
+    refused = requests.ConnectionError(
+        MaxRetryError(None, "/messages", NewConnectionError(None, "refused"))
+    )
+
+    def request_failing_with(*errors):
+        outcomes = [*errors, make_response(200)]
+
+        def request():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        return request
+
+    with pytest.raises(requests.ConnectionError):
+        dispatcher.send("phone", request_failing_with(dropped))
+    assert dispatcher.stats()["retries"] == 0
+
+    response = dispatcher.send("phone", request_failing_with(refused))
+    receipt = dispatcher.send("phone", request_failing_with(dropped), idempotent=True)
+
+    assert response.status_code == receipt.status_code == 200
+    assert dispatcher.stats()["retries"] == 2
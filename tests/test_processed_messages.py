@@ -0,0 +1,62 @@
+"""
+Tests for inbound message deduplication.
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from app.services import processed_messages
+from app.services.db_service import DocumentChangedError
+from app.services.processed_messages import (
+    RecentIds,
+    check_message_status_and_save,
+    check_messages_status_and_save,
+)
+
+
+@pytest.fixture
+def db():
+    with (
+        patch.object(processed_messages, "db_service") as db,
+        patch.object(processed_messages, "recent_message_ids", RecentIds(60, 100)),
+    ):
+        yield db
+
+
+def test_single_message_is_one_atomic_create(db):
+    """A new message costs one create, a fast retry costs nothing."""
+    assert check_message_status_and_save("wamid.1") is False
+    assert check_message_status_and_save("wamid.1") is True
+
+    db.create.assert_called_once()
+    db.read.assert_not_called()
+    db.commit_writes.assert_not_called()
+
+
+def test_existing_message_is_reported_processed(db):
+    """A create that finds the document is a duplicate, e.g. from another instance."""
+    db.create.side_effect = DocumentChangedError("exists")
+
+    assert check_message_status_and_save("wamid.1") is True
+
+
+def test_several_messages_are_created_in_one_batch(db):
+    """Several new messages cost one batch."""
+    result = check_messages_status_and_save(["wamid.1", "wamid.2", "wamid.1"])
+
+    assert result == [False, False, True]
+    writes = db.commit_writes.call_args.args[0]
+    assert [w.path[-1] for w in writes] == ["wamid.1", "wamid.2"]
+    db.create.assert_not_called()
+
+
+def test_batch_conflict_is_settled_one_by_one(db):
+    """A batch failing on a processed message creates each one on its own."""
+    db.commit_writes.side_effect = DocumentChangedError("exists")
+    db.create.side_effect = [None, DocumentChangedError("exists")]
+
+    result = check_messages_status_and_save(["wamid.1", "wamid.2"])
+
+    assert result == [False, True]
+    assert db.create.call_count == 2
@@ -0,0 +1,99 @@
+"""
+Tests for lazy singletons and the startup profile.
+"""
+
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.utils import lazy
+from app.utils.lazy import LazySingleton, lazy_singletons, warm_up
+from app.utils.startup_profile import ImportTimer, StartupProfile, startup_profile
+
+
+class _Client:
+    def __init__(self):
+        self.value = 42
+
+
+def test_lazy_singleton_initializes_on_first_use():
+    """The wrapped object is built once, on first attribute access."""
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return _Client()
+
+    singleton = LazySingleton("test-client", factory)
+    try:
+        assert not singleton.initialized
+        assert calls == []
+
+        assert singleton.value == 42
+        assert singleton.value == 42
+        assert singleton.initialized
+        assert calls == [1]
+        assert "test-client" in startup_profile.report()["client_init_ms"]
+    finally:
+        lazy_singletons.pop("test-client", None)
+
+
+def test_private_names_do_not_initialize():
+    """Probes of private and dunder names, e.g. by mock or abc, stay lazy."""
+    factory = MagicMock(return_value=_Client())
+    singleton = LazySingleton("test-client", factory)
+    try:
+        with pytest.raises(AttributeError):
+            singleton._private
+        assert not hasattr(singleton, "__wrapped__")
+        factory.assert_not_called()
+    finally:
+        lazy_singletons.pop("test-client", None)
+
+
+def test_warm_up_stops_when_asked():
+    """A set stop event leaves the remaining singletons uninitialized."""
+    stop = threading.Event()
+    first = LazySingleton("first", MagicMock(side_effect=stop.set))
+    second = LazySingleton("second", MagicMock())
+    for name in ("first", "second"):
+        lazy_singletons.pop(name)
+    with patch.object(lazy, "lazy_singletons", {"first": first, "second": second}):
+        warm_up(stop)
+
+    first._factory.assert_called_once()
+    second._factory.assert_not_called()
+
+
+def test_importing_app_does_not_initialize_clients():
+    """Importing the application leaves the service clients uninitialized."""
+    import app.main  # noqa: F401
+
+    for name in ("firestore", "gcs", "pinecone", "openai"):
+        assert not lazy_singletons[name].initialized
+
+
+def test_startup_profile_endpoint(client):
+    """The startup report lists module import and client init times."""
+    response = client.get("/health/startup")
+
+    assert response.status_code == 200
+    assert {"ready_ms", "imports_ms", "client_init_ms"} <= response.json().keys()
+
+
+def test_import_timer_records_imports_until_uninstalled():
+    """Imports are timed only while the timer is on sys.meta_path."""
+    profile = StartupProfile()
+    profile.install_import_timer()
+    try:
+        sys.modules.pop("colorsys", None)
+        import colorsys  # noqa: F401
+    finally:
+        profile.uninstall_import_timer()
+
+    assert "colorsys" in profile.report()["imports_ms"]
+    assert not any(
+        isinstance(f, ImportTimer) and f._profile is profile for f in sys.meta_path
+    )
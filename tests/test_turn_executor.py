@@ -0,0 +1,85 @@
+"""
+Tests for the turn executor budget handling.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from app.services.turn_executor import FALLBACK_MESSAGE, TurnExecutor
+
+TOOL_CALLS = {
+    "type": "tool_calls",
+    "tool_calls": [{"name": "unknown_tool", "args": {}, "id": "call_1"}],
+    "usage": {"total_tokens": 1000},
+}
+
+
+class FakeHistory:
+    def __init__(self):
+        self.messages = []
+
+    def add_ai_message(self, msg, tool_calls=None):
+        self.messages.append(("ai", msg, tool_calls))
+
+    def add_tool_message(self, msg, tool_call_id):
+        self.messages.append(("tool", msg, tool_call_id))
+
+    def trim(self):
+        pass
+
+
+def run_turn(executor, responses):
+    history = FakeHistory()
+    with patch("app.services.turn_executor.llm_service") as mock_llm:
+        mock_llm.aformat_and_query = AsyncMock(side_effect=responses)
+        result = asyncio.run(executor.run(history, "1234567890"))
+    return result, history, mock_llm
+
+
+def test_turn_returns_reply_after_tools():
+    """The reply ends the turn and is the last AI message in the history."""
+    reply = {"type": "message", "text": "Done", "usage": {"total_tokens": 500}}
+    result, history, _ = run_turn(TurnExecutor(), [TOOL_CALLS, reply])
+
+    assert result.text == "Done"
+    assert result.iterations == 2
+    assert result.tokens == 1500
+    assert result.exhausted is None
+    assert history.messages[-1] == ("ai", "Done", None)
+
+
+def test_turn_stops_at_max_iterations():
+    """A model that keeps calling tools gets the fallback after the cap."""
+    result, history, mock_llm = run_turn(
+        TurnExecutor(max_iterations=3), [TOOL_CALLS] * 10
+    )
+
+    assert mock_llm.aformat_and_query.await_count == 3
+    assert result.exhausted == "iterations"
+    assert result.text == FALLBACK_MESSAGE
+    assert history.messages[-1] == ("ai", FALLBACK_MESSAGE, None)
+
+
+def test_turn_stops_when_token_budget_is_used():
+    """The token budget is checked before every LLM call."""
+    result, _, mock_llm = run_turn(TurnExecutor(token_budget=2000), [TOOL_CALLS] * 10)
+
+    assert mock_llm.aformat_and_query.await_count == 2
+    assert result.exhausted == "tokens"
+
+
+def test_turn_stops_at_deadline():
+    """A slow LLM call is abandoned when the turn deadline passes."""
+
+    async def slow_query(messages, timeout=None):
+        await asyncio.sleep(1)
+
+    history = FakeHistory()
+    with patch("app.services.turn_executor.llm_service") as mock_llm:
+        mock_llm.aformat_and_query = slow_query
+        result = asyncio.run(
+            TurnExecutor(deadline_seconds=0.05).run(history, "1234567890")
+        )
+
+    assert result.exhausted == "deadline"
+    assert result.text == FALLBACK_MESSAGE
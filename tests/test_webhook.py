@@ -19,10 +19,10 @@ def mock_settings_class():
 
 
 @pytest.fixture
-def mock_process_whatsapp_message():
-    with patch("app.main.process_whatsapp_message") as mock_process_whatsapp_message:
-        mock_process_whatsapp_message.return_value = None
-        yield mock_process_whatsapp_message
+def mock_message_queue():
+    with patch("app.main.message_queue") as mock_message_queue:
+        mock_message_queue.submit.return_value = None
+        yield mock_message_queue
 
 
 def test_whatsapp_webhook_verification_success(mock_settings_class, client):
@@ -66,7 +66,7 @@ def test_whatsapp_webhook_verification_failure(client, mock_settings_class):
 
 
 def test_whatsapp_webhook_message_handling(
-    client, mock_settings_class, mock_process_whatsapp_message
+    client, mock_settings_class, mock_message_queue
 ):
     """Test the WhatsApp webhook POST endpoint for message handling."""
     from app.config import get_settings
@@ -119,11 +119,46 @@ def test_whatsapp_webhook_message_handling(
     assert response.status_code == 200
     assert response.json() == {"success": True}
 
-    # Verify message was processed
-    mock_process_whatsapp_message.assert_called_once()
+    # Verify message was enqueued for the workers
+    mock_message_queue.submit.assert_called_once()
 
-    # Extract the first argument (message) passed to process_whatsapp_message
-    message_arg = mock_process_whatsapp_message.call_args[0][0]
+    # Extract the first argument (message) passed to the queue
+    message_arg = mock_message_queue.submit.call_args[0][0]
     assert message_arg["id"] == "message_id_123"
     assert message_arg["type"] == "text"
     assert message_arg["text"]["body"] == "Bill for $100 from Electricity Company"
+
+
+def test_whatsapp_webhook_queue_full(client, mock_settings_class, mock_message_queue):
+    """Test that the webhook asks WhatsApp to retry when the queue is full."""
+    from app.services.message_queue import QueueFullError
+
+    mock_settings_class.whatsapp_business_account_id = "123456789"
+    mock_message_queue.submit.side_effect = QueueFullError("Message queue is full")
+    payload = {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "123456789",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messages": [
+                                {
+                                    "id": "message_id_123",
+                                    "from": "9876543210",
+                                    "type": "text",
+                                    "text": {"body": "Hi"},
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+    response = client.post("/webhook/whatsapp", json=payload)
+
+    assert response.status_code == 503